@@ -8,6 +8,7 @@ Joy IP 3D 图片生成系统 - 主应用
 import os
 import json
 import base64
+import hashlib
 import logging
 import re
 import threading
@@ -15,13 +16,14 @@ import time
 import uuid
 from typing import Dict
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from matchers.head_matcher import HeadMatcher
 from matchers.body_matcher import BodyMatcher
 from content_agent import ContentAgent
-from generation_controller import GenerationController
+from generation_controller import GenerationController, GATE_SKIP_ON_CIRCUIT_OPEN, GATE_UNAVAILABLE_ERROR
 from image_processor import ImageProcessor
 from config import get_config
 from utils.generation_log import log_generation
@@ -68,8 +70,8 @@ class WerkzeugFilter(logging.Filter):
     """过滤掉频繁的轮询请求日志"""
     def filter(self, record):
         msg = record.getMessage()
-        # 屏蔽 job status 轮询日志
-        if '/api/job/' in msg and '/status' in msg:
+        # 屏蔽 job status 轮询 / 长轮询 / SSE 日志
+        if '/api/job/' in msg and ('/status' in msg or '/poll' in msg or '/events' in msg):
             return False
         return True
 
@@ -88,6 +90,16 @@ else:
     app = Flask(__name__)
     logger.info("前后端分离模式")
 
+# 反向代理后按 X-Forwarded-For 识别客户端 IP（只信任配置的代理层数）
+if config.TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXY_COUNT)
+    logger.info(f"信任 {config.TRUSTED_PROXY_COUNT} 层反向代理的 X-Forwarded-For")
+
+# 按 API Token 区分租户的已登记 Token（摘要）
+_TENANT_TOKEN_DIGESTS = {
+    hashlib.sha256(t.encode('utf-8')).hexdigest()[:16] for t in config.TENANT_API_TOKENS
+}
+
 # 配置CORS
 if config.CORS_ENABLED:
     CORS(app, origins=config.CORS_ORIGINS)
@@ -201,20 +213,59 @@ def sanitize_analysis_result(analysis: Dict) -> Dict:
 # =========================
 # 使用 JobManager 管理任务（带队列控制和 TTL 自动清理）
 # =========================
-from utils.job_manager import job_manager
+from utils.job_manager import job_manager, LANE_INTERACTIVE
 from utils.resource_manager import resources
+from utils.worker_pool import get_worker_pool, is_worker_process
+from utils.stage_scheduler import (
+    stage_scheduler, STAGE_ANALYZE, STAGE_COMPOSE, STAGE_GENERATE, STAGE_GATE
+)
+from utils.llm_gateway import llm_gateway
+from utils.llm_cache import llm_cache
+from utils.cancellation import JobCancelledError, DeadlineExceededError, JOB_DEADLINE_SECONDS
+from utils.deadline import latency_tracker
+from utils.image_codec import image_codec
+from utils.analysis_fanout import AnalysisFanout
+from utils.circuit_breaker import circuit_breakers
+from utils.clip_cache import prebuild_3d_head_cache
 
 # 保留旧接口的兼容性
 jobs = {}  # 已废弃，使用 job_manager
 jobs_lock = threading.Lock()  # 已废弃
 
-def _init_job(requirement: str) -> str:
+def _init_job(requirement: str, tenant: str = "", lane: str = LANE_INTERACTIVE) -> str:
     """创建新任务（使用 JobManager）"""
-    return job_manager.create_job(requirement)
+    return job_manager.create_job(requirement, tenant=tenant, lane=lane)
 
-def _submit_job(job_id: str, requirement: str) -> dict:
-    """提交任务到执行队列"""
-    return job_manager.submit_job(job_id, lambda jid, req: _run_generation_job(jid, req))
+def _get_request_tenant() -> str:
+    """
+    获取请求的租户标识（用于公平排队与租户并发上限）
+    已登记的 API Token（TENANT_API_TOKENS，仅保存摘要）按 Token 计租户，否则按客户端 IP；
+    客户端 IP 取连接地址，配置 TRUSTED_PROXY_COUNT 时由 ProxyFix 按可信代理层数改写，
+    客户端无法通过伪造请求头获得新的租户
+    """
+    token = request.headers.get('X-API-Token', '')
+    auth = request.headers.get('Authorization', '')
+    if not token and auth.lower().startswith('bearer '):
+        token = auth[7:]
+    token = token.strip()
+    if token:
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+        if digest in _TENANT_TOKEN_DIGESTS:
+            return f"token:{digest}"
+
+    return f"ip:{request.remote_addr or 'unknown'}"
+
+def _submit_job(job_id: str, requirement: str, coalesce: bool = True) -> dict:
+    """提交任务到执行队列（默认与执行中的相同请求合并）"""
+    return job_manager.submit_job(job_id, _job_handler, coalesce=coalesce)
+
+def _job_handler(job_id: str, requirement: str):
+    """任务执行入口：process 模式下交给工作进程池执行，否则在当前线程执行"""
+    pool = get_worker_pool()
+    if pool is not None:
+        pool.run(_run_generation_job, job_id, requirement)
+    else:
+        _run_generation_job(job_id, requirement)
 
 def _update_job(job_id: str, **fields):
     """更新任务状态（使用 JobManager）"""
@@ -226,7 +277,13 @@ def _append_log(job_id: str, text: str):
 
 def _run_generation_job(job_id: str, requirement: str):
     """在后台线程中执行完整生成流程，并持续更新任务状态"""
+    # 取消令牌：用户取消后在各阶段检查点停止，不再发起新的远程调用
+    cancel_token = job_manager.get_cancel_token(job_id)
+    # 任务截止时间：随令牌传给下游调用，超时后停止并标记失败
+    if JOB_DEADLINE_SECONDS > 0:
+        cancel_token.set_deadline(time.time() + JOB_DEADLINE_SECONDS)
     try:
+        cancel_token.raise_if_cancelled()
         _update_job(job_id, status='running', stage='analyze', progress=5)
         _append_log(job_id, f"收到生成请求: {requirement}")
 
@@ -248,7 +305,8 @@ def _run_generation_job(job_id: str, requirement: str):
             
             # 调用2D完整生成流程（传入预分析结果）
             result = controller_2d.generate_complete_flow(
-                requirement, perspective, output_dir="output", pre_analysis=pre_analysis
+                requirement, perspective, output_dir="output", pre_analysis=pre_analysis,
+                job_id=job_id, cancel_token=cancel_token
             )
             
             if result.get('success') and result.get('images'):
@@ -270,6 +328,15 @@ def _run_generation_job(job_id: str, requirement: str):
                     'perspective': perspective
                 })
                 return
+            elif result.get('gate_unavailable'):
+                _update_job(job_id, status='failed', stage='gate', error=result['error'], details={
+                    'generated_count': result.get('generated_count', 0),
+                    'passed_count': 0,
+                    'reason': 'Gate 接口熔断中，图片未经质量检查',
+                    'retryable': True,
+                    'mode': '2D'
+                })
+                return
             else:
                 error_msg = result.get('error', '2D生成失败')
                 _update_job(job_id, status='failed', stage='generate', error=error_msg)
@@ -285,52 +352,71 @@ def _run_generation_job(job_id: str, requirement: str):
         local_controller = resources.get_generation_controller()
         local_processor = resources.get_image_processor()
 
-        if pre_analysis:
-            # 使用预分析结果，跳过分析步骤
-            _append_log(job_id, "使用用户确认的预分析结果")
-            logger.info(f"[Job {job_id}] 使用预分析结果: {pre_analysis}")
-            
-            # 仍需进行合规检查
-            is_compliant, reason = local_agent.check_compliance(requirement)
-            if not is_compliant:
-                _update_job(job_id, status='failed', stage='analyze', error=f"内容不合规: {reason}")
-                return
+        # 分析阶段互不依赖的 LLM 调用同时发出，结果在本任务内复用（图片组合时不再重复分析）
+        fanout = AnalysisFanout(job_id, cancel_token)
+        with stage_scheduler.stage(STAGE_ANALYZE, job_id, cancel_token):
+            if pre_analysis:
+                fanout.start('compliance', local_agent.check_compliance, requirement)
+            else:
+                fanout.start('content', local_agent.process_content, requirement)
+            fanout.start('expression', local_head.analyze_user_requirement, requirement)
+            # 动作分类投机执行：内容分析已给出动作时，结果只用于基础图片选择
+            fanout.start('action', local_body.classify_action_type, requirement)
+
+            if pre_analysis:
+                # 使用预分析结果，跳过分析步骤
+                _append_log(job_id, "使用用户确认的预分析结果")
+                logger.info(f"[Job {job_id}] 使用预分析结果: {pre_analysis}")
+                
+                # 仍需进行合规检查
+                is_compliant, reason = fanout.result('compliance')
+                if not is_compliant:
+                    fanout.cancel()
+                    _update_job(job_id, status='failed', stage='analyze', error=f"内容不合规: {reason}")
+                    return
+                
+                analysis = pre_analysis.copy()
+                # 确保所有字段存在
+                for key in ['表情', '动作', '上装', '下装', '头戴', '手持']:
+                    if key not in analysis:
+                        analysis[key] = ''
+            else:
+                # 步骤1: 合规检查和内容分析
+                agent_result = fanout.result('content')
+                if not agent_result['compliant']:
+                    fanout.cancel()
+                    _update_job(job_id, status='failed', stage='analyze', error=f"内容不合规: {agent_result['reason']}")
+                    return
+
+                analysis = agent_result['analysis']
             
-            analysis = pre_analysis.copy()
-            # 确保所有字段存在
-            for key in ['表情', '动作', '上装', '下装', '头戴', '手持']:
-                if key not in analysis:
-                    analysis[key] = ''
-        else:
-            # 步骤1: 合规检查和内容分析
-            agent_result = local_agent.process_content(requirement)
-            if not agent_result['compliant']:
-                _update_job(job_id, status='failed', stage='analyze', error=f"内容不合规: {agent_result['reason']}")
-                return
+            # 使用统一的清洗函数处理分析结果
+            analysis = sanitize_analysis_result(analysis)
+            _update_job(job_id, analysis=analysis, progress=15)
 
-            analysis = agent_result['analysis']
-        
-        # 使用统一的清洗函数处理分析结果
-        analysis = sanitize_analysis_result(analysis)
-        _update_job(job_id, analysis=analysis, progress=15)
-
-        # 步骤2: 表情与动作分析
-        _update_job(job_id, stage='match', progress=25)
-        expression_info = local_head.analyze_user_requirement(requirement)
-        
-        # 如果预分析中有动作，使用预分析的动作；否则重新分析
-        if not analysis.get('动作'):
-            action_type = local_body.classify_action_type(requirement)
-            analysis['动作'] = action_type
-        else:
-            action_type = analysis['动作']
+            # 步骤2: 表情与动作分析
+            _update_job(job_id, stage='match', progress=25)
+            expression_info = fanout.result('expression')
+            
+            # 如果预分析中有动作，使用预分析的动作；否则使用动作分类结果
+            if not analysis.get('动作'):
+                action_type = fanout.result('action')
+                analysis['动作'] = action_type
+            else:
+                action_type = analysis['动作']
             
         _append_log(job_id, f"表情分析: {expression_info}")
         _append_log(job_id, f"动作类型: {action_type}")
 
         # 步骤3: 选择与组合基础图片
         _update_job(job_id, stage='compose', progress=35)
-        processor_result = local_processor.process_user_requirement(requirement, log_callback=lambda t: _append_log(job_id, t))
+        # 先取得动作分类结果（可能仍在进行中）再占用合成阶段名额
+        classified_action = fanout.result('action')
+        with stage_scheduler.stage(STAGE_COMPOSE, job_id, cancel_token):
+            processor_result = local_processor.process_user_requirement(
+                requirement, log_callback=lambda t: _append_log(job_id, t),
+                action_type=classified_action, requirement_features=expression_info
+            )
         if not processor_result['success']:
             _update_job(job_id, status='failed', stage='compose', error=processor_result.get('error', '图片处理失败'), details={
                 'action_type': processor_result.get('action_type'),
@@ -379,7 +465,10 @@ def _run_generation_job(job_id: str, requirement: str):
         if accessories_info:
             _append_log(job_id, f"开始统一配件处理: {list(accessories_info.keys())}")
             logger.debug(f"[统一配件处理] 开始处理配件: {accessories_info}")
-            final_images = local_controller.process_accessories_unified(final_images, accessories_info)
+            with stage_scheduler.stage(STAGE_GENERATE, job_id, cancel_token):
+                final_images = local_controller.process_accessories_unified(
+                    final_images, accessories_info, cancel_token=cancel_token
+                )
             logger.debug(f"[统一配件处理] 处理完成，图片数: {len(final_images)}")
             _update_job(job_id, progress=80)
             
@@ -392,7 +481,21 @@ def _run_generation_job(job_id: str, requirement: str):
         
         # 最终 Gate 检查
         logger.debug(f"[配饰处理] 开始最终 Gate 检查，待检查图片数: {len(final_images)}")
-        final_images = local_controller.final_gate_check(final_images)
+        _update_job(job_id, stage='gate')
+        if final_images and local_controller.gate_circuit_open():
+            if not GATE_SKIP_ON_CIRCUIT_OPEN:
+                # 图片已生成，只是无法检查：明确报告 Gate 不可用（可重试），而不是按图片缺失失败
+                _append_log(job_id, "Gate 接口熔断中，图片未经检查不展示")
+                _update_job(job_id, status='failed', error=GATE_UNAVAILABLE_ERROR, details={
+                    'generated_count': len(final_images),
+                    'passed_count': 0,
+                    'reason': 'Gate 接口熔断中，图片未经质量检查',
+                    'retryable': True
+                })
+                return
+            _append_log(job_id, "Gate 接口熔断中，跳过质量检查")
+        with stage_scheduler.stage(STAGE_GATE, job_id, cancel_token):
+            final_images = local_controller.final_gate_check(final_images, cancel_token=cancel_token)
         logger.debug(f"[配饰处理] Gate 检查完成，通过图片数: {len(final_images)}")
 
         # 步骤10: 验证图片并转为URL
@@ -424,12 +527,35 @@ def _run_generation_job(job_id: str, requirement: str):
             'passed_count': len(validated_images)
         })
 
+    except DeadlineExceededError:
+        logger.warning(f"[Job {job_id}] 任务超过截止时间（{JOB_DEADLINE_SECONDS:.0f}秒），停止执行")
+        _update_job(job_id, status='failed', error=f'任务超时：超过 {JOB_DEADLINE_SECONDS:.0f} 秒未完成')
+    except JobCancelledError:
+        logger.info(f"[Job {job_id}] 任务已取消，停止执行")
     except Exception as e:
         import traceback
         traceback.print_exc()
         _update_job(job_id, status='failed', error=f'服务器错误: {str(e)}')
 
 
+# 重启恢复：将上次退出前未完成的任务重新入队
+try:
+    job_manager.resume_pending_jobs(_job_handler)
+except Exception as e:
+    logger.error(f"恢复未完成任务失败: {e}")
+
+# 多进程执行模式：启动时预热工作进程（预加载 CLIP 与素材缓存）
+if get_worker_pool() is not None:
+    try:
+        get_worker_pool().warm_up()
+    except Exception as e:
+        logger.error(f"工作进程预热失败: {e}")
+elif not is_worker_process():
+    # 线程模式：后台预构建 3D 头像向量缓存（缓存已存在时只做校验）；
+    # 工作进程 spawn 时也会导入本模块，其预加载由 warm_up 负责，不在这里重复构建
+    threading.Thread(target=prebuild_3d_head_cache, daemon=True, name="CLIP-HeadIndex").start()
+
+
 # 配置output文件夹为静态目录
 @app.route('/output/<path:filename>')
 def serve_output_file(filename):
@@ -456,6 +582,8 @@ def start_generate():
             - 下装: 下半身服装
             - 头戴: 头部配饰
             - 手持: 手持物品
+        lane: (可选) 优先级通道，interactive（默认）或 batch
+        fresh: (可选) 为 true 时不与执行中的相同请求合并，重新生成新的结果
     """
     logger.info("=== 收到 start_generate 请求 ===")
     logger.info(f"请求来源: {request.remote_addr}")
@@ -478,8 +606,10 @@ def start_generate():
             logger.warning("请求参数为空，返回400错误")
             return jsonify({'success': False, 'error': '请输入需求描述'}), 400
 
-        # 创建任务
-        job_id = _init_job(requirement)
+        # 创建任务（按租户公平排队）
+        lane = data.get('lane', LANE_INTERACTIVE)
+        tenant = _get_request_tenant()
+        job_id = _init_job(requirement, tenant=tenant, lane=lane)
         logger.info(f"✓ 任务创建成功: job_id={job_id}")
         
         # 存储模式和视角信息到任务中
@@ -490,13 +620,19 @@ def start_generate():
             _update_job(job_id, pre_analysis=pre_analysis)
         
         # 提交到执行队列
-        submit_result = _submit_job(job_id, requirement)
+        fresh = str(data.get('fresh', '')).lower() in ('1', 'true', 'yes')
+        submit_result = _submit_job(job_id, requirement, coalesce=not fresh)
         if not submit_result.get('success'):
             logger.warning(f"任务提交失败: {submit_result.get('error')}")
-            return jsonify({
+            retry_after = submit_result.get('retry_after')
+            response = jsonify({
                 'success': False, 
-                'error': submit_result.get('error', '队列已满')
-            }), 503
+                'error': submit_result.get('error', '队列已满'),
+                'retry_after': retry_after
+            })
+            if retry_after:
+                response.headers['Retry-After'] = str(retry_after)
+            return response, 503
         
         # 获取队列统计
         queue_stats = job_manager.get_queue_stats()
@@ -506,6 +642,7 @@ def start_generate():
             'job_id': job_id,
             'queue_position': submit_result.get('queue_position', 0),
             'estimated_wait': submit_result.get('estimated_wait', 0),
+            'coalesced_with': submit_result.get('coalesced_with'),
             'queue_stats': queue_stats
         }
         logger.info(f"✓ 任务已提交: job_id={job_id}, 队列位置={submit_result.get('queue_position')}, 预估等待={submit_result.get('estimated_wait')}秒")
@@ -518,8 +655,13 @@ def start_generate():
 
 @app.route('/api/queue/stats', methods=['GET'])
 def queue_stats():
-    """获取队列统计信息"""
+    """获取队列统计信息（含各阶段并发与排队深度、各模型 LLM 调用统计、图片生成延迟与对冲统计）"""
     stats = job_manager.get_queue_stats()
+    stats['stages'] = stage_scheduler.get_stats()
+    stats['llm'] = llm_gateway.get_stats()
+    stats['llm_cache'] = llm_cache.get_stats()
+    stats['upstream_latency'] = latency_tracker.get_stats()
+    stats['image_codec'] = image_codec.get_stats()
     return jsonify({
         'success': True,
         'stats': stats
@@ -528,19 +670,26 @@ def queue_stats():
 
 @app.route('/api/job/<job_id>/cancel', methods=['POST'])
 def cancel_job(job_id: str):
-    """取消排队中的任务"""
+    """取消任务（排队中的任务直接移出队列，执行中的任务在下一个检查点停止）"""
     success = job_manager.cancel_job(job_id)
     if success:
         return jsonify({'success': True, 'message': '任务已取消'})
     else:
-        return jsonify({'success': False, 'error': '无法取消该任务（可能已在执行中）'}), 400
+        return jsonify({'success': False, 'error': '无法取消该任务（任务不存在或已结束）'}), 400
 
 
 @app.route('/api/job/<job_id>/status', methods=['GET'])
 def job_status(job_id: str):
-    """查询任务状态（使用 JobManager）"""
+    """
+    查询任务状态（使用 JobManager）
+
+    请求参数:
+        since: (可选) 日志游标，即上次响应中的 job.log_cursor；
+               传入时 job.logs 只包含该游标之后的新日志，不传则不返回日志
+    """
     logger.debug(f"查询任务状态: job_id={job_id}")
-    job_dict = job_manager.get_job_dict(job_id)
+    log_since = request.args.get('since', type=int)
+    job_dict = job_manager.get_job_dict(job_id, log_since=log_since)
     if not job_dict:
         logger.warning(f"任务不存在: job_id={job_id}")
         return jsonify({'success': False, 'error': '任务不存在'}), 404
@@ -554,6 +703,70 @@ def job_status(job_id: str):
     return jsonify(status_data)
 
 
+# 长轮询最长挂起时间与 SSE 心跳间隔（秒）
+JOB_POLL_MAX_TIMEOUT = float(os.environ.get('JOB_POLL_MAX_TIMEOUT', '30'))
+JOB_SSE_HEARTBEAT = float(os.environ.get('JOB_SSE_HEARTBEAT', '15'))
+
+
+def _parse_cursor(value) -> float:
+    """解析 updated_at 游标（非法值按 0 处理，即返回完整快照）"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@app.route('/api/job/<job_id>/poll', methods=['GET'])
+def job_poll(job_id: str):
+    """
+    长轮询任务状态：没有新变更时挂起，直到任务更新或超时
+
+    请求参数:
+        updated_at: 上次响应中的 updated_at 游标（不传则返回完整快照）
+        timeout: 最长挂起时间（秒），默认 25，上限 JOB_POLL_MAX_TIMEOUT
+    """
+    since = _parse_cursor(request.args.get('updated_at'))
+    timeout = min(_parse_cursor(request.args.get('timeout', 25)), JOB_POLL_MAX_TIMEOUT)
+    result = job_manager.get_job_changes(job_id, since=since, timeout=timeout)
+    if result is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job_id': job_id, **result})
+
+
+@app.route('/api/job/<job_id>/events', methods=['GET'])
+def job_events(job_id: str):
+    """
+    SSE 推送任务进度：首条为完整快照，之后只推送变化的字段与新增日志
+    断线重连时浏览器会携带 Last-Event-ID（即 updated_at 游标），从断点继续推送
+    """
+    since = _parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('updated_at'))
+    if job_manager.get_job(job_id) is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+
+    def _stream(cursor: float):
+        while True:
+            result = job_manager.get_job_changes(job_id, since=cursor, timeout=JOB_SSE_HEARTBEAT)
+            if result is None:
+                yield "event: error\ndata: {\"error\": \"任务不存在\"}\n\n"
+                return
+            if result['updated_at'] > cursor or result['full']:
+                cursor = result['updated_at']
+                payload = json.dumps(result, ensure_ascii=False)
+                yield f"id: {cursor}\nevent: update\ndata: {payload}\n\n"
+            else:
+                # 心跳，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+            if result['finished']:
+                yield "event: done\ndata: {}\n\n"
+                return
+
+    return Response(
+        stream_with_context(_stream(since)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/generate', methods=['POST'])
 def generate():
     """
@@ -579,11 +792,16 @@ def generate():
         logger.info(f"收到生成请求: {requirement}")
         
         
-        # 步骤1: 合规检查和内容分析
+        # 步骤1: 合规检查和内容分析（表情分析与动作分类同时发出）
         logger.info("步骤1: 合规检查和内容分析...")
-        agent_result = content_agent.process_content(requirement)
+        fanout = AnalysisFanout()
+        fanout.start('content', content_agent.process_content, requirement)
+        fanout.start('expression', head_matcher.analyze_user_requirement, requirement)
+        fanout.start('action', body_matcher.classify_action_type, requirement)
+        agent_result = fanout.result('content')
         
         if not agent_result['compliant']:
+            fanout.cancel()
             return jsonify({
                 'success': False,
                 'error': f"内容不合规: {agent_result['reason']}"
@@ -598,18 +816,20 @@ def generate():
         logger.info("步骤2: 分析表情和动作...")
         
         # 获取表情信息
-        expression_info = head_matcher.analyze_user_requirement(requirement)
+        expression_info = fanout.result('expression')
         logger.debug(f"表情分析: {expression_info}")
         
         # 获取动作类型
-        action_type = body_matcher.classify_action_type(requirement)
+        action_type = fanout.result('action')
         logger.debug(f"动作类型: {action_type}")
         analysis['动作'] = action_type
         
         # 步骤3: 使用image_processor选择和组合图片
         logger.info("步骤3: 选择和组合图片...")
         try:
-            processor_result = image_processor.process_user_requirement(requirement)
+            processor_result = image_processor.process_user_requirement(
+                requirement, action_type=action_type, requirement_features=expression_info
+            )
         except TypeError:
             processor_result = image_processor.process_user_requirement(requirement, log_callback=None)
         
@@ -758,7 +978,8 @@ def health_check():
     """健康检查"""
     return jsonify({
         'status': 'healthy',
-        'service': 'Joy IP 3D Generation System'
+        'service': 'Joy IP 3D Generation System',
+        'circuit_breakers': circuit_breakers.get_stats()
     })
 
 
@@ -1832,6 +2053,8 @@ if __name__ == '__main__':
     logger.info("API端点:")
     logger.info("  - POST /api/start_generate  - 启动生成任务")
     logger.info("  - GET  /api/job/<id>/status - 查询任务状态")
+    logger.info("  - GET  /api/job/<id>/poll   - 长轮询任务变更")
+    logger.info("  - GET  /api/job/<id>/events - SSE 推送任务进度")
     logger.info("  - POST /api/generate        - 同步生成图片")
     logger.info("  - POST /api/analyze         - 分析内容")
     logger.info("  - GET  /api/health          - 健康检查")
@@ -1,22 +1,29 @@
 import requests
 import json
-import base64
 import time
 from pathlib import Path
 # 导入2D/3D统一接口
 from prompt_templates_2d import get_system_prompt, get_accessory_instruction, get_constraints
 
-# 尝试导入带重试机制的http_client
-try:
-    from utils.http_client import http_post
-    USE_HTTP_CLIENT = True
-except ImportError:
-    USE_HTTP_CLIENT = False
+# 出站请求统一经共享 HTTP 客户端（连接复用、熔断、下游健康度统计），
+# 以及截止时间预算、对冲请求与共享图片编解码器
+from utils.http_client import http_post, api_headers
+from utils.deadline import remaining_timeout, retry_allowed, hedge_delay, hedged_call, latency_tracker
+from utils.image_codec import image_codec, PROFILE_GENERATION
+from utils.circuit_breaker import CircuitOpenError
+from utils.cancellation import DeadlineExceededError
 
 # API 地址与鉴权
 URL = "https://modelservice.jdcloud.com/v1/images/gemini_flash/generations"
 API_KEY = "pk-a3b4d157-e765-45b9-988a-b8b2a6d7c8bf"
 
+# 单次生成请求超时（秒），有任务截止时间时不超过剩余时间
+REQUEST_TIMEOUT = 120
+# 需要重试的状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 延迟统计与对冲请求使用的接口标识
+LATENCY_KEY = "banana-pro-img-jd"
+
 # 在此配置本地图片路径（作为默认值，可被命令行参数覆盖）
 IMG1_PATH = r"C:\Users\heyunshen\Downloads\badcase\generated_1763630969.png"
 IMG2_PATH = None  # 可选第二张图片，默认不使用
@@ -28,21 +35,10 @@ PROMPT_TEXT = (
     "严格保持图片1中角色的动作、表情一致性，进行品牌风格优化"
 )
 
-def detect_mime_type(path: str) -> str:
-    lower = str(path).lower()
-    if lower.endswith(".jpg") or lower.endswith(".jpeg"):
-        return "image/jpeg"
-    if lower.endswith(".webp"):
-        return "image/webp"
-    if lower.endswith(".bmp"):
-        return "image/bmp"
-    return "image/png"
-
-
-def encode_image_to_base64(image_path: str) -> str | None:
+def encode_image_with_mime(image_path: str) -> tuple[str, str] | None:
+    """编码图片为 (base64, MIME)；按生成输入的配置缩放/转码并按文件缓存"""
     try:
-        with open(image_path, "rb") as f:
-            return base64.b64encode(f.read()).decode("utf-8")
+        return image_codec.encode(image_path, profile=PROFILE_GENERATION)
     except FileNotFoundError:
         print(f"错误：找不到图片文件 -> {image_path}")
         return None
@@ -51,12 +47,15 @@ def encode_image_to_base64(image_path: str) -> str | None:
         return None
 
 
+def encode_image_to_base64(image_path: str) -> str | None:
+    encoded = encode_image_with_mime(image_path)
+    return encoded[0] if encoded else None
+
+
 def base64_to_image(base64_string: str, save_path: Path) -> Path | None:
     try:
-        img_bytes = base64.b64decode(base64_string)
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(save_path, "wb") as f:
-            f.write(img_bytes)
+        # 分块解码直接写入磁盘
+        image_codec.decode_to_file(base64_string, str(save_path))
         return save_path
     except Exception as e:
         print(f"错误：解码或保存图片失败 -> {e}")
@@ -64,13 +63,13 @@ def base64_to_image(base64_string: str, save_path: Path) -> Path | None:
 
 
 def build_payload_two_images(prompt: str, img1_path: str, img2_path: str) -> dict | None:
-    b64_img1 = encode_image_to_base64(img1_path)
-    b64_img2 = encode_image_to_base64(img2_path)
-    if not b64_img1 or not b64_img2:
+    encoded1 = encode_image_with_mime(img1_path)
+    encoded2 = encode_image_with_mime(img2_path)
+    if not encoded1 or not encoded2:
         return None
 
-    mime1 = detect_mime_type(img1_path)
-    mime2 = detect_mime_type(img2_path)
+    b64_img1, mime1 = encoded1
+    b64_img2, mime2 = encoded2
 
     parts = [
         {"text": prompt},
@@ -97,11 +96,11 @@ def build_payload_two_images(prompt: str, img1_path: str, img2_path: str) -> dic
     return payload
 
 def build_payload_one_image(prompt: str, img1_path: str) -> dict | None:
-    b64_img1 = encode_image_to_base64(img1_path)
-    if not b64_img1:
+    encoded1 = encode_image_with_mime(img1_path)
+    if not encoded1:
         return None
 
-    mime1 = detect_mime_type(img1_path)
+    b64_img1, mime1 = encoded1
     parts = [
         {"text": prompt},
         {"inlineData": {"mimeType": mime1, "data": b64_img1}},
@@ -141,7 +140,8 @@ def extract_generated_image_base64(resp_json: dict) -> str | None:
     return None
 
 
-def generate_image_with_accessories(image_path, accessories_info, style="default", mode="3d"):
+def generate_image_with_accessories(image_path, accessories_info, style="default", mode="3d", deadline=None,
+                                    cancel_token=None):
     """
     统一的配件生成接口，兼容原有的三个模块接口
     
@@ -150,6 +150,8 @@ def generate_image_with_accessories(image_path, accessories_info, style="default
         accessories_info: 配件信息（可以是服装、手拿、头戴的组合描述）
         style: prompt风格 ("default", "professional", "simple")
         mode: 模式 ("2d" 或 "3d")，决定使用哪套模板
+        deadline: 任务截止时间（time.time() 时间戳，可选），请求超时与重试不超过截止时间
+        cancel_token: 任务取消令牌（可选），取消后不再发起重试
         
     Returns:
         str: 生成的图片路径（格式：/output/xxx.png）或原图片路径（跳过时）
@@ -173,7 +175,7 @@ def generate_image_with_accessories(image_path, accessories_info, style="default
     print("=" * 50)
     
     # 执行图片生成
-    result_path = _generate_single_image(image_path, prompt)
+    result_path = _generate_single_image(image_path, prompt, deadline=deadline, cancel_token=cancel_token)
     return result_path if result_path else image_path
 
 def _detect_scene_style(accessories_info: str) -> str:
@@ -338,47 +340,78 @@ def _parse_accessories_info(accessories_info: str) -> dict:
 
 
 
-def _generate_single_image(image_path: str, prompt: str) -> str:
+def _send_generation_request(payload: dict, headers: dict, timeout: float, deadline=None):
+    """发送生成请求（开启对冲时，超过历史 p95 延迟未返回则再发一个相同请求）"""
+    def _send():
+        start = time.time()
+        # 重试由 _generate_single_image 按截止时间控制，底层客户端不再单独重试
+        response = http_post(URL, json=payload, headers=headers, timeout=timeout, max_retries=0)
+        if response.status_code == 200:
+            latency_tracker.observe(LATENCY_KEY, time.time() - start)
+        return response
+
+    delay = hedge_delay(LATENCY_KEY)
+    if delay is None:
+        return _send()
+    return hedged_call(LATENCY_KEY, _send, delay, lambda r: r.status_code == 200, deadline=deadline)
+
+
+def _generate_single_image(image_path: str, prompt: str, deadline=None, cancel_token=None) -> str:
     """
     生成单张图片的核心逻辑
-    支持429错误重试
+    支持429/5xx错误重试；传入截止时间时单次超时不超过剩余时间，
+    退避后剩余时间不够一次请求则不再重试；传入取消令牌时每次请求前与退避期间检查，已取消则放弃
     """
     payload = build_payload_one_image(prompt, image_path)
     if payload is None:
         print("构建请求失败：请检查本地图片路径是否正确，以及文件是否可读。")
         return None
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Connection": "keep-alive",
-        "Content-Type": "application/json",
-        "Trace-Id": "banana-pro-img-jd-unified",
-    }
+    headers = api_headers(API_KEY, trace_id="banana-pro-img-jd-unified")
 
     max_retries = 3
     retry_delay = 2  # 初始重试延迟（秒）
 
+    def _can_retry(attempt: int, wait_time: float) -> bool:
+        if attempt >= max_retries - 1:
+            return False
+        return retry_allowed(deadline, wait_time)
+
+    def _cancelled() -> bool:
+        if cancel_token is not None and cancel_token.cancelled:
+            print("任务已取消，停止生成")
+            return True
+        return False
+
+    def _backoff(wait_time: float) -> bool:
+        """退避等待，期间任务被取消时返回 False"""
+        if cancel_token is None:
+            time.sleep(wait_time)
+            return True
+        cancel_token.wait(wait_time)
+        return not _cancelled()
+
     for attempt in range(max_retries):
+        if _cancelled():
+            return None
         try:
             print(f"发送请求...{f' (重试 {attempt})' if attempt > 0 else ''}")
             
-            # 使用带重试机制的http_client（如果可用）
-            if USE_HTTP_CLIENT:
-                response = http_post(URL, json=payload, headers=headers, timeout=120)
-            else:
-                response = requests.post(URL, headers=headers, json=payload, timeout=120)
+            timeout = remaining_timeout(REQUEST_TIMEOUT, deadline)
+            response = _send_generation_request(payload, headers, timeout, deadline)
             
             print("HTTP", response.status_code)
 
-            # 处理429频率限制错误
-            if response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)  # 指数退避
-                    print(f"遇到频率限制(429)，等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
+            # 处理429频率限制与5xx错误
+            if response.status_code in RETRY_STATUS:
+                wait_time = retry_delay * (2 ** attempt)  # 指数退避
+                if _can_retry(attempt, wait_time):
+                    print(f"HTTP {response.status_code}，等待 {wait_time} 秒后重试...")
+                    if not _backoff(wait_time):
+                        return None
                     continue
                 else:
-                    print("频率限制(429)：已达最大重试次数")
+                    print(f"HTTP {response.status_code}：已达最大重试次数或剩余时间不足")
                     return None
 
             # 优先解析为 JSON，提取 base64 图片
@@ -412,14 +445,22 @@ def _generate_single_image(image_path: str, prompt: str) -> str:
                 print("保存图片失败。")
                 return None
 
+        except DeadlineExceededError:
+            # 任务超过截止时间：交给调用方终止任务，而不是当作普通生成失败沿用原图
+            raise
+        except CircuitOpenError as open_err:
+            # 生成接口熔断中：不重试，由调用方返回基础合成图
+            print(f"生成接口熔断中，跳过生成：{open_err}")
+            return None
         except requests.exceptions.RequestException as req_err:
             print(f"请求错误：{req_err}")
             if hasattr(req_err, "response") and req_err.response is not None:
                 print("错误响应：", req_err.response.text)
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)
+            wait_time = retry_delay * (2 ** attempt)
+            if _can_retry(attempt, wait_time):
                 print(f"等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
+                if not _backoff(wait_time):
+                    return None
             else:
                 return None
         except Exception as e:
@@ -453,16 +494,11 @@ def main():
         print("构建请求失败：请检查本地图片路径是否正确，以及文件是否可读。")
         return
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Connection": "keep-alive",
-        "Content-Type": "application/json",
-        "Trace-Id": "banana-pro-img-jd-local",
-    }
+    headers = api_headers(API_KEY, trace_id="banana-pro-img-jd-local")
 
     try:
         print("发送请求...")
-        response = requests.post(URL, headers=headers, json=payload, timeout=120)
+        response = http_post(URL, json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
         print("HTTP", response.status_code)
 
         # 优先解析为 JSON，提取 base64 图片
@@ -42,6 +42,9 @@ class Config:
     SECRET_KEY: str = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     HOST: str = os.environ.get('HOST', '0.0.0.0')
     PORT: int = int(os.environ.get('PORT', 28888))
+    # 前置反向代理层数：> 0 时按 X-Forwarded-For 最后 N 跳识别客户端 IP（werkzeug ProxyFix），
+    # 0 表示直接使用连接地址，不信任客户端提供的 X-Forwarded-For
+    TRUSTED_PROXY_COUNT: int = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
     
     # =========================
     # 文件路径配置
@@ -67,6 +70,12 @@ class Config:
         origins = os.environ.get('CORS_ORIGINS', '')
         return [o.strip() for o in origins.split(',') if o.strip()] if origins else []
     
+    @property
+    def TENANT_API_TOKENS(self) -> List[str]:
+        """按 API Token 区分租户的已登记 Token；未登记的 Token 按客户端 IP 计租户"""
+        tokens = os.environ.get('TENANT_API_TOKENS', '')
+        return [t.strip() for t in tokens.split(',') if t.strip()] if tokens else []
+    
     # =========================
     # 脚本执行配置
     # =========================
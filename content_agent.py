@@ -12,8 +12,9 @@ import re
 import logging
 from typing import Dict, List, Tuple
 from config import get_config
-# 使用优化后的 HTTP 客户端和违规词库
-from utils.http_client import http_post, http_get, parse_ai_response
+# 使用优化后的 HTTP 客户端、LLM 网关和违规词库
+from utils.http_client import http_get, parse_ai_response
+from utils.llm_gateway import llm_gateway
 from utils.banned_words import (
     check_banned_words, reload_banned_words,
     add_banned_word as add_word_to_cache,
@@ -128,7 +129,7 @@ class ContentAgent:
                 "Content-Type": "application/json"
             }
             
-            resp = http_post(self.api_url, json=payload, headers=headers, timeout=120)
+            resp = llm_gateway.post(payload["model"], self.api_url, json=payload, headers=headers, timeout=120)
             resp.raise_for_status()
             result = parse_ai_response(resp.json())
             
@@ -250,7 +251,7 @@ class ContentAgent:
                 "Content-Type": "application/json"
             }
             
-            resp = http_post(self.api_url, json=payload, headers=headers, timeout=120)
+            resp = llm_gateway.post(payload["model"], self.api_url, json=payload, headers=headers, timeout=120)
             resp.raise_for_status()
             ai_text = parse_ai_response(resp.json())
             
@@ -389,7 +390,7 @@ class ContentAgent:
                 "Content-Type": "application/json"
             }
             
-            resp = http_post(self.api_url, json=payload, headers=headers, timeout=120)
+            resp = llm_gateway.post(payload["model"], self.api_url, json=payload, headers=headers, timeout=120)
             resp.raise_for_status()
             ai_text = parse_ai_response(resp.json())
             
@@ -587,7 +588,7 @@ class ContentAgent:
             }
             
             logger.info(f"合并AI分析使用模型: {self.analysis_model}")
-            resp = http_post(self.api_url, json=payload, headers=headers, timeout=120)
+            resp = llm_gateway.post(payload["model"], self.api_url, json=payload, headers=headers, timeout=120)
             resp.raise_for_status()
             ai_text = parse_ai_response(resp.json())
             
@@ -34,6 +34,12 @@ if [[ -n $(git status -s) ]]; then
 fi
 echo -e "${GREEN}✓ Git状态正常${NC}"
 
+# 出站 HTTP 调用必须经过共享客户端（禁止直接 requests.post/get 等）
+if ! python3 utils/http_guard.py; then
+    echo -e "${RED}错误: 存在绕过共享 HTTP 客户端的调用${NC}"
+    exit 1
+fi
+
 # ==========================================
 # 2. 推送到GitHub
 # ==========================================
@@ -17,6 +17,9 @@ import re
 import logging
 
 from utils.module_loader import ModuleLoader
+from utils.cancellation import (
+    CancellationToken, DeadlineExceededError, as_completed_cancellable, cancellable_executor, check_cancelled
+)
 from content_agent import ContentAgent
 
 logger = logging.getLogger(__name__)
@@ -26,6 +29,10 @@ logger = logging.getLogger(__name__)
 # ==========================
 ENABLE_GATE_CHECK = str(os.environ.get("ENABLE_GATE_CHECK", "1")).strip().lower() in ("1", "true")
 GATE_CHECK_SCOPE = str(os.environ.get("GATE_CHECK_SCOPE", "hats")).strip().lower()
+# Gate 接口熔断中时：false（默认）不展示未检查的图片，true 跳过检查直接展示图片
+GATE_SKIP_ON_CIRCUIT_OPEN = str(os.environ.get("GATE_SKIP_ON_CIRCUIT_OPEN", "0")).strip().lower() in ("1", "true")
+# Gate 接口熔断且不跳过检查时任务的错误信息
+GATE_UNAVAILABLE_ERROR = "Gate 服务暂不可用，请稍后重试"
 
 # 并行处理配置
 # 优化：默认启用4个并行worker，可通过环境变量覆盖
@@ -212,7 +219,8 @@ class GenerationController:
         return True
     
     def process_accessories_unified(self, image_paths: List[str], analysis: Dict[str, str], 
-                                   output_dir: str = "output") -> List[str]:
+                                   output_dir: str = "output",
+                                   cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """
         统一处理配件（服装、手拿、头戴）
         
@@ -220,6 +228,7 @@ class GenerationController:
             image_paths: 输入图片路径列表
             analysis: 分析结果，包含服装、手拿、头戴等信息
             output_dir: 输出目录
+            cancel_token: 取消令牌（可选），取消后不再发起新的生成请求
             
         Returns:
             List[str]: 处理后的图片路径列表
@@ -251,11 +260,13 @@ class GenerationController:
             image_paths, 
             accessories_info, 
             self.banana_unified.generate_image_with_accessories,
-            "统一配件"
+            "统一配件",
+            cancel_token=cancel_token
         )
     
     def _process_accessory_parallel(self, image_paths: List[str], accessory_info: str,
-                                    process_func, accessory_type: str) -> List[str]:
+                                    process_func, accessory_type: str,
+                                    cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """
         并行处理配饰（通用方法）
         
@@ -264,13 +275,16 @@ class GenerationController:
             accessory_info: 配饰信息
             process_func: 处理函数
             accessory_type: 配饰类型名称（用于日志）
+            cancel_token: 取消令牌（可选），取消时丢弃未开始的子任务且不等待执行中的请求；
+                令牌与截止时间传给每次生成请求
             
         Returns:
             List[str]: 处理后的图片路径列表
         """
         if len(image_paths) <= 1:
             # 单张图片直接处理，不需要并行
-            return self._process_accessory_single(image_paths, accessory_info, process_func, accessory_type)
+            return self._process_accessory_single(image_paths, accessory_info, process_func, accessory_type,
+                                                  cancel_token=cancel_token)
         
         # 多张图片并行处理
         max_workers = min(MAX_PARALLEL_WORKERS, len(image_paths))
@@ -279,21 +293,23 @@ class GenerationController:
         # 保持原始顺序的结果字典
         results = {}
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with cancellable_executor(max_workers) as executor:
             # 提交所有任务
             future_to_idx = {
-                executor.submit(self._process_single_image, img_path, accessory_info, process_func): idx
+                executor.submit(self._process_single_image, img_path, accessory_info, process_func, cancel_token): idx
                 for idx, img_path in enumerate(image_paths)
             }
             
-            # 收集结果
-            for future in as_completed(future_to_idx):
+            # 收集结果（取消时丢弃未开始的子任务）
+            for future in as_completed_cancellable(future_to_idx, cancel_token):
                 idx = future_to_idx[future]
                 original_path = image_paths[idx]
                 try:
                     result = future.result(timeout=120)
                     results[idx] = result if result else original_path
                     logger.info(f"[{accessory_type}] 图片 {idx+1}/{len(image_paths)} 处理完成")
+                except DeadlineExceededError:
+                    raise
                 except Exception as e:
                     logger.warning(f"[{accessory_type}] 图片 {idx+1} 处理失败: {str(e)}")
                     results[idx] = original_path
@@ -302,25 +318,33 @@ class GenerationController:
         return [results[i] for i in range(len(image_paths))]
     
     def _process_accessory_single(self, image_paths: List[str], accessory_info: str,
-                                  process_func, accessory_type: str) -> List[str]:
+                                  process_func, accessory_type: str,
+                                  cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """串行处理配饰（单张或兜底）"""
         processed_images = []
         for image_path in image_paths:
-            result = self._process_single_image(image_path, accessory_info, process_func)
+            check_cancelled(cancel_token)
+            result = self._process_single_image(image_path, accessory_info, process_func, cancel_token)
             processed_images.append(result if result else image_path)
         return processed_images
     
     def _process_single_image(self, image_path: str, accessory_info: str, 
-                              process_func) -> Optional[str]:
-        """处理单张图片"""
+                              process_func, cancel_token: Optional[CancellationToken] = None) -> Optional[str]:
+        """处理单张图片（cancel_token 可选，令牌及其截止时间传给生成请求）"""
         try:
-            result_url = process_func(image_path, accessory_info)
+            if cancel_token is not None:
+                result_url = process_func(image_path, accessory_info, deadline=cancel_token.deadline,
+                                          cancel_token=cancel_token)
+            else:
+                result_url = process_func(image_path, accessory_info)
             if result_url:
                 # 转换URL为本地路径
                 if result_url.startswith('/'):
                     return result_url.lstrip('/')
                 return result_url
             return None
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.warning(f"处理图片时发生错误: {str(e)}")
             return None
@@ -564,12 +588,21 @@ class GenerationController:
 
         return images
     
-    def final_gate_check(self, image_paths: List[str]) -> List[str]:
+    def gate_circuit_open(self) -> bool:
+        """Gate 检查开启且 Gate 接口处于熔断中"""
+        gate = getattr(self, 'gate_check', None)
+        if not ENABLE_GATE_CHECK or GATE_CHECK_SCOPE == 'none' or not hasattr(gate, 'gate_circuit_open'):
+            return False
+        return gate.gate_circuit_open()
+
+    def final_gate_check(self, image_paths: List[str],
+                         cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """
         最终 Gate 检查：在图片展示到页面前进行统一质量检查（支持并行）
         
         Args:
             image_paths: 待检查的图片路径列表
+            cancel_token: 取消令牌（可选），取消后不再发起新的检查请求
             
         Returns:
             List[str]: 通过检查的图片路径列表
@@ -600,17 +633,26 @@ class GenerationController:
             _log("Gate 模块未提供 analyze_image_with_three_models，跳过检查")
             return image_paths
         
+        if self.gate_circuit_open():
+            if GATE_SKIP_ON_CIRCUIT_OPEN:
+                _log("Gate 接口熔断中，跳过检查")
+                return image_paths
+            _log("Gate 接口熔断中，不展示未检查的图片")
+            return []
+        
         # 单张图片直接检查，不需要并行
         if len(image_paths) == 1:
-            return self._gate_check_single(image_paths, _log)
+            return self._gate_check_single(image_paths, _log, cancel_token)
         
         # 多张图片并行检查
-        return self._gate_check_parallel(image_paths, _log)
+        return self._gate_check_parallel(image_paths, _log, cancel_token)
     
-    def _gate_check_single(self, image_paths: List[str], _log) -> List[str]:
+    def _gate_check_single(self, image_paths: List[str], _log,
+                           cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """串行 Gate 检查（单张图片）"""
         passed_images = []
         for i, image_path in enumerate(image_paths):
+            check_cancelled(cancel_token)
             _log(f"检查图片 [{i+1}/{len(image_paths)}]: {image_path}")
             try:
                 ok, analysis_results = self.gate_check.analyze_image_with_three_models(image_path)
@@ -630,7 +672,8 @@ class GenerationController:
         _log(f"检查完成: {len(passed_images)}/{len(image_paths)} 张图片通过")
         return passed_images
     
-    def _gate_check_parallel(self, image_paths: List[str], _log) -> List[str]:
+    def _gate_check_parallel(self, image_paths: List[str], _log,
+                             cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """并行 Gate 检查（多张图片）"""
         max_workers = min(MAX_PARALLEL_WORKERS, len(image_paths))
         _log(f"并行检查 {len(image_paths)} 张图片，workers={max_workers}")
@@ -638,15 +681,15 @@ class GenerationController:
         # 保持原始顺序的结果字典
         results = {}
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with cancellable_executor(max_workers) as executor:
             # 提交所有检查任务
             future_to_idx = {
                 executor.submit(self._check_single_image_gate, img_path): idx
                 for idx, img_path in enumerate(image_paths)
             }
             
-            # 收集结果
-            for future in as_completed(future_to_idx):
+            # 收集结果（取消时丢弃未开始的检查）
+            for future in as_completed_cancellable(future_to_idx, cancel_token):
                 idx = future_to_idx[future]
                 image_path = image_paths[idx]
                 try:
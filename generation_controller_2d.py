@@ -16,6 +16,13 @@ from datetime import datetime
 import logging
 
 from utils.module_loader import ModuleLoader
+from utils.cancellation import (
+    CancellationToken, JobCancelledError, DeadlineExceededError, as_completed_cancellable, cancellable_executor,
+    check_cancelled
+)
+from utils.stage_scheduler import (
+    stage_scheduler, STAGE_ANALYZE, STAGE_COMPOSE, STAGE_GENERATE, STAGE_GATE
+)
 from content_agent_2d import ContentAgent2D
 from matchers.head_matcher_2d import HeadMatcher2D
 from matchers.body_matcher_2d import BodyMatcher2D
@@ -25,6 +32,10 @@ logger = logging.getLogger(__name__)
 # Gate 检查开关与范围（复用3D配置）
 ENABLE_GATE_CHECK = str(os.environ.get("ENABLE_GATE_CHECK", "1")).strip().lower() in ("1", "true")
 GATE_CHECK_SCOPE = str(os.environ.get("GATE_CHECK_SCOPE", "hats")).strip().lower()
+# Gate 接口熔断中时：false（默认）不展示未检查的图片，true 跳过检查直接展示图片
+GATE_SKIP_ON_CIRCUIT_OPEN = str(os.environ.get("GATE_SKIP_ON_CIRCUIT_OPEN", "0")).strip().lower() in ("1", "true")
+# Gate 接口熔断且不跳过检查时任务的错误信息
+GATE_UNAVAILABLE_ERROR = "Gate 服务暂不可用，请稍后重试"
 
 # 并行处理配置
 MAX_PARALLEL_WORKERS = int(os.environ.get("MAX_PARALLEL_WORKERS", "2"))
@@ -205,7 +216,8 @@ class GenerationController2D:
         return True
     
     def process_accessories_unified(self, image_paths: List[str], analysis: Dict[str, str],
-                                     output_dir: str = "output") -> List[str]:
+                                     output_dir: str = "output",
+                                     cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """
         统一处理配件（服装、手拿、头戴）
         
@@ -213,6 +225,7 @@ class GenerationController2D:
             image_paths: 输入图片路径列表
             analysis: 分析结果
             output_dir: 输出目录
+            cancel_token: 取消令牌（可选）
             
         Returns:
             List[str]: 处理后的图片路径列表
@@ -255,33 +268,39 @@ class GenerationController2D:
             accessories_info,
             self.banana_unified.generate_image_with_accessories,
             "2D统一配件",
-            mode="2d"  # 2D模式
+            mode="2d",  # 2D模式
+            cancel_token=cancel_token
         )
     
     def _process_accessory_parallel(self, image_paths: List[str], accessory_info: str,
-                                     process_func, accessory_type: str, mode: str = "3d") -> List[str]:
+                                     process_func, accessory_type: str, mode: str = "3d",
+                                     cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """并行处理配饰（4路并发）"""
         if len(image_paths) <= 1:
-            return self._process_accessory_single(image_paths, accessory_info, process_func, accessory_type, mode)
+            return self._process_accessory_single(image_paths, accessory_info, process_func, accessory_type, mode,
+                                                  cancel_token=cancel_token)
         
         max_workers = min(MAX_PARALLEL_WORKERS_2D, len(image_paths))
         logger.info(f"[{accessory_type}] 并行处理 {len(image_paths)} 张图片，workers={max_workers}, mode={mode}")
         
         results = {}
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with cancellable_executor(max_workers) as executor:
             future_to_idx = {
-                executor.submit(self._process_single_image, img_path, accessory_info, process_func, mode): idx
+                executor.submit(self._process_single_image, img_path, accessory_info, process_func, mode,
+                                cancel_token): idx
                 for idx, img_path in enumerate(image_paths)
             }
             
-            for future in as_completed(future_to_idx):
+            for future in as_completed_cancellable(future_to_idx, cancel_token):
                 idx = future_to_idx[future]
                 original_path = image_paths[idx]
                 try:
                     result = future.result(timeout=120)
                     results[idx] = result if result else original_path
                     logger.info(f"[{accessory_type}] 图片 {idx+1}/{len(image_paths)} 处理完成")
+                except DeadlineExceededError:
+                    raise
                 except Exception as e:
                     logger.warning(f"[{accessory_type}] 图片 {idx+1} 处理失败: {str(e)}")
                     results[idx] = original_path
@@ -289,31 +308,39 @@ class GenerationController2D:
         return [results[i] for i in range(len(image_paths))]
     
     def _process_accessory_single(self, image_paths: List[str], accessory_info: str,
-                                   process_func, accessory_type: str, mode: str = "3d") -> List[str]:
+                                   process_func, accessory_type: str, mode: str = "3d",
+                                   cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """串行处理配饰"""
         processed_images = []
         for image_path in image_paths:
-            result = self._process_single_image(image_path, accessory_info, process_func, mode)
+            check_cancelled(cancel_token)
+            result = self._process_single_image(image_path, accessory_info, process_func, mode, cancel_token)
             processed_images.append(result if result else image_path)
         return processed_images
     
     def _process_single_image(self, image_path: str, accessory_info: str,
-                               process_func, mode: str = "3d") -> Optional[str]:
-        """处理单张图片"""
+                               process_func, mode: str = "3d",
+                               cancel_token: Optional[CancellationToken] = None) -> Optional[str]:
+        """处理单张图片（cancel_token 可选，令牌及其截止时间传给生成请求）"""
         try:
             # 传递mode参数
-            result_url = process_func(image_path, accessory_info, mode=mode)
+            deadline = cancel_token.deadline if cancel_token is not None else None
+            result_url = process_func(image_path, accessory_info, mode=mode, deadline=deadline,
+                                      cancel_token=cancel_token)
             if result_url:
                 if result_url.startswith('/'):
                     return result_url.lstrip('/')
                 return result_url
             return None
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.warning(f"处理图片时发生错误: {str(e)}")
             return None
     
     def process_background(self, image_paths: List[str], background_info: str,
-                            output_dir: str = "output") -> List[str]:
+                            output_dir: str = "output",
+                            cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """处理背景"""
         if not background_info:
             logger.info("跳过背景处理（无背景信息）")
@@ -328,6 +355,7 @@ class GenerationController2D:
         processed_images = []
         
         for image_path in image_paths:
+            check_cancelled(cancel_token)
             try:
                 result_url = self.banana_background.generate_image_with_accessories(
                     image_path, background_info
@@ -374,7 +402,15 @@ class GenerationController2D:
             logger.warning(f"合规检查失败: {str(e)}")
             return False
     
-    def final_gate_check(self, image_paths: List[str]) -> List[str]:
+    def gate_circuit_open(self) -> bool:
+        """Gate 检查开启且 Gate 接口处于熔断中"""
+        gate = getattr(self, 'gate_check', None)
+        if not ENABLE_GATE_CHECK or GATE_CHECK_SCOPE == 'none' or not hasattr(gate, 'gate_circuit_open'):
+            return False
+        return gate.gate_circuit_open()
+
+    def final_gate_check(self, image_paths: List[str],
+                         cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """最终Gate检查（4路并发）"""
         def _log(msg: str):
             logger.info(f"[FinalGate2D] {msg}")
@@ -397,17 +433,26 @@ class GenerationController2D:
             _log("Gate 模块未提供 analyze_image_with_three_models，跳过检查")
             return image_paths
         
+        if self.gate_circuit_open():
+            if GATE_SKIP_ON_CIRCUIT_OPEN:
+                _log("Gate 接口熔断中，跳过检查")
+                return image_paths
+            _log("Gate 接口熔断中，不展示未检查的图片")
+            return []
+        
         # 单张图片直接检查
         if len(image_paths) == 1:
-            return self._gate_check_single(image_paths, _log)
+            return self._gate_check_single(image_paths, _log, cancel_token)
         
         # 多张图片并行检查
-        return self._gate_check_parallel(image_paths, _log)
+        return self._gate_check_parallel(image_paths, _log, cancel_token)
     
-    def _gate_check_single(self, image_paths: List[str], _log) -> List[str]:
+    def _gate_check_single(self, image_paths: List[str], _log,
+                           cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """串行 Gate 检查（单张图片）"""
         passed_images = []
         for i, image_path in enumerate(image_paths):
+            check_cancelled(cancel_token)
             _log(f"检查图片 [{i+1}/{len(image_paths)}]: {image_path}")
             try:
                 ok, analysis_results = self.gate_check.analyze_image_with_three_models(image_path)
@@ -422,20 +467,21 @@ class GenerationController2D:
         _log(f"检查完成: {len(passed_images)}/{len(image_paths)} 张图片通过")
         return passed_images
     
-    def _gate_check_parallel(self, image_paths: List[str], _log) -> List[str]:
+    def _gate_check_parallel(self, image_paths: List[str], _log,
+                             cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """并行 Gate 检查（多张图片）"""
         max_workers = min(MAX_PARALLEL_WORKERS_2D, len(image_paths))
         _log(f"并行检查 {len(image_paths)} 张图片，workers={max_workers}")
         
         results = {}
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with cancellable_executor(max_workers) as executor:
             future_to_idx = {
                 executor.submit(self._check_single_image_gate, img_path): idx
                 for idx, img_path in enumerate(image_paths)
             }
             
-            for future in as_completed(future_to_idx):
+            for future in as_completed_cancellable(future_to_idx, cancel_token):
                 idx = future_to_idx[future]
                 image_path = image_paths[idx]
                 try:
@@ -472,7 +518,8 @@ class GenerationController2D:
 
     
     def generate_complete_flow(self, requirement: str, perspective: str = "正视角",
-                                output_dir: str = "output", pre_analysis: Dict = None) -> Dict:
+                                output_dir: str = "output", pre_analysis: Dict = None,
+                                job_id: str = "", cancel_token: Optional[CancellationToken] = None) -> Dict:
         """
         2D完整图片生成流程
         
@@ -481,6 +528,8 @@ class GenerationController2D:
             perspective: 视角（正视角/仰视角）
             output_dir: 输出目录
             pre_analysis: 预分析结果（可选），如果提供则跳过内容分析步骤
+            job_id: 任务ID（可选，用于阶段调度日志）
+            cancel_token: 取消令牌（可选），各步骤之间检查，取消时抛出 JobCancelledError
             
         Returns:
             Dict: 生成结果，包含success, images, logs等
@@ -514,7 +563,8 @@ class GenerationController2D:
                     return result
             else:
                 # 执行内容分析
-                process_result = self.content_agent.process_content_2d(requirement, perspective)
+                with stage_scheduler.stage(STAGE_ANALYZE, job_id, cancel_token):
+                    process_result = self.content_agent.process_content_2d(requirement, perspective)
                 if not process_result.get('success') or not process_result.get('compliant'):
                     result["error"] = process_result.get('reason', '内容不合规')
                     result["logs"].append(f"内容分析失败: {result['error']}")
@@ -523,6 +573,8 @@ class GenerationController2D:
                 analysis = process_result.get('analysis', {})
                 result["analysis"] = analysis
                 result["logs"].append(f"内容分析完成: {analysis}")
+        except JobCancelledError:
+            raise
         except Exception as e:
             result["error"] = f"内容分析异常: {str(e)}"
             result["logs"].append(result["error"])
@@ -530,21 +582,24 @@ class GenerationController2D:
         
         # 步骤1: 匹配头像和身体（各选2张，组合生成4张）
         try:
-            head_matches, head_logs = self.head_matcher.find_one_best_match_2d(
-                requirement, perspective, top_k=5, num_select=2
-            )
-            result["logs"].extend(head_logs)
-            
-            body_matches, body_logs = self.body_matcher.find_one_best_match_2d(
-                requirement, perspective, top_k=5, num_select=2
-            )
-            result["logs"].extend(body_logs)
+            with stage_scheduler.stage(STAGE_COMPOSE, job_id, cancel_token):
+                head_matches, head_logs = self.head_matcher.find_one_best_match_2d(
+                    requirement, perspective, top_k=5, num_select=2
+                )
+                result["logs"].extend(head_logs)
+                
+                body_matches, body_logs = self.body_matcher.find_one_best_match_2d(
+                    requirement, perspective, top_k=5, num_select=2
+                )
+                result["logs"].extend(body_logs)
             
             if not head_matches or not body_matches:
                 result["error"] = "未找到匹配的头像或身体图片"
                 return result
                 
             result["logs"].append(f"匹配完成: head={len(head_matches)}, body={len(body_matches)}")
+        except JobCancelledError:
+            raise
         except Exception as e:
             result["error"] = f"图片匹配异常: {str(e)}"
             result["logs"].append(result["error"])
@@ -552,7 +607,8 @@ class GenerationController2D:
         
         # 步骤2: 生成基础拼接图片
         action_type = analysis.get('动作', '站姿')
-        images = self.generate_step1_images(head_matches, body_matches, output_dir, action_type)
+        with stage_scheduler.stage(STAGE_COMPOSE, job_id, cancel_token):
+            images = self.generate_step1_images(head_matches, body_matches, output_dir, action_type)
         
         if not images:
             result["error"] = "未能生成基础图片"
@@ -560,17 +616,24 @@ class GenerationController2D:
         
         result["logs"].append(f"基础图片生成完成: {len(images)} 张")
         
-        # 步骤3: 处理配件
-        images = self.process_accessories_unified(images, analysis, output_dir)
-        result["logs"].append(f"配件处理完成: {len(images)} 张")
-        
-        # 步骤4: 处理背景（如果有）
-        if analysis.get('背景'):
-            images = self.process_background(images, analysis['背景'], output_dir)
-            result["logs"].append(f"背景处理完成: {len(images)} 张")
+        # 步骤3-4: 处理配件与背景（远程图片生成）
+        with stage_scheduler.stage(STAGE_GENERATE, job_id, cancel_token):
+            images = self.process_accessories_unified(images, analysis, output_dir, cancel_token=cancel_token)
+            result["logs"].append(f"配件处理完成: {len(images)} 张")
+            
+            if analysis.get('背景'):
+                images = self.process_background(images, analysis['背景'], output_dir, cancel_token=cancel_token)
+                result["logs"].append(f"背景处理完成: {len(images)} 张")
+        
+        # 步骤5: 最终Gate检查（Gate 熔断且不跳过检查时明确报告不可用，而不是按未通过处理）
+        if images and not GATE_SKIP_ON_CIRCUIT_OPEN and self.gate_circuit_open():
+            result["error"] = GATE_UNAVAILABLE_ERROR
+            result["gate_unavailable"] = True
+            result["generated_count"] = len(images)
+            return result
         
-        # 步骤5: 最终Gate检查
-        images = self.final_gate_check(images)
+        with stage_scheduler.stage(STAGE_GATE, job_id, cancel_token):
+            images = self.final_gate_check(images, cancel_token=cancel_token)
         result["logs"].append(f"Gate检查完成: {len(images)} 张通过")
         
         result["success"] = len(images) > 0
@@ -89,13 +89,15 @@ class ImageProcessor:
         print(f"从 {folder_path} 中选择了 {len(selected_images)} 张身体图片")
         return selected_images
     
-    def select_head_images(self, action_type: str, requirement: str, log_callback: Optional[Callable[[str], None]] = None) -> List[Dict]:
+    def select_head_images(self, action_type: str, requirement: str, log_callback: Optional[Callable[[str], None]] = None,
+                           requirement_features: Optional[Dict[str, str]] = None) -> List[Dict]:
         """根据动作类型选择头像图片，通过head_matcher分析"""
         folder_path = self.head_folder_mapping.get(action_type, "data/face_front_per")
         
         # 使用head_matcher从指定文件夹中选择最佳匹配的头像
         selected_heads, logs = self.head_matcher.find_best_matches_from_folder(
-            requirement, folder_path, top_k=2, log_callback=log_callback
+            requirement, folder_path, top_k=2, log_callback=log_callback,
+            requirement_features=requirement_features
         )
         
         msg = f"从 {folder_path} 中选择了 {len(selected_heads)} 张头像图片"
@@ -209,7 +211,14 @@ class ImageProcessor:
         
         return combined_images
 
-    def process_user_requirement(self, requirement: str, output_dir: str = "output", log_callback: Optional[Callable[[str], None]] = None) -> Dict:
+    def process_user_requirement(self, requirement: str, output_dir: str = "output", log_callback: Optional[Callable[[str], None]] = None,
+                                 action_type: Optional[str] = None, requirement_features: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        根据用户需求选择并组合基础图片
+
+        action_type / requirement_features 为调用方已得到的动作分类与表情分析结果，
+        传入时不再重复调用大模型分析
+        """
         msg0 = f"开始处理用户需求：{requirement}"
         print(msg0)
         if log_callback:
@@ -217,7 +226,8 @@ class ImageProcessor:
                 log_callback(msg0)
             except Exception:
                 pass
-        action_type = self.body_matcher.classify_action_type(requirement)
+        if not action_type:
+            action_type = self.body_matcher.classify_action_type(requirement)
         msg1 = f"分析得到的动作类型：{action_type}"
         print(msg1)
         if log_callback:
@@ -237,7 +247,8 @@ class ImageProcessor:
                 "error": "没有找到合适的身体图片",
                 "action_type": action_type
             }
-        head_images = self.select_head_images(action_type, requirement, log_callback=log_callback)
+        head_images = self.select_head_images(action_type, requirement, log_callback=log_callback,
+                                              requirement_features=requirement_features)
         if not head_images:
             return {
                 "success": False,
@@ -14,12 +14,13 @@ import sys
 import pandas as pd
 import re
 from typing import Dict, List
-import base64
 
 # 确保能导入项目根目录的 config
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import get_config
-from utils.http_client import http_post, parse_ai_response
+from utils.http_client import parse_ai_response
+from utils.llm_gateway import llm_gateway
+from utils.image_codec import image_codec, PROFILE_ANALYSIS
 
 
 class BaseMatcher:
@@ -37,7 +38,7 @@ class BaseMatcher:
     
     def _call_ai(self, system_prompt: str, user_prompt: str, temperature: float = 0.3, max_tokens: int = 500) -> str:
         """
-        统一的AI调用方法，使用共享 HTTP Session
+        统一的AI调用方法，经 LLM 网关限流与重试
         """
         try:
             payload = {
@@ -55,7 +56,7 @@ class BaseMatcher:
                 "Content-Type": "application/json"
             }
             
-            resp = http_post(self.api_url, json=payload, headers=headers, timeout=60)
+            resp = llm_gateway.post(self.model, self.api_url, json=payload, headers=headers, timeout=60)
             resp.raise_for_status()
             data = resp.json()
             
@@ -129,12 +130,10 @@ class BaseMatcher:
         return scores
     
     def convert_image_to_base64(self, image_path: str) -> str:
-        """将图片转换为base64格式"""
+        """将图片转换为base64格式（data URL，按图片分析配置缩放/转码并按文件缓存）"""
         try:
             if os.path.exists(image_path):
-                with open(image_path, 'rb') as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
-                    return f"data:image/png;base64,{image_data}"
+                return image_codec.data_url(image_path, profile=PROFILE_ANALYSIS)
             else:
                 return ""
         except Exception as e:
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情关键词翻译表
+头像 CLIP 检索使用英文文本效果更好，常见表情关键词使用预先整理的翻译，
+只有自由描述的表情才调用大模型翻译
+
+修改翻译内容（预置表或大模型翻译提示词）时请同时递增 EXPRESSION_TABLE_VERSION：
+版本作为大模型翻译结果的缓存命名空间，递增后旧的翻译缓存不再命中
+"""
+
+from typing import Optional
+
+EXPRESSION_TABLE_VERSION = "1"
+
+# 关键词 -> CLIP 检索英文文本
+# 按匹配优先级排列：较长/较具体的关键词在前（例如"大笑"先于"笑"）
+EXPRESSION_TRANSLATIONS = {
+    "大笑": "laughing face",
+    "微笑": "smiling face",
+    "开心": "happy face",
+    "愉快": "cheerful face",
+    "高兴": "happy face",
+    "喜悦": "joyful face",
+    "笑": "smiling face",
+    "哈哈": "laughing face",
+    "愤怒": "angry face",
+    "生气": "angry face",
+    "怒视": "glaring angry face",
+    "发火": "furious face",
+    "悲伤": "sad face",
+    "难过": "sad face",
+    "哭泣": "crying face",
+    "伤心": "sad face",
+    "哭": "crying face",
+    "惊讶": "surprised face",
+    "震惊": "shocked face",
+    "吃惊": "astonished face",
+    "害羞": "shy face",
+    "脸红": "blushing face",
+    "羞涩": "bashful face",
+    "冷漠": "indifferent face",
+    "面瘫": "expressionless face",
+    "无表情": "expressionless face",
+    "平静": "calm face",
+    "张嘴": "open mouth face",
+    "咧嘴": "grinning face",
+    "闭嘴": "closed mouth face",
+    "嘟嘴": "pouting face",
+    "眨眼": "winking face",
+    "闭眼": "closed eyes face",
+    "睁大眼": "wide open eyes face",
+    "调皮": "playful face",
+    "得意": "smug face",
+    "疑惑": "confused face",
+    "思考": "thinking face",
+    "紧张": "nervous face",
+    "放松": "relaxed face",
+}
+
+# 默认表情
+DEFAULT_EXPRESSION = "开心"
+
+# 匹配时去除的首尾标点
+_STRIP_CHARS = " \t\r\n，。！？、；,.!?;\"'“”"
+
+
+def find_expression_keyword(text: str) -> str:
+    """在文本中查找第一个已知表情关键词，未找到返回空字符串"""
+    for keyword in EXPRESSION_TRANSLATIONS:
+        if keyword in text:
+            return keyword
+    return ""
+
+
+def lookup_expression(cn_text: str) -> Optional[str]:
+    """查询翻译表（整段文本与关键词完全一致时命中），未命中返回 None"""
+    return EXPRESSION_TRANSLATIONS.get((cn_text or "").strip(_STRIP_CHARS))
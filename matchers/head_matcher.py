@@ -11,10 +11,14 @@ import random
 import logging
 from typing import Dict, List, Optional, Callable
 from .base_matcher import BaseMatcher
-from PIL import Image
-from sentence_transformers import SentenceTransformer, util
+from .expression_table import (
+    DEFAULT_EXPRESSION, EXPRESSION_TABLE_VERSION, find_expression_keyword, lookup_expression
+)
+from sentence_transformers import SentenceTransformer
 # 使用全局 CLIP 管理器
 from utils.clip_manager import get_clip_model, get_clip_tokenizer
+# 图片嵌入使用预构建的持久化缓存，请求时只编码检索文本
+from utils.clip_cache import get_clip_cache
 
 logger = logging.getLogger(__name__)
 
@@ -137,8 +141,14 @@ class HeadMatcher(BaseMatcher):
         return scores[:top_k], processing_logs
     
     def find_best_matches_from_folder(self, requirement: str, folder_path: str, 
-                                     top_k: int = 2, log_callback: Optional[Callable[[str], None]] = None) -> tuple:
-        """从指定文件夹中找到最匹配的头像图片"""
+                                     top_k: int = 2, log_callback: Optional[Callable[[str], None]] = None,
+                                     requirement_features: Optional[Dict[str, str]] = None) -> tuple:
+        """
+        从指定文件夹中找到最匹配的头像图片（requirement_features 为已有的需求分析结果时不再重复分析）
+
+        图片嵌入来自 CLIPEmbeddingCache（首次使用或素材变化时构建并持久化），
+        检索文本编码一次后与整个文件夹的嵌入矩阵做一次矩阵-向量乘法打分
+        """
         import glob
         
         # 初始化日志收集
@@ -160,7 +170,8 @@ class HeadMatcher(BaseMatcher):
             return [], processing_logs
         
         # 使用 CLIP 对“表情”文本与图片进行相似度检索
-        requirement_features = self.analyze_user_requirement(requirement)
+        if requirement_features is None:
+            requirement_features = self.analyze_user_requirement(requirement)
         expr_text = self._extract_expression_text(requirement)
         if not expr_text:
             expr_text = requirement_features.get('表情', '') or requirement
@@ -183,7 +194,7 @@ class HeadMatcher(BaseMatcher):
             # 先用 CLIP 分词器安全截断，避免 77/82 等长度冲突
             expr_text_safe = self._truncate_clip_text(expr_text)
             # SentenceTransformer.encode 文本参数为位置参数或 sentences 关键字
-            text_emb = self._clip_model_ref.encode([expr_text_safe], convert_to_tensor=True, normalize_embeddings=True)
+            text_emb = self._clip_model_ref.encode([expr_text_safe], convert_to_tensor=False, normalize_embeddings=True)
         except Exception as e:
             err = f"文本向量化失败: {str(e)}"
             logger.error(err)
@@ -192,24 +203,24 @@ class HeadMatcher(BaseMatcher):
                 log_callback(err)
             return [], processing_logs
 
-        # 图片检索评分
+        # 图片检索评分（缓存的图片嵌入矩阵 × 文本向量）
+        try:
+            image_files, similarities = get_clip_cache().score(text_emb[0], folder_path)
+        except Exception as e:
+            image_files, similarities = [], None
+            logger.error(f"头像向量缓存不可用: {folder_path}, {e}")
+        if similarities is None:
+            err = f"头像向量缓存构建失败: {folder_path}"
+            logger.error(err)
+            processing_logs.append(err)
+            if log_callback:
+                log_callback(err)
+            return [], processing_logs
+
         scores = []
-        for img_path in all_images:
+        for img_path, sim in zip(image_files, similarities):
             img_name = os.path.basename(img_path)
-            try:
-                image = Image.open(img_path).convert('RGB')
-                # SentenceTransformer.encode 图片参数为位置参数（传入 PIL.Image 列表）
-                img_emb = self._clip_model_ref.encode([image], convert_to_tensor=True, normalize_embeddings=True)
-                sim = util.cos_sim(img_emb, text_emb)[0][0].item()
-                total_score = float(sim)
-            except Exception as e:
-                total_score = 0.0
-                err = f"图片向量化失败 {img_name}: {str(e)}"
-                logger.error(err)
-                processing_logs.append(err)
-                if log_callback:
-                    log_callback(err)
-
+            total_score = float(sim)
             scores.append({
                 "image_name": img_name,
                 "image_path": img_path,
@@ -296,8 +307,8 @@ class HeadMatcher(BaseMatcher):
             if not cn_text or not cn_text.strip():
                 return ""
             
-            # 使用共享 HTTP 客户端
-            from utils.http_client import http_post
+            # 经 LLM 网关调用（限流与统一重试）
+            from utils.llm_gateway import llm_gateway
             
             payload = {
                 "model": "doubao-seed-1.6-250615",
@@ -313,7 +324,9 @@ class HeadMatcher(BaseMatcher):
                 "Content-Type": "application/json"
             }
             
-            resp = http_post(self.api_url, json=payload, headers=headers, timeout=30)
+            # 翻译表版本作为缓存命名空间：修改翻译内容后不再命中旧的翻译结果
+            resp = llm_gateway.post(payload["model"], self.api_url, json=payload, headers=headers, timeout=30,
+                                    cache_namespace=f"expression-v{EXPRESSION_TABLE_VERSION}")
             resp.raise_for_status()
             data = resp.json()
             
@@ -344,41 +357,29 @@ class HeadMatcher(BaseMatcher):
             return cn_text
 
     def _extract_expression_text(self, requirement: str) -> str:
-        """提取表情文本并通过大模型翻译为英文（CLIP英文效果更好）
+        """提取表情文本并翻译为英文（CLIP英文效果更好）
         
-        当没有找到表情描述时，默认使用"开心"
+        常见表情关键词直接查预置翻译表，只有自由描述的表情才调用大模型翻译
+        （翻译结果由 LLM 响应缓存复用）；当没有找到表情描述时，默认使用"开心"
         """
         try:
             # 先尝试从格式化文本中提取
             m = re.search(r"表情[：:]\s*([^\n]+)", requirement)
-            cn_expr = ""
             if m:
                 cn_expr = m.group(1).strip()
             else:
-                # 常见表情关键词列表
-                keywords = [
-                    "大笑", "微笑", "开心", "愉快", "高兴", "喜悦", "笑", "哈哈",
-                    "愤怒", "生气", "怒视", "发火",
-                    "悲伤", "难过", "哭泣", "伤心", "哭",
-                    "惊讶", "震惊", "吃惊",
-                    "害羞", "脸红", "羞涩",
-                    "冷漠", "面瘫", "无表情", "平静",
-                    "张嘴", "咧嘴", "闭嘴", "嘟嘴",
-                    "眨眼", "闭眼", "睁大眼",
-                    "调皮", "得意", "疑惑", "思考", "紧张", "放松"
-                ]
-                for kw in keywords:
-                    if kw in requirement:
-                        cn_expr = kw
-                        break
-            
-            # 如果找到中文表情，使用大模型翻译为英文
-            if cn_expr:
-                return self._translate_to_english(cn_expr)
+                cn_expr = find_expression_keyword(requirement)
             
             # 如果没有找到特定表情关键词，使用默认表情"开心"
-            logger.info(f"未找到表情描述，使用默认表情: 开心")
-            return self._translate_to_english("开心")
+            if not cn_expr:
+                logger.info(f"未找到表情描述，使用默认表情: {DEFAULT_EXPRESSION}")
+                cn_expr = DEFAULT_EXPRESSION
+            
+            en_text = lookup_expression(cn_expr)
+            if en_text:
+                logger.debug(f"表情翻译(预置表 v{EXPRESSION_TABLE_VERSION}): '{cn_expr}' -> '{en_text}'")
+                return en_text
+            return self._translate_to_english(cn_expr)
             
         except Exception as e:
             logger.info(f"提取表情文本异常: {e}，使用默认表情: happy face")
@@ -12,8 +12,20 @@ from .response import APIResponse, ErrorCode
 from .logger import setup_logger, get_logger, init_app_logger
 from .module_loader import ModuleLoader
 from .resource_manager import ResourceManager, resources
-from .job_manager import JobManager, JobStatus, Job, job_manager
-from .http_client import get_http_session, http_post, http_get, parse_ai_response
+from .job_manager import JobManager, JobStatus, Job, job_manager, get_job_manager
+from .job_store import JobStore, SQLiteJobStore, create_job_store
+from .worker_pool import GenerationWorkerPool, get_worker_pool
+from .stage_scheduler import StageScheduler, stage_scheduler
+from .duration_predictor import DurationPredictor
+from .cancellation import CancellationToken, JobCancelledError, DeadlineExceededError
+from .admission import AdmissionController, admission_controller
+from .http_client import get_http_session, http_post, http_get, api_headers, parse_ai_response
+from .async_http import AsyncHTTPClient, get_async_client
+from .llm_gateway import LLMGateway, llm_gateway
+from .llm_cache import LLMResponseCache, llm_cache
+from .circuit_breaker import CircuitBreakerRegistry, CircuitOpenError, circuit_breakers
+from .analysis_fanout import AnalysisFanout
+from .image_codec import ImagePayloadCodec, image_codec
 from .banned_words import get_banned_words, check_banned_words, reload_banned_words
 
 __all__ = [
@@ -35,14 +47,41 @@ __all__ = [
     'resources',
     # 任务管理
     'JobManager',
+    'get_job_manager',
     'JobStatus',
     'Job',
     'job_manager',
+    'JobStore',
+    'SQLiteJobStore',
+    'create_job_store',
+    'GenerationWorkerPool',
+    'get_worker_pool',
+    'StageScheduler',
+    'stage_scheduler',
+    'DurationPredictor',
+    'CancellationToken',
+    'JobCancelledError',
+    'DeadlineExceededError',
+    'AnalysisFanout',
+    'AdmissionController',
+    'admission_controller',
     # HTTP 客户端
     'get_http_session',
     'http_post',
     'http_get',
+    'api_headers',
     'parse_ai_response',
+    'AsyncHTTPClient',
+    'get_async_client',
+    'LLMGateway',
+    'llm_gateway',
+    'LLMResponseCache',
+    'llm_cache',
+    'CircuitBreakerRegistry',
+    'CircuitOpenError',
+    'circuit_breakers',
+    'ImagePayloadCodec',
+    'image_codec',
     # 违规词库
     'get_banned_words',
     'check_banned_words',
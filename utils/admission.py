@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+准入控制与背压
+根据下游（图片生成 / LLM / Gate 接口）的健康状况自适应调整任务并发，
+下游退化时拒绝新任务并给出 Retry-After，避免堆积注定超时的任务
+
+- 滑动窗口统计最近的请求结果：429 / 5xx / 超时 / 连接错误计为失败，并记录延迟
+- AIMD：下游退化时并发上限减半（multiplicative decrease），健康时每个周期 +1（additive increase）
+- 退化期间排队数超过 有效并发 × ADMISSION_QUEUE_FACTOR 时拒绝新任务
+- 调整在记录样本、准入检查与查询状态时按需进行：拒绝新任务后下游没有流量时，
+  窗口内样本照常过期，并发上限按经过的周期数逐步恢复
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 准入控制配置（可通过环境变量覆盖）
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_WINDOW = float(os.environ.get("ADMISSION_WINDOW", "60"))  # 统计窗口（秒）
+ADMISSION_ERROR_THRESHOLD = float(os.environ.get("ADMISSION_ERROR_THRESHOLD", "0.25"))  # 失败率阈值
+ADMISSION_LATENCY_THRESHOLD = float(os.environ.get("ADMISSION_LATENCY_THRESHOLD", "120"))  # p90 延迟阈值（秒）
+ADMISSION_MIN_SAMPLES = int(os.environ.get("ADMISSION_MIN_SAMPLES", "5"))  # 判定所需最少样本数
+ADMISSION_EVAL_INTERVAL = float(os.environ.get("ADMISSION_EVAL_INTERVAL", "5"))  # AIMD 调整周期（秒）
+ADMISSION_MIN_CONCURRENCY = int(os.environ.get("ADMISSION_MIN_CONCURRENCY", "1"))
+ADMISSION_QUEUE_FACTOR = float(os.environ.get("ADMISSION_QUEUE_FACTOR", "2"))
+ADMISSION_MIN_RETRY_AFTER = int(os.environ.get("ADMISSION_MIN_RETRY_AFTER", "10"))
+ADMISSION_MAX_RETRY_AFTER = int(os.environ.get("ADMISSION_MAX_RETRY_AFTER", "300"))
+
+# 视为下游过载/故障的状态码
+_FAILURE_STATUS = (429, 500, 502, 503, 504)
+
+
+class AdmissionController:
+    """自适应准入控制器（线程安全）"""
+
+    def __init__(
+        self,
+        max_limit: int = 5,
+        min_limit: int = ADMISSION_MIN_CONCURRENCY,
+        window: float = ADMISSION_WINDOW,
+        error_threshold: float = ADMISSION_ERROR_THRESHOLD,
+        latency_threshold: float = ADMISSION_LATENCY_THRESHOLD,
+        eval_interval: float = ADMISSION_EVAL_INTERVAL,
+        enabled: bool = ADMISSION_ENABLED
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.window = window
+        self.error_threshold = error_threshold
+        self.latency_threshold = latency_threshold
+        self.eval_interval = eval_interval
+        self.enabled = enabled
+
+        self._limit = float(max_limit)
+        self._samples: deque = deque()  # (timestamp, host, ok, latency)
+        self._last_eval = 0.0
+        self._degraded = False
+        self._listeners: List[Callable[[int], None]] = []
+        self._lock = threading.Lock()
+
+    def set_max_limit(self, max_limit: int):
+        """设置并发上限（由 JobQueue 初始化时调用）"""
+        with self._lock:
+            self.max_limit = max_limit
+            self.min_limit = min(self.min_limit, max_limit)
+            self._limit = min(self._limit, max_limit) if self._degraded else float(max_limit)
+
+    def add_listener(self, callback: Callable[[int], None]):
+        """注册并发上限变化回调 callback(new_limit)"""
+        self._listeners.append(callback)
+
+    def record(self, host: str, ok: bool, latency: float = 0.0):
+        """
+        记录一次下游请求结果
+
+        Args:
+            host: 下游主机
+            ok: 是否成功（429/5xx/超时/连接错误为失败）
+            latency: 请求耗时（秒）
+        """
+        if not self.enabled:
+            return
+        self._refresh(sample=(time.time(), host, ok, latency))
+
+    def _refresh(self, sample: Optional[tuple] = None):
+        """丢弃过期样本并按周期执行 AIMD 调整，并发上限变化时通知监听者"""
+        now = time.time()
+        with self._lock:
+            if sample is not None:
+                self._samples.append(sample)
+            self._trim(now)
+            changed = self._evaluate(now)
+            limit = self.concurrency_limit_locked()
+        if changed:
+            for callback in self._listeners:
+                try:
+                    callback(limit)
+                except Exception as e:
+                    logger.warning(f"并发上限变化回调失败: {e}")
+
+    def _trim(self, now: float):
+        """丢弃窗口外的样本（需要在锁内调用）"""
+        cutoff = now - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def _evaluate(self, now: float) -> bool:
+        """
+        按周期执行 AIMD 调整，返回有效并发是否变化（需要在锁内调用）
+
+        健康时按距上次调整经过的周期数增加并发（期间没有调用也不会少加）
+        """
+        elapsed = now - self._last_eval
+        if elapsed < self.eval_interval:
+            return False
+        self._last_eval = now
+
+        error_rate, p90 = self._health_locked()
+        enough = len(self._samples) >= ADMISSION_MIN_SAMPLES
+        degraded = enough and (error_rate > self.error_threshold or p90 > self.latency_threshold)
+
+        before = self.concurrency_limit_locked()
+        if degraded:
+            self._limit = max(float(self.min_limit), self._limit / 2)
+        else:
+            periods = int(elapsed // self.eval_interval) if self.eval_interval > 0 else 1
+            self._limit = min(float(self.max_limit), self._limit + max(1, periods))
+        after = self.concurrency_limit_locked()
+
+        if degraded != self._degraded:
+            if degraded:
+                logger.warning(f"下游退化（失败率 {error_rate:.0%}, p90 延迟 {p90:.1f}s），并发上限降至 {after}")
+            else:
+                logger.info(f"下游恢复（失败率 {error_rate:.0%}, p90 延迟 {p90:.1f}s），并发上限逐步恢复")
+            self._degraded = degraded
+        elif before != after:
+            logger.info(f"自适应并发上限: {before} -> {after}")
+        return before != after
+
+    def _health_locked(self) -> tuple:
+        """计算窗口内失败率与 p90 延迟（需要在锁内调用）"""
+        if not self._samples:
+            return 0.0, 0.0
+        failures = sum(1 for _, _, ok, _ in self._samples if not ok)
+        latencies = sorted(latency for _, _, ok, latency in self._samples if ok)
+        p90 = latencies[int((len(latencies) - 1) * 0.9)] if latencies else 0.0
+        return failures / len(self._samples), p90
+
+    def concurrency_limit_locked(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def concurrency_limit(self) -> int:
+        """当前有效并发上限"""
+        with self._lock:
+            return self.concurrency_limit_locked()
+
+    @property
+    def degraded(self) -> bool:
+        return self._degraded
+
+    def check(self, waiting_count: int) -> bool:
+        """
+        判断是否接收新任务
+
+        Args:
+            waiting_count: 当前排队任务数
+
+        Returns:
+            bool: True 表示接收；退化期间排队数超过 有效并发 × ADMISSION_QUEUE_FACTOR 时拒绝
+        """
+        if not self.enabled:
+            return True
+        self._refresh()
+        if not self._degraded:
+            return True
+        return waiting_count < self.concurrency_limit() * ADMISSION_QUEUE_FACTOR
+
+    def get_stats(self) -> Dict:
+        """获取准入控制状态"""
+        if self.enabled:
+            self._refresh()
+        with self._lock:
+            self._trim(time.time())
+            error_rate, p90 = self._health_locked()
+            hosts: Dict[str, Dict] = {}
+            for _, host, ok, _ in self._samples:
+                item = hosts.setdefault(host, {"requests": 0, "failures": 0})
+                item["requests"] += 1
+                if not ok:
+                    item["failures"] += 1
+            return {
+                "enabled": self.enabled,
+                "degraded": self._degraded,
+                "concurrency_limit": self.concurrency_limit_locked(),
+                "max_concurrency": self.max_limit,
+                "error_rate": round(error_rate, 3),
+                "p90_latency": round(p90, 1),
+                "samples": len(self._samples),
+                "hosts": hosts
+            }
+
+
+def clamp_retry_after(seconds: float) -> int:
+    """将建议的重试等待时间限制在配置范围内"""
+    return int(min(ADMISSION_MAX_RETRY_AFTER, max(ADMISSION_MIN_RETRY_AFTER, seconds)))
+
+
+# 全局准入控制器
+admission_controller = AdmissionController()
+
+# 结果转发函数（多进程模式下工作进程把样本转发给主进程）
+_forwarder: Optional[Callable[[str, bool, float], None]] = None
+
+
+def set_upstream_forwarder(forwarder: Optional[Callable[[str, bool, float], None]]):
+    """设置下游结果转发函数（工作进程初始化时调用）"""
+    global _forwarder
+    _forwarder = forwarder
+
+
+def record_upstream(url: str, status_code: Optional[int] = None, latency: float = 0.0, error: bool = False):
+    """
+    记录一次下游请求结果（供 HTTP 客户端调用）
+
+    Args:
+        url: 请求 URL
+        status_code: HTTP 状态码（请求异常时为 None）
+        latency: 请求耗时（秒）
+        error: 是否发生超时/连接错误
+    """
+    try:
+        host = urlparse(url).netloc or url
+    except Exception:
+        host = str(url)
+    ok = not error and status_code not in _FAILURE_STATUS
+    if _forwarder is not None:
+        _forwarder(host, ok, latency)
+    else:
+        admission_controller.record(host, ok, latency)
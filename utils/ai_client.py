@@ -9,6 +9,9 @@ import requests
 import json
 from typing import Dict, List, Optional
 
+from .http_client import api_headers
+from .llm_gateway import llm_gateway
+
 
 class AIClient:
     """JD Cloud AI API 客户端"""
@@ -23,14 +26,7 @@ class AIClient:
         """
         self.api_url = api_url
         self.api_key = api_key
-        self.headers = {
-            "Accept": "*/*",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Authorization": f"Bearer {self.api_key}",
-            "Connection": "keep-alive",
-            "Content-Type": "application/json",
-            "User-Agent": "JoyIP-3D-System/1.0"
-        }
+        self.headers = api_headers(self.api_key)
     
     def chat_completion(
         self,
@@ -59,11 +55,12 @@ class AIClient:
                 "max_tokens": max_tokens
             }
             
-            # 发送请求
-            response = requests.post(
+            # 发送请求（经 LLM 网关限流与重试）
+            response = llm_gateway.post(
+                model,
                 self.api_url,
-                headers=self.headers,
                 json=payload,
+                headers=self.headers,
                 timeout=30
             )
             
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析阶段并发执行
+生成任务分析阶段的几个 LLM 调用（内容分析/合规检查、表情分析、动作分类）互不依赖，
+在共享线程池中同时发出，分析阶段耗时取决于最慢的一个调用而不是所有调用之和
+
+- 每个任务一个 AnalysisFanout，结果按名称记忆，同一任务内每个调用只执行一次，
+  后续步骤（图片选择与组合）直接复用
+- 投机执行：动作分类即使最终被内容分析/预分析结果覆盖也会提前发出，
+  未用到的结果直接丢弃
+- 等待结果时定期检查取消令牌，取消后丢弃尚未开始的调用
+"""
+
+import os
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from .cancellation import CancellationToken, CANCEL_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 分析调用线程池大小（可通过环境变量覆盖），所有任务共享
+ANALYSIS_FANOUT_WORKERS = int(os.environ.get("ANALYSIS_FANOUT_WORKERS", "16"))
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """获取共享线程池（懒创建）"""
+    global _EXECUTOR
+
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=ANALYSIS_FANOUT_WORKERS,
+                                               thread_name_prefix="Analysis")
+    return _EXECUTOR
+
+
+class AnalysisFanout:
+    """单个任务的分析调用集合（线程安全）"""
+
+    def __init__(self, job_id: str = "", cancel_token: Optional[CancellationToken] = None):
+        self.job_id = job_id
+        self.cancel_token = cancel_token
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def start(self, name: str, func: Callable, *args, **kwargs) -> Future:
+        """
+        在后台发出一个分析调用（同名调用已发出时直接返回已有的 future）
+
+        Args:
+            name: 调用名称（记忆键）
+            func: 分析函数（同步函数）
+        """
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None:
+                future = self._futures[name] = _get_executor().submit(func, *args, **kwargs)
+                logger.debug(f"[Job {self.job_id}] 发出分析调用: {name}")
+            return future
+
+    def result(self, name: str, func: Optional[Callable] = None, *args, **kwargs) -> Any:
+        """
+        获取分析结果（等待期间检查取消令牌）
+
+        调用尚未发出时，如提供了 func 则在当前线程执行并记忆结果；
+        分析函数抛出的异常原样抛出
+
+        Raises:
+            KeyError: 调用未发出且未提供 func
+            JobCancelledError: 任务已取消或超过截止时间
+        """
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None:
+                if func is None:
+                    raise KeyError(name)
+                future = self._futures[name] = Future()
+                future.set_running_or_notify_cancel()
+                run_inline = True
+            else:
+                run_inline = False
+
+        if run_inline:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            return future.result()
+
+        while True:
+            if self.cancel_token is not None and self.cancel_token.stopped:
+                self.cancel()
+                self.cancel_token.raise_if_cancelled()
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL if self.cancel_token is not None else None)
+            except FutureTimeoutError:
+                continue
+
+    def cancel(self):
+        """丢弃尚未开始的调用（正在执行的调用无法中断，会自然结束）"""
+        with self._lock:
+            dropped = sum(1 for future in self._futures.values() if future.cancel())
+        if dropped:
+            logger.info(f"[Job {self.job_id}] 丢弃 {dropped} 个未开始的分析调用")
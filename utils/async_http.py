@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步 HTTP 客户端
+基于 httpx.AsyncClient，在独立的事件循环线程中运行，所有出站请求共享一个连接池
+
+- HTTP/2 多路复用（需要安装 h2，未安装时自动使用 HTTP/1.1 keep-alive）
+- 每个下游主机一个全局并发预算（HTTP_MAX_CONNECTIONS_PER_HOST），
+  各模块的线程池同时发请求时不会各自打开新的 TLS 连接
+- 429 / 5xx / 连接错误自动重试（指数退避，尊重 Retry-After），结果上报准入控制
+- 同步门面 request_sync() 返回 requests.Response，异常转换为 requests 异常，
+  现有基于 requests 的调用代码无需修改
+"""
+
+import os
+import time
+import asyncio
+import threading
+import importlib.util
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTPX_AVAILABLE = False
+
+from .admission import record_upstream
+
+logger = logging.getLogger(__name__)
+
+# 异步客户端配置（可通过环境变量覆盖）
+HTTP_CLIENT_BACKEND = os.environ.get("HTTP_CLIENT_BACKEND", "httpx").strip().lower()  # httpx | requests
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", "1.0"))
+
+# 需要重试的状态码（与 requests Session 的重试策略一致）
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Retry-After 最长等待时间（秒）
+_MAX_RETRY_AFTER = 60.0
+
+_GLOBAL_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），无效时返回 None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_httpx_timeout(timeout):
+    """requests 风格的超时（秒 或 (connect, read)）转换为 httpx.Timeout"""
+    if timeout is None:
+        return None
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _to_requests_response(response, method: str) -> requests.Response:
+    """httpx.Response 转换为 requests.Response（内容已完整读取）"""
+    result = requests.Response()
+    result.status_code = response.status_code
+    result._content = response.content
+    result._content_consumed = True
+    result.headers = CaseInsensitiveDict(response.headers)
+    result.url = str(response.url)
+    result.reason = response.reason_phrase
+    result.encoding = get_encoding_from_headers(result.headers)
+    try:
+        result.elapsed = response.elapsed
+    except RuntimeError:
+        result.elapsed = timedelta(0)
+    result.request = requests.Request(method, result.url).prepare()
+    return result
+
+
+def _to_requests_exception(error: Exception) -> requests.exceptions.RequestException:
+    """httpx 异常转换为对应的 requests 异常"""
+    message = f"{type(error).__name__}: {error}"
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(message)
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.ReadTimeout(message)
+    if isinstance(error, (httpx.ConnectError, httpx.RemoteProtocolError, httpx.ReadError, httpx.WriteError)):
+        return requests.exceptions.ConnectionError(message)
+    if isinstance(error, httpx.InvalidURL):
+        return requests.exceptions.InvalidURL(message)
+    return requests.exceptions.RequestException(message)
+
+
+class AsyncHTTPClient:
+    """
+    共享异步 HTTP 客户端（事件循环在后台线程中运行）
+
+    异步代码可直接 await request()；同步代码通过 request_sync() 调用
+    """
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+        http2: bool = HTTP2_ENABLED,
+        max_retries: int = HTTP_MAX_RETRIES,
+        backoff: float = HTTP_RETRY_BACKOFF
+    ):
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # HTTP/2 依赖 h2 包（httpx[http2]）
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.info("未安装 h2，异步 HTTP 客户端使用 HTTP/1.1 keep-alive")
+
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        self._client = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name="AsyncHTTP-Loop")
+        self._thread.start()
+        self._ready.wait()
+
+        logger.info(f"AsyncHTTPClient 初始化: http2={self.http2}, max_connections={max_connections}, "
+                    f"max_per_host={max_per_host}")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._client = httpx.AsyncClient(http2=self.http2, limits=self._limits, follow_redirects=True)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        """获取下游主机的并发槽位（只在事件循环线程中访问）"""
+        host = urlparse(url).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    async def request(self, method: str, url: str, timeout=60, max_retries: Optional[int] = None, **kwargs):
+        """
+        发送请求（429/5xx/连接错误自动重试）
+
+        重试用尽后返回最后一次响应（由调用方检查状态码），连接错误则抛出 httpx 异常
+
+        Args:
+            max_retries: 重试次数（None 使用默认配置，0 表示由调用方自行重试）
+
+        Returns:
+            httpx.Response
+        """
+        # requests 参数名转换为 httpx 参数名
+        if "allow_redirects" in kwargs:
+            kwargs["follow_redirects"] = kwargs.pop("allow_redirects")
+        if isinstance(kwargs.get("data"), (str, bytes)):
+            kwargs["content"] = kwargs.pop("data")
+        timeout = _to_httpx_timeout(timeout)
+        slot = self._host_slot(url)
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                async with slot:
+                    response = await self._client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                record_upstream(url, None, time.time() - start, error=True)
+                if attempt >= max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"请求失败，{delay:.1f}秒后重试 ({attempt + 1}/{max_retries}): "
+                               f"{url}, {type(e).__name__} {e}")
+            else:
+                record_upstream(url, response.status_code, time.time() - start)
+                if response.status_code not in RETRY_STATUS or attempt >= max_retries:
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = min(retry_after, _MAX_RETRY_AFTER) if retry_after is not None \
+                    else self.backoff * (2 ** attempt)
+                logger.warning(f"HTTP {response.status_code}，{delay:.1f}秒后重试 "
+                               f"({attempt + 1}/{max_retries}): {url}")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def request_sync(self, method: str, url: str, timeout=60, max_retries: Optional[int] = None,
+                     **kwargs) -> requests.Response:
+        """
+        同步门面：在事件循环线程中执行请求并等待结果
+
+        Returns:
+            requests.Response（httpx 异常转换为 requests 异常）
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("不能在事件循环线程中调用 request_sync，请使用 await request()")
+        future = asyncio.run_coroutine_threadsafe(
+            self.request(method, url, timeout=timeout, max_retries=max_retries, **kwargs), self._loop
+        )
+        try:
+            response = future.result()
+        except httpx.HTTPError as e:
+            raise _to_requests_exception(e) from e
+        return _to_requests_response(response, method)
+
+    def close(self):
+        """关闭连接池并停止事件循环"""
+        if self._loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"关闭异步 HTTP 客户端失败: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+
+
+def get_async_client() -> Optional[AsyncHTTPClient]:
+    """
+    获取全局异步 HTTP 客户端（单例）
+
+    Returns:
+        AsyncHTTPClient: 未安装 httpx 或 HTTP_CLIENT_BACKEND=requests 时返回 None
+    """
+    global _GLOBAL_CLIENT
+
+    if not HTTPX_AVAILABLE or HTTP_CLIENT_BACKEND != "httpx":
+        return None
+
+    if _GLOBAL_CLIENT is None:
+        with _CLIENT_LOCK:
+            if _GLOBAL_CLIENT is None:
+                _GLOBAL_CLIENT = AsyncHTTPClient()
+
+    return _GLOBAL_CLIENT
+
+
+def close_async_client():
+    """关闭全局异步 HTTP 客户端"""
+    global _GLOBAL_CLIENT
+
+    with _CLIENT_LOCK:
+        client, _GLOBAL_CLIENT = _GLOBAL_CLIENT, None
+    if client is not None:
+        client.close()
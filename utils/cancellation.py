@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务取消令牌
+用于协作式取消执行中的生成任务：生成流程在阶段之间和并行结果收集时检查令牌，
+已取消则停止后续远程调用，并丢弃尚未开始执行的 future；
+并行阶段使用 cancellable_executor，取消时不等待正在执行的调用（调用本身在重试/退避前检查令牌）
+
+令牌同时携带任务截止时间：超过截止时间后检查点抛出 DeadlineExceededError，
+下游调用的超时与重试也以截止时间为预算（见 utils.deadline）
+"""
+
+import os
+import time
+import threading
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 并行结果收集时检查取消状态的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+# 任务截止时间（开始执行后的秒数，默认 0 不限制）
+JOB_DEADLINE_SECONDS = float(os.environ.get("JOB_DEADLINE_SECONDS", "0"))
+
+
+class JobCancelledError(Exception):
+    """任务已被取消"""
+
+    def __init__(self, message: str = "任务已取消"):
+        super().__init__(message)
+
+
+class DeadlineExceededError(JobCancelledError):
+    """任务超过截止时间"""
+
+    def __init__(self, message: str = "任务超过截止时间"):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """
+    取消令牌（线程安全）
+
+    event 可以是 threading.Event，也可以是任何提供 is_set/set/wait(timeout) 的对象
+    （多进程执行模式下为共享内存中的取消标志，由主进程设置、工作进程读取）
+    deadline 为任务截止时间（time.time() 时间戳，None 表示不限制）
+    """
+
+    def __init__(self, event=None, deadline: Optional[float] = None):
+        self._event = event if event is not None else threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.deadline = deadline
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消"""
+        return self._event.is_set()
+
+    def set_deadline(self, deadline: Optional[float]):
+        """设置任务截止时间（time.time() 时间戳）"""
+        self.deadline = deadline
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的剩余秒数（未设置截止时间时返回 None）"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    @property
+    def expired(self) -> bool:
+        """是否已超过截止时间"""
+        return self.deadline is not None and time.time() >= self.deadline
+
+    @property
+    def stopped(self) -> bool:
+        """是否应停止执行（已取消或已超过截止时间）"""
+        return self.cancelled or self.expired
+
+    def cancel(self):
+        """取消并触发回调"""
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"取消回调执行失败: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """注册取消回调（已取消时立即执行）"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout: float) -> bool:
+        """等待至多 timeout 秒（用于重试退避），期间被取消时立即返回 True"""
+        return bool(self._event.wait(timeout))
+
+    def raise_if_cancelled(self):
+        """检查点：已取消则抛出 JobCancelledError，超过截止时间则抛出 DeadlineExceededError"""
+        if self.cancelled:
+            raise JobCancelledError()
+        if self.expired:
+            raise DeadlineExceededError()
+
+
+def check_cancelled(cancel_token: Optional[CancellationToken]):
+    """检查点（令牌为空时不做任何事）"""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+@contextmanager
+def cancellable_executor(max_workers: int) -> Iterator[ThreadPoolExecutor]:
+    """
+    并行阶段使用的线程池
+
+    正常结束时与 with ThreadPoolExecutor 相同，等待所有子任务完成；
+    以异常退出（取消、超过截止时间）时不等待正在执行的调用并丢弃未开始的子任务，
+    任务立即释放阶段并发名额与队列运行位
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        yield executor
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+
+def as_completed_cancellable(futures: Iterable[Future],
+                             cancel_token: Optional[CancellationToken] = None,
+                             poll_interval: float = CANCEL_POLL_INTERVAL) -> Iterator[Future]:
+    """
+    与 concurrent.futures.as_completed 相同，但在等待期间定期检查取消令牌
+
+    取消或超过截止时间时会 cancel 所有尚未开始的 future（正在执行的调用无法中断，会自然结束），
+    然后抛出 JobCancelledError / DeadlineExceededError
+    """
+    pending = set(futures)
+    if cancel_token is None:
+        poll_interval = None
+    while pending:
+        if cancel_token is not None and cancel_token.stopped:
+            dropped = sum(1 for f in pending if f.cancel())
+            logger.info(f"任务已取消或超时，丢弃 {dropped} 个未开始的子任务")
+            cancel_token.raise_if_cancelled()
+        done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future
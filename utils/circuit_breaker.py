@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下游熔断器
+按 (主机, 模型[, 调用类型]) 维护熔断状态，下游连续失败时快速失败，避免每个请求都等到超时：
+
+- closed: 正常放行；连续失败 CIRCUIT_FAILURE_THRESHOLD 次（连接错误/超时/429/5xx）后进入 open
+- open: 直接抛出 CircuitOpenError，不发请求；CIRCUIT_OPEN_SECONDS 后进入 half_open
+- half_open: 只放行 CIRCUIT_HALF_OPEN_PROBES 个探测请求，探测成功回到 closed，
+  失败重新进入 open 且打开时间翻倍（不超过 CIRCUIT_MAX_OPEN_SECONDS）
+
+CircuitOpenError 继承 requests 的 ConnectionError，调用方已有的连接错误降级逻辑
+（返回基础合成图、Gate 熔断时不展示未检查的图片等）无需修改即可生效
+
+多进程执行模式下各工作进程分别熔断，状态变化转发给主进程用于 /api/health 展示
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from .async_http import RETRY_STATUS
+
+logger = logging.getLogger(__name__)
+
+# 配置（可通过环境变量覆盖）
+CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))  # 连续失败次数
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.environ.get("CIRCUIT_MAX_OPEN_SECONDS", "300"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """下游熔断中，请求未发出"""
+
+    def __init__(self, key: str, retry_in: float):
+        super().__init__(f"下游熔断中: {key}，{retry_in:.0f}秒后重新探测")
+        self.key = key
+        self.retry_in = retry_in
+
+
+def circuit_key(url: str, model: Optional[str] = None, call_type: Optional[str] = None) -> str:
+    """
+    熔断维度：主机（+ 模型）（+ 调用类型）
+
+    调用类型用于同一接口与模型上需要独立熔断的调用（如 Gate 检查与图片生成共用接口与模型，
+    生成失败不应使 Gate 检查熔断）
+    """
+    try:
+        host = urlparse(url).netloc or url
+    except Exception:
+        host = str(url)
+    key = f"{host}|{model}" if model else host
+    return f"{key}#{call_type}" if call_type else key
+
+
+class _Circuit:
+    """单个 (主机, 模型) 的熔断状态"""
+
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def snapshot(self, now: float) -> Dict:
+        retry_in = self.opened_at + self.open_seconds - now if self.state == STATE_OPEN else 0.0
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in": round(max(0.0, retry_in), 1),
+            "rejected": self.rejected,
+            "trips": self.trips
+        }
+
+
+class CircuitBreakerRegistry:
+    """熔断器集合（线程安全）"""
+
+    def __init__(
+        self,
+        enabled: bool = CIRCUIT_BREAKER_ENABLED,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES
+    ):
+        self.enabled = enabled
+        self.threshold = max(1, threshold)
+        self.half_open_probes = max(1, half_open_probes)
+        self._circuits: Dict[str, _Circuit] = {}
+        self._remote: Dict[Tuple[str, str], Dict] = {}  # (来源, key) -> 工作进程上报的状态
+        self._lock = threading.Lock()
+        self._forwarder: Optional[Callable[[str, Dict], None]] = None
+
+    def set_state_forwarder(self, forwarder: Optional[Callable[[str, Dict], None]]):
+        """设置状态变化转发函数（工作进程初始化时调用）"""
+        self._forwarder = forwarder
+
+    def _transition(self, key: str, circuit: _Circuit, state: str, now: float):
+        """切换状态（需要在锁内调用），返回需要转发的状态快照"""
+        previous, circuit.state = circuit.state, state
+        if state == STATE_OPEN:
+            circuit.opened_at = now
+            circuit.trips += 1
+            logger.warning(f"[熔断] {key} {previous} -> open，{circuit.open_seconds:.0f}秒后探测 "
+                           f"(连续失败 {circuit.failures} 次)")
+        else:
+            logger.info(f"[熔断] {key} {previous} -> {state}")
+        return circuit.snapshot(now)
+
+    def _forward(self, key: str, snapshot: Optional[Dict]):
+        if snapshot is not None and self._forwarder is not None:
+            try:
+                self._forwarder(key, snapshot)
+            except Exception as e:
+                logger.debug(f"转发熔断状态失败: {e}")
+
+    def acquire(self, url: str, model: Optional[str] = None, call_type: Optional[str] = None) -> Optional[str]:
+        """
+        请求前检查熔断状态
+
+        Returns:
+            熔断维度 key（请求结束后传给 record）；未开启熔断时返回 None
+
+        Raises:
+            CircuitOpenError: 熔断中或半开状态下探测名额已用完
+        """
+        if not self.enabled:
+            return None
+        key = circuit_key(url, model, call_type)
+        snapshot = None
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit()
+            now = time.time()
+            if circuit.state == STATE_OPEN:
+                retry_in = circuit.opened_at + circuit.open_seconds - now
+                if retry_in > 0:
+                    circuit.rejected += 1
+                    raise CircuitOpenError(key, retry_in)
+                circuit.probes = 0
+                snapshot = self._transition(key, circuit, STATE_HALF_OPEN, now)
+            if circuit.state == STATE_HALF_OPEN:
+                if circuit.probes >= self.half_open_probes:
+                    circuit.rejected += 1
+                    raise CircuitOpenError(key, 0)
+                circuit.probes += 1
+        self._forward(key, snapshot)
+        return key
+
+    def record(self, key: Optional[str], ok: bool):
+        """记录请求结果（ok: 未发生连接错误/超时且状态码不是 429/5xx）"""
+        if key is None:
+            return
+        snapshot = None
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                return
+            now = time.time()
+            if ok:
+                circuit.failures = 0
+                if circuit.state != STATE_CLOSED:
+                    circuit.open_seconds = CIRCUIT_OPEN_SECONDS
+                    snapshot = self._transition(key, circuit, STATE_CLOSED, now)
+            else:
+                circuit.failures += 1
+                if circuit.state == STATE_HALF_OPEN:
+                    circuit.open_seconds = min(circuit.open_seconds * 2, CIRCUIT_MAX_OPEN_SECONDS)
+                    snapshot = self._transition(key, circuit, STATE_OPEN, now)
+                elif circuit.state == STATE_CLOSED and circuit.failures >= self.threshold:
+                    snapshot = self._transition(key, circuit, STATE_OPEN, now)
+        self._forward(key, snapshot)
+
+    def record_response(self, key: Optional[str], status_code: Optional[int]):
+        """按状态码记录请求结果（status_code 为 None 表示请求异常）"""
+        self.record(key, status_code is not None and status_code not in RETRY_STATUS)
+
+    def is_open(self, url: str, model: Optional[str] = None, call_type: Optional[str] = None) -> bool:
+        """下游是否处于熔断中（不占用探测名额；open 状态已到探测时间时视为可用）"""
+        if not self.enabled:
+            return False
+        key = circuit_key(url, model, call_type)
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return (circuit is not None and circuit.state == STATE_OPEN
+                    and circuit.opened_at + circuit.open_seconds > time.time())
+
+    def record_remote(self, source: str, key: str, snapshot: Dict):
+        """记录工作进程上报的熔断状态（主进程调用）"""
+        with self._lock:
+            self._remote[(source, key)] = dict(snapshot, updated_at=time.time())
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取各下游的熔断状态（含工作进程上报的状态）"""
+        with self._lock:
+            now = time.time()
+            stats = {key: circuit.snapshot(now) for key, circuit in sorted(self._circuits.items())}
+            for (source, key), snapshot in sorted(self._remote.items()):
+                stats[f"{key}@{source}"] = snapshot
+            return stats
+
+
+# 全局熔断器
+circuit_breakers = CircuitBreakerRegistry()
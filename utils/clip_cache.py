@@ -3,15 +3,33 @@
 """
 CLIP 嵌入向量缓存管理器
 预计算并缓存图片的 CLIP 嵌入向量，加速检索
+2D 头像/身体素材与 3D 头像素材（HEAD_3D_FOLDERS）都使用该缓存，请求时只需编码检索文本
+
+构建缓存时图片解码/缩放在线程池中预取，CLIP 按批编码（CLIP_CACHE_BATCH_SIZE）
+
+索引按图片逐条记录（文件名、大小、修改时间、内容哈希）：素材增删改时只编码新增或内容变化的图片，
+删除的图片从索引中移除；有效性检查只比较文件夹修改时间
+
+新鲜度按周期检查（CLIP_CACHE_CHECK_INTERVAL）：本进程首次使用某个索引时同步比较一次文件夹修改时间，
+之后每个周期最多在后台线程完整校验一次（扫描文件大小/修改时间，可发现原地覆盖的图片），
+请求路径上不再扫描文件夹
+
+磁盘格式：每个文件夹一个 JSON 清单（<key>.json）+ 一个 float16 矩阵（<key>.<版本>.npy，
+另保留上一代矩阵供并发读取），
+矩阵以只读内存映射打开，多个工作进程共享操作系统页缓存，加载时无需反序列化
 """
 
 import os
-import glob
-import pickle
+import json
+import uuid
 import hashlib
 import logging
+import time
 import threading
-from typing import List, Tuple, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Callable, List, Tuple, Dict, Optional
 from pathlib import Path
 
 import numpy as np
@@ -23,6 +41,53 @@ logger = logging.getLogger(__name__)
 _GLOBAL_CACHE = None
 _CACHE_LOCK = threading.Lock()
 
+# 构建配置（可通过环境变量覆盖）
+CLIP_CACHE_BATCH_SIZE = int(os.environ.get("CLIP_CACHE_BATCH_SIZE", "32"))  # 每批编码的图片数
+CLIP_CACHE_DECODE_WORKERS = int(os.environ.get("CLIP_CACHE_DECODE_WORKERS", "4"))  # 图片解码线程数
+# 解码时把短边缩小到该尺寸（CLIP 输入为 224），0 表示不缩放
+CLIP_CACHE_IMAGE_SIZE = int(os.environ.get("CLIP_CACHE_IMAGE_SIZE", "224"))
+# 素材新鲜度检查周期（秒），0 表示每次使用都同步检查
+CLIP_CACHE_CHECK_INTERVAL = float(os.environ.get("CLIP_CACHE_CHECK_INTERVAL", "30"))
+
+# 缓存文件格式版本（旧格式的缓存会被重新构建）
+CACHE_FORMAT_VERSION = 3
+# 嵌入矩阵的存储精度
+EMBEDDING_DTYPE = np.float16
+
+# 素材图片扩展名
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# 进度回调：(已处理图片数, 总数, 预计剩余秒数)
+ProgressCallback = Callable[[int, int, float], None]
+
+# 3D 头像素材目录（与 ImageProcessor.head_folder_mapping 一致）
+HEAD_3D_FOLDERS = [
+    "data/face_front_per",
+    "data/face_left_turn_per",
+]
+
+
+@dataclass
+class _FileEntry:
+    """索引中的一张图片（文件名、大小、修改时间与内容哈希）"""
+    name: str
+    size: int
+    mtime_ns: int
+    sha1: str
+
+
+@dataclass
+class _FolderIndex:
+    """单个文件夹的向量索引：entries 与 embeddings 的行一一对应（按文件名排序）"""
+    folder_path: str
+    dir_mtime_ns: int
+    entries: List[_FileEntry]
+    embeddings: np.ndarray
+    
+    @cached_property
+    def files(self) -> List[str]:
+        return [os.path.join(self.folder_path, e.name) for e in self.entries]
+
 
 class CLIPEmbeddingCache:
     """CLIP 嵌入向量缓存"""
@@ -30,8 +95,15 @@ class CLIPEmbeddingCache:
     def __init__(self, cache_dir: str = "cache/clip_embeddings"):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self._memory_cache: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self._memory_cache: Dict[str, _FolderIndex] = {}
         self._clip_model = None
+        # 每个文件夹一把构建锁，避免并发请求与后台预构建重复编码同一文件夹
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._build_locks_lock = threading.Lock()
+        # 新鲜度检查：各文件夹上次检查时间（monotonic）与正在后台检查的文件夹
+        self._checked_at: Dict[str, float] = {}
+        self._refreshing: set = set()
+        self._refresh_lock = threading.Lock()
         logger.info(f"CLIPEmbeddingCache 初始化，缓存目录: {self.cache_dir}")
     
     def _get_clip_model(self):
@@ -41,159 +113,413 @@ class CLIPEmbeddingCache:
             self._clip_model = get_clip_model()
         return self._clip_model
     
-    def _get_folder_hash(self, folder_path: str) -> str:
-        """生成文件夹内容的哈希值（基于文件列表和修改时间）"""
-        image_files = self._get_image_files(folder_path)
-        if not image_files:
-            return ""
-        
-        # 基于文件名和修改时间生成哈希
-        content = []
-        for f in sorted(image_files):
+    def _get_cache_key(self, folder_path: str) -> str:
+        """缓存文件名（文件夹路径的哈希）"""
+        return hashlib.md5(folder_path.encode()).hexdigest()[:16]
+    
+    def _get_manifest_path(self, folder_path: str) -> Path:
+        """获取清单文件路径"""
+        return self.cache_dir / f"{self._get_cache_key(folder_path)}.json"
+    
+    @staticmethod
+    def _dir_mtime_ns(folder_path: str) -> int:
+        """文件夹修改时间（增删/重命名图片时变化），文件夹不存在时返回 -1"""
+        try:
+            return os.stat(folder_path).st_mtime_ns
+        except OSError:
+            return -1
+    
+    @staticmethod
+    def _scan_folder(folder_path: str) -> Dict[str, Tuple[int, int]]:
+        """列出文件夹中的图片：{文件名: (大小, 修改时间 ns)}"""
+        files = {}
+        try:
+            with os.scandir(folder_path) as it:
+                for entry in it:
+                    if os.path.splitext(entry.name)[1] not in IMAGE_EXTENSIONS or not entry.is_file():
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+        return files
+    
+    @staticmethod
+    def _content_hash(path: str) -> str:
+        """文件内容哈希（SHA-1）"""
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _load_image(img_path: str) -> Image.Image:
+        """解码图片并把短边缩小到 CLIP_CACHE_IMAGE_SIZE（在解码线程中执行）"""
+        with Image.open(img_path) as image:
+            if CLIP_CACHE_IMAGE_SIZE > 0:
+                # JPEG 可在解码阶段直接降采样
+                image.draft('RGB', (CLIP_CACHE_IMAGE_SIZE, CLIP_CACHE_IMAGE_SIZE))
+            image = image.convert('RGB')
+        short_side = min(image.size)
+        if 0 < CLIP_CACHE_IMAGE_SIZE < short_side:
+            scale = CLIP_CACHE_IMAGE_SIZE / short_side
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                 Image.BICUBIC)
+        return image
+    
+    def _load_index(self, folder_path: str) -> Optional[_FolderIndex]:
+        """从磁盘加载文件夹索引（不存在、格式不兼容或损坏时返回 None）；嵌入矩阵以只读内存映射打开"""
+        manifest_path = self._get_manifest_path(folder_path)
+        if not manifest_path.exists():
+            return None
+        # 读取清单后矩阵文件可能被其他进程的连续两次更新清理，此时重新读取一次清单
+        for attempt in range(2):
             try:
-                mtime = os.path.getmtime(f)
-                content.append(f"{f}:{mtime}")
-            except:
-                content.append(f)
-        
-        return hashlib.md5("|".join(content).encode()).hexdigest()[:16]
-    
-    def _get_cache_path(self, folder_path: str) -> Path:
-        """获取缓存文件路径"""
-        # 使用文件夹路径的哈希作为缓存文件名
-        folder_hash = hashlib.md5(folder_path.encode()).hexdigest()[:16]
-        return self.cache_dir / f"{folder_hash}.pkl"
-    
-    def _get_image_files(self, folder_path: str) -> List[str]:
-        """获取文件夹中的所有图片文件"""
-        extensions = ['*.png', '*.jpg', '*.jpeg', '*.bmp', '*.gif']
-        all_images = []
-        for ext in extensions:
-            all_images.extend(glob.glob(os.path.join(folder_path, ext)))
-        return sorted(all_images)
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') != CACHE_FORMAT_VERSION:
+                    return None
+                embeddings = np.load(self.cache_dir / manifest['embeddings_file'], mmap_mode='r')
+                break
+            except FileNotFoundError as e:
+                if attempt == 0:
+                    continue
+                logger.warning(f"加载缓存失败: {e}")
+                return None
+            except Exception as e:
+                logger.warning(f"加载缓存失败: {e}")
+                return None
+        try:
+            entries = [_FileEntry(*e) for e in manifest['entries']]
+            if embeddings.shape[0] != len(entries):
+                logger.warning(f"缓存清单与嵌入矩阵行数不一致，忽略: {folder_path}")
+                return None
+            return _FolderIndex(
+                folder_path=folder_path,
+                dir_mtime_ns=manifest['dir_mtime_ns'],
+                entries=entries,
+                embeddings=embeddings
+            )
+        except Exception as e:
+            logger.warning(f"加载缓存失败: {e}")
+            return None
     
-    def has_cache(self, folder_path: str) -> bool:
-        """检查是否存在有效缓存"""
-        # 检查内存缓存
-        if folder_path in self._memory_cache:
-            return True
+    def _save_index(self, index: _FolderIndex) -> _FolderIndex:
+        """
+        保存文件夹索引，返回嵌入矩阵改为内存映射的索引
+        
+        每次保存写入新的矩阵文件，再原子替换清单：其他进程要么看到旧清单与旧矩阵，要么看到新的，
+        不会读到写了一半的缓存；上一代矩阵文件保留（刚读到旧清单的进程仍能加载），
+        只删除更早一代的矩阵（已映射的进程不受影响）
+        """
+        key = self._get_cache_key(index.folder_path)
+        manifest_path = self._get_manifest_path(index.folder_path)
+        previous = older = None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                previous_manifest = json.load(f)
+            previous = previous_manifest.get('embeddings_file')
+            older = previous_manifest.get('previous_embeddings_file')
+        except (OSError, ValueError, AttributeError):
+            pass
+        
+        embeddings_file = f"{key}.{uuid.uuid4().hex[:8]}.npy"
+        np.save(self.cache_dir / embeddings_file, np.asarray(index.embeddings, dtype=EMBEDDING_DTYPE))
+        manifest = {
+            'version': CACHE_FORMAT_VERSION,
+            'folder_path': index.folder_path,
+            'dir_mtime_ns': index.dir_mtime_ns,
+            'embeddings_file': embeddings_file,
+            'previous_embeddings_file': previous,
+            'entries': [(e.name, e.size, e.mtime_ns, e.sha1) for e in index.entries]
+        }
+        tmp_path = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+        
+        # 清理更早一代的矩阵与旧版本的 pickle 缓存（Windows 下被映射的文件删除失败时保留）
+        for stale in (older, f"{key}.pkl"):
+            if stale and stale not in (embeddings_file, previous):
+                try:
+                    (self.cache_dir / stale).unlink()
+                except OSError:
+                    pass
         
-        # 检查磁盘缓存
-        cache_path = self._get_cache_path(folder_path)
-        if not cache_path.exists():
-            return False
+        index.embeddings = np.load(self.cache_dir / embeddings_file, mmap_mode='r')
+        return index
+    
+    def _get_index(self, folder_path: str) -> Optional[_FolderIndex]:
+        """获取文件夹索引（内存优先，其次磁盘），不检查是否过期"""
+        index = self._memory_cache.get(folder_path)
+        if index is None:
+            index = self._load_index(folder_path)
+            if index is not None:
+                self._memory_cache[folder_path] = index
+                logger.info(f"从缓存加载: {folder_path} ({len(index.entries)} 张)")
+        return index
+    
+    def _is_fresh(self, index: _FolderIndex) -> bool:
+        """索引记录的文件夹修改时间与当前一致（只需一次 stat）"""
+        return index.dir_mtime_ns == self._dir_mtime_ns(index.folder_path)
+    
+    def _ensure_fresh(self, folder_path: str, index: _FolderIndex) -> Optional[_FolderIndex]:
+        """
+        按周期检查索引是否过期
         
-        # 验证缓存是否过期
+        - 本进程首次使用（或检查周期为 0）：同步比较文件夹修改时间（一次 stat），过期时增量更新
+        - 距上次检查超过 CLIP_CACHE_CHECK_INTERVAL：在后台完整校验，本次直接返回当前索引
+        - 其余情况直接返回当前索引
+        """
+        checked_at = self._checked_at.get(folder_path)
+        if checked_at is None or CLIP_CACHE_CHECK_INTERVAL <= 0:
+            self._checked_at[folder_path] = time.monotonic()
+            if self._is_fresh(index):
+                return index
+            with self._get_build_lock(folder_path):
+                return self._update_index(folder_path)
+        if time.monotonic() - checked_at >= CLIP_CACHE_CHECK_INTERVAL:
+            self._schedule_refresh(folder_path)
+        return index
+    
+    def _schedule_refresh(self, folder_path: str):
+        """在后台线程中校验并增量更新文件夹索引（同一文件夹同时只有一个检查）"""
+        with self._refresh_lock:
+            if folder_path in self._refreshing:
+                return
+            self._refreshing.add(folder_path)
+        threading.Thread(target=self._background_refresh, args=(folder_path,), daemon=True,
+                         name="CLIPCacheRefresh").start()
+    
+    def _background_refresh(self, folder_path: str):
         try:
-            with open(cache_path, 'rb') as f:
-                cached = pickle.load(f)
-            stored_hash = cached.get('folder_hash', '')
-            current_hash = self._get_folder_hash(folder_path)
-            return stored_hash == current_hash
-        except Exception:
-            return False
-    
-    def build_cache(self, folder_path: str, force: bool = False) -> bool:
+            with self._get_build_lock(folder_path):
+                self._update_index(folder_path, verify=True)
+        except Exception as e:
+            logger.warning(f"后台检查 CLIP 缓存失败: {folder_path}, {e}")
+            self._checked_at[folder_path] = time.monotonic()
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(folder_path)
+    
+    def has_cache(self, folder_path: str) -> bool:
+        """
+        检查是否存在有效缓存
+        
+        按周期检查新鲜度（见 _ensure_fresh），周期内的调用不访问文件系统
+        """
+        index = self._get_index(folder_path)
+        return index is not None and self._ensure_fresh(folder_path, index) is not None
+    
+    def _get_build_lock(self, folder_path: str) -> threading.Lock:
+        with self._build_locks_lock:
+            lock = self._build_locks.get(folder_path)
+            if lock is None:
+                lock = self._build_locks[folder_path] = threading.Lock()
+            return lock
+    
+    def build_cache(self, folder_path: str, force: bool = False,
+                    progress_callback: Optional[ProgressCallback] = None) -> bool:
         """
-        预计算并保存图片嵌入
+        预计算并保存图片嵌入（增量：只编码新增或内容变化的图片，删除的图片从索引中移除）
         
         Args:
             folder_path: 图片文件夹路径
-            force: 是否强制重建缓存
-            
+            force: 是否强制重建缓存（全部重新编码）
+            progress_callback: 进度回调 (已处理数, 总数, 预计剩余秒数)，每批编码后调用
+        
         Returns:
             bool: 是否成功
         """
-        if not force and self.has_cache(folder_path):
-            logger.info(f"缓存已存在，跳过: {folder_path}")
-            return True
+        with self._get_build_lock(folder_path):
+            return self._update_index(folder_path, force, progress_callback) is not None
+    
+    def _encode_batch(self, model, paths: List[str], images: List[Image.Image]) -> Tuple[List[str], List[np.ndarray]]:
+        """编码一批图片；整批失败时逐张编码，跳过无法编码的图片"""
+        try:
+            embs = model.encode(images, batch_size=len(images), convert_to_tensor=False,
+                                normalize_embeddings=True)
+            return paths, list(embs)
+        except Exception as e:
+            logger.warning(f"批量编码失败，改为逐张编码: {e}")
+        valid_paths, embs = [], []
+        for path, image in zip(paths, images):
+            try:
+                embs.append(model.encode([image], convert_to_tensor=False, normalize_embeddings=True)[0])
+                valid_paths.append(path)
+            except Exception as e:
+                logger.warning(f"处理图片失败 {path}: {e}")
+        return valid_paths, embs
+    
+    def _encode_files(self, image_files: List[str],
+                      progress_callback: Optional[ProgressCallback] = None) -> Dict[str, np.ndarray]:
+        """批量编码图片（解码在线程池中预取），返回 {路径: 嵌入}，跳过无法处理的图片"""
+        total = len(image_files)
+        batch_size = max(1, CLIP_CACHE_BATCH_SIZE)
+        model = self._get_clip_model()
+        encoded = {}
+        start = time.time()
+        batches = [image_files[i:i + batch_size] for i in range(0, total, batch_size)]
         
-        image_files = self._get_image_files(folder_path)
-        if not image_files:
-            logger.warning(f"文件夹中无图片: {folder_path}")
-            return False
+        with ThreadPoolExecutor(max_workers=max(1, CLIP_CACHE_DECODE_WORKERS),
+                                thread_name_prefix="CLIPDecode") as pool:
+            # 编码当前批次时，下一批次已在线程池中解码
+            pending = [pool.submit(self._load_image, p) for p in batches[0]] if batches else []
+            done = 0
+            for index, batch in enumerate(batches):
+                futures = pending
+                pending = ([pool.submit(self._load_image, p) for p in batches[index + 1]]
+                           if index + 1 < len(batches) else [])
+                
+                paths, images = [], []
+                for img_path, future in zip(batch, futures):
+                    try:
+                        images.append(future.result())
+                        paths.append(img_path)
+                    except Exception as e:
+                        logger.warning(f"处理图片失败 {img_path}: {e}")
+                if images:
+                    encoded.update(zip(*self._encode_batch(model, paths, images)))
+                
+                done += len(batch)
+                elapsed = time.time() - start
+                eta = elapsed / done * (total - done)
+                logger.debug(f"CLIP 编码进度: {done}/{total}，预计剩余 {eta:.1f}秒")
+                if progress_callback:
+                    try:
+                        progress_callback(done, total, eta)
+                    except Exception as e:
+                        logger.debug(f"进度回调失败: {e}")
+        return encoded
+    
+    def _update_index(self, folder_path: str, force: bool = False,
+                      progress_callback: Optional[ProgressCallback] = None,
+                      verify: bool = False) -> Optional[_FolderIndex]:
+        """
+        增量更新文件夹索引（需持有文件夹构建锁）
         
-        logger.info(f"开始构建 CLIP 缓存: {folder_path} ({len(image_files)} 张图片)")
+        大小与修改时间未变的图片直接复用；变化的图片计算内容哈希，哈希已在索引中
+        （只是被 touch 或重命名）时复用原嵌入，否则重新编码
         
-        model = self._get_clip_model()
-        embeddings = []
-        valid_files = []
+        Args:
+            force: 忽略已有索引，全部重新编码
+            verify: 文件夹修改时间未变时也扫描文件（发现原地覆盖的图片），无变化时不重写缓存
+        """
+        index = None if force else self._get_index(folder_path)
+        if index is not None and not verify and self._is_fresh(index):
+            self._checked_at[folder_path] = time.monotonic()
+            return index
+        
+        # 先记录文件夹修改时间再扫描：扫描期间有变化时，下次检查会发现索引过期
+        dir_mtime_ns = self._dir_mtime_ns(folder_path)
+        scanned = self._scan_folder(folder_path)
+        self._checked_at[folder_path] = time.monotonic()
+        if not scanned:
+            logger.warning(f"文件夹中无图片: {folder_path}")
+            self._memory_cache.pop(folder_path, None)
+            return None
         
-        for img_path in image_files:
+        old_by_name: Dict[str, Tuple[_FileEntry, int]] = {}
+        old_by_hash: Dict[str, int] = {}
+        if index is not None:
+            for row, entry in enumerate(index.entries):
+                old_by_name[entry.name] = (entry, row)
+                old_by_hash[entry.sha1] = row
+        
+        entries: List[_FileEntry] = []
+        rows: List[Optional[int]] = []  # 复用的旧行号，None 表示需要编码
+        to_encode: List[str] = []
+        for name in sorted(scanned):
+            size, mtime_ns = scanned[name]
+            previous = old_by_name.get(name)
+            if previous is not None and previous[0].size == size and previous[0].mtime_ns == mtime_ns:
+                entries.append(previous[0])
+                rows.append(previous[1])
+                continue
+            path = os.path.join(folder_path, name)
             try:
-                image = Image.open(img_path).convert('RGB')
-                emb = model.encode([image], convert_to_tensor=False, normalize_embeddings=True)
-                embeddings.append(emb[0])
-                valid_files.append(img_path)
-            except Exception as e:
-                logger.warning(f"处理图片失败 {img_path}: {e}")
+                sha1 = self._content_hash(path)
+            except OSError as e:
+                logger.warning(f"读取图片失败 {path}: {e}")
+                continue
+            entries.append(_FileEntry(name, size, mtime_ns, sha1))
+            rows.append(old_by_hash.get(sha1))
+            if rows[-1] is None:
+                to_encode.append(path)
         
-        if not embeddings:
-            logger.error(f"无有效嵌入: {folder_path}")
-            return False
+        if (index is not None and not to_encode and dir_mtime_ns == index.dir_mtime_ns
+                and entries == index.entries and rows == list(range(len(index.entries)))):
+            return index
         
-        embeddings_array = np.array(embeddings)
+        removed = len(set(old_by_name) - set(scanned))
+        if index is None:
+            logger.info(f"开始构建 CLIP 缓存: {folder_path} ({len(entries)} 张图片, batch={CLIP_CACHE_BATCH_SIZE})")
+        else:
+            logger.info(f"增量更新 CLIP 缓存: {folder_path} (编码 {len(to_encode)} 张, 删除 {removed} 张)")
         
-        # 保存到磁盘
-        cache_data = {
-            'folder_path': folder_path,
-            'folder_hash': self._get_folder_hash(folder_path),
-            'image_files': valid_files,
-            'embeddings': embeddings_array
-        }
+        start = time.time()
+        encoded = self._encode_files(to_encode, progress_callback) if to_encode else {}
+        
+        vectors = []
+        kept_entries = []
+        for entry, row in zip(entries, rows):
+            if row is not None:
+                vectors.append(index.embeddings[row])
+            else:
+                emb = encoded.get(os.path.join(folder_path, entry.name))
+                if emb is None:
+                    continue
+                vectors.append(emb)
+            kept_entries.append(entry)
         
-        cache_path = self._get_cache_path(folder_path)
-        with open(cache_path, 'wb') as f:
-            pickle.dump(cache_data, f)
+        if not vectors:
+            logger.error(f"无有效嵌入: {folder_path}")
+            self._memory_cache.pop(folder_path, None)
+            return None
         
-        # 保存到内存
-        self._memory_cache[folder_path] = (valid_files, embeddings_array)
+        new_index = _FolderIndex(
+            folder_path=folder_path,
+            dir_mtime_ns=dir_mtime_ns,
+            entries=kept_entries,
+            embeddings=np.asarray(vectors, dtype=np.float32)
+        )
+        new_index = self._save_index(new_index)
+        self._memory_cache[folder_path] = new_index
         
-        logger.info(f"✅ 缓存构建完成: {folder_path} ({len(valid_files)} 张)")
-        return True
+        logger.info(f"✅ 缓存构建完成: {folder_path} ({len(kept_entries)} 张, {time.time() - start:.1f}秒)")
+        return new_index
     
     def get_embeddings(self, folder_path: str) -> Tuple[List[str], Optional[np.ndarray]]:
         """
-        获取缓存的嵌入向量
+        获取缓存的嵌入向量（按周期检查新鲜度，素材有变化时增量更新）
         
         Returns:
-            Tuple[文件路径列表, 嵌入矩阵] 或 ([], None)
+            Tuple[文件路径列表, 嵌入矩阵] 或 ([], None)（从未构建过缓存）
         """
-        # 优先从内存获取
-        if folder_path in self._memory_cache:
-            return self._memory_cache[folder_path]
-        
-        # 从磁盘加载
-        cache_path = self._get_cache_path(folder_path)
-        if cache_path.exists():
-            try:
-                with open(cache_path, 'rb') as f:
-                    cached = pickle.load(f)
-                
-                # 验证哈希
-                if cached.get('folder_hash') == self._get_folder_hash(folder_path):
-                    files = cached['image_files']
-                    embeddings = cached['embeddings']
-                    self._memory_cache[folder_path] = (files, embeddings)
-                    logger.info(f"从缓存加载: {folder_path} ({len(files)} 张)")
-                    return files, embeddings
-            except Exception as e:
-                logger.warning(f"加载缓存失败: {e}")
-        
-        return [], None
+        index = self._get_index(folder_path)
+        if index is None:
+            return [], None
+        index = self._ensure_fresh(folder_path, index)
+        if index is None:
+            return [], None
+        return index.files, index.embeddings
     
-    def search(self, text_embedding: np.ndarray, folder_path: str, 
-               top_k: int = 5) -> List[Dict]:
+    def score(self, text_embedding: np.ndarray, folder_path: str) -> Tuple[List[str], Optional[np.ndarray]]:
         """
-        基于文本嵌入搜索最相似图片
+        计算文件夹内所有图片与文本嵌入的余弦相似度（一次矩阵-向量乘法）
+        
+        无缓存时先构建（只在首次使用或素材变化后发生）
         
         Args:
-            text_embedding: 文本嵌入向量 (1, D)
+            text_embedding: 文本嵌入向量 (D,) 或 (1, D)
             folder_path: 图片文件夹路径
-            top_k: 返回前 k 个结果
-            
+        
         Returns:
-            List[Dict]: 匹配结果列表
+            Tuple[文件路径列表, 相似度数组] 或 ([], None)
         """
         files, embeddings = self.get_embeddings(folder_path)
         
@@ -203,18 +529,29 @@ class CLIPEmbeddingCache:
                 files, embeddings = self.get_embeddings(folder_path)
             
             if embeddings is None:
-                return []
+                return [], None
         
-        # 计算余弦相似度
-        if len(text_embedding.shape) == 1:
-            text_embedding = text_embedding.reshape(1, -1)
-        
-        # 归一化
-        text_norm = text_embedding / (np.linalg.norm(text_embedding, axis=1, keepdims=True) + 1e-8)
-        emb_norm = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8)
+        # 图片嵌入构建时已归一化，只需归一化文本
+        text_vec = np.asarray(text_embedding, dtype=np.float32).reshape(-1)
+        text_vec = text_vec / (np.linalg.norm(text_vec) + 1e-8)
+        return files, embeddings @ text_vec
+    
+    def search(self, text_embedding: np.ndarray, folder_path: str, 
+               top_k: int = 5) -> List[Dict]:
+        """
+        基于文本嵌入搜索最相似图片
         
-        # 计算相似度
-        similarities = np.dot(emb_norm, text_norm.T).flatten()
+        Args:
+            text_embedding: 文本嵌入向量 (1, D)
+            folder_path: 图片文件夹路径
+            top_k: 返回前 k 个结果
+            
+        Returns:
+            List[Dict]: 匹配结果列表
+        """
+        files, similarities = self.score(text_embedding, folder_path)
+        if similarities is None:
+            return []
         
         # 获取 top_k
         top_indices = np.argsort(similarities)[::-1][:top_k]
@@ -243,7 +580,7 @@ def get_clip_cache() -> CLIPEmbeddingCache:
     return _GLOBAL_CACHE
 
 
-def prebuild_2d_cache():
+def prebuild_2d_cache(progress_callback: Optional[ProgressCallback] = None):
     """预构建所有 2D 素材的缓存"""
     cache = get_clip_cache()
     
@@ -265,11 +602,30 @@ def prebuild_2d_cache():
     
     for folder in folders:
         if os.path.exists(folder):
-            cache.build_cache(folder)
+            cache.build_cache(folder, progress_callback=progress_callback)
     
     logger.info("✅ 2D 素材缓存预构建完成")
 
 
+def prebuild_3d_head_cache(progress_callback: Optional[ProgressCallback] = None):
+    """预构建 3D 头像素材的缓存"""
+    cache = get_clip_cache()
+    
+    for folder in HEAD_3D_FOLDERS:
+        if os.path.exists(folder):
+            try:
+                cache.build_cache(folder, progress_callback=progress_callback)
+            except Exception as e:
+                logger.warning(f"预构建 3D 头像缓存失败（将在首次检索时构建）: {folder}, {e}")
+    
+    logger.info("✅ 3D 头像缓存预构建完成")
+
+
+def _print_progress(done: int, total: int, eta: float):
+    print(f"\r  {done}/{total}  预计剩余 {eta:.1f}秒", end="\n" if done >= total else "", flush=True)
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    prebuild_2d_cache()
+    prebuild_2d_cache(_print_progress)
+    prebuild_3d_head_cache(_print_progress)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+截止时间预算与对冲请求
+下游调用（远程图片生成等）的超时、重试与对冲都以任务截止时间为预算：
+
+- remaining_timeout(): 单次请求的超时不超过任务剩余时间，剩余时间不足时抛出 DeadlineExceededError
+- retry_allowed(): 退避等待之后剩余时间不够一次请求时不再重试
+- hedged_call(): 请求超过该接口历史 p95 延迟仍未返回时再发出一个相同的请求，取先成功的结果；
+  对冲请求会增加下游调用量，默认关闭（HEDGE_ENABLED=true 开启），
+  且历史样本不足 HEDGE_MIN_SAMPLES 时不对冲
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from .cancellation import DeadlineExceededError
+
+logger = logging.getLogger(__name__)
+
+# 配置（可通过环境变量覆盖）
+DEADLINE_MIN_ATTEMPT = float(os.environ.get("DEADLINE_MIN_ATTEMPT", "5"))  # 一次请求至少需要的时间（秒）
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "5"))  # 对冲延迟下限（秒）
+HEDGE_MAX_WORKERS = int(os.environ.get("HEDGE_MAX_WORKERS", "32"))
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def remaining_timeout(timeout: float, deadline: Optional[float]) -> float:
+    """
+    按截止时间裁剪单次请求超时
+
+    Args:
+        timeout: 默认超时（秒）
+        deadline: 任务截止时间（time.time() 时间戳，None 表示不限制）
+
+    Raises:
+        DeadlineExceededError: 剩余时间不足 DEADLINE_MIN_ATTEMPT
+    """
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.time()
+    if remaining < DEADLINE_MIN_ATTEMPT:
+        raise DeadlineExceededError()
+    return min(timeout, remaining)
+
+
+def retry_allowed(deadline: Optional[float], delay: float) -> bool:
+    """等待 delay 秒后是否还有时间完成一次请求"""
+    return deadline is None or time.time() + delay + DEADLINE_MIN_ATTEMPT <= deadline
+
+
+class LatencyTracker:
+    """按接口统计最近的成功请求延迟（线程安全）"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: Dict[str, deque] = {}
+        self._hedges: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float):
+        """记录一次成功请求的耗时"""
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.size)
+            samples.append(seconds)
+
+    def percentile(self, key: str, q: float) -> Optional[float]:
+        """延迟分位数（样本不足 HEDGE_MIN_SAMPLES 时返回 None）"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[int((len(samples) - 1) * q)]
+
+    def record_hedge(self, key: str, won: bool):
+        """记录一次对冲（won: 对冲请求先于原请求成功）"""
+        with self._lock:
+            item = self._hedges.setdefault(key, {"hedged": 0, "hedge_wins": 0})
+            item["hedged"] += 1
+            if won:
+                item["hedge_wins"] += 1
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取各接口的延迟与对冲统计"""
+        with self._lock:
+            keys = sorted(set(self._samples) | set(self._hedges))
+            stats = {}
+            for key in keys:
+                samples = sorted(self._samples.get(key, ()))
+                stats[key] = {
+                    "samples": len(samples),
+                    "p50_latency": round(samples[len(samples) // 2], 2) if samples else 0,
+                    "p95_latency": round(samples[int((len(samples) - 1) * 0.95)], 2) if samples else 0,
+                    **self._hedges.get(key, {"hedged": 0, "hedge_wins": 0})
+                }
+            return stats
+
+
+# 全局延迟统计
+latency_tracker = LatencyTracker()
+
+
+def hedge_delay(key: str) -> Optional[float]:
+    """对冲延迟（历史 p95，不低于 HEDGE_MIN_DELAY）；未开启或样本不足时返回 None"""
+    if not HEDGE_ENABLED:
+        return None
+    p95 = latency_tracker.percentile(key, HEDGE_PERCENTILE)
+    if p95 is None:
+        return None
+    return max(HEDGE_MIN_DELAY, p95)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """获取对冲请求线程池（懒创建）"""
+    global _EXECUTOR
+
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="Hedge")
+    return _EXECUTOR
+
+
+def hedged_call(
+    key: str,
+    func: Callable[[], Any],
+    delay: float,
+    is_success: Callable[[Any], bool],
+    deadline: Optional[float] = None
+) -> Any:
+    """
+    对冲调用：func 超过 delay 秒未返回时再调用一次，返回先成功的结果
+
+    落后的调用无法中断，会在后台自然结束；两次都失败时返回原调用的结果（或抛出其异常）
+
+    Args:
+        key: 接口标识（用于统计）
+        func: 无参调用
+        delay: 对冲延迟（秒）
+        is_success: 判断结果是否成功
+        deadline: 任务截止时间，剩余时间不够一次请求时不再对冲
+    """
+    executor = _get_executor()
+    primary = executor.submit(func)
+    done, _ = wait([primary], timeout=delay)
+    if done or not retry_allowed(deadline, 0):
+        return primary.result()
+
+    logger.info(f"[对冲] {key} 请求超过 {delay:.1f}秒未返回，发出对冲请求")
+    hedge = executor.submit(func)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception:
+                continue
+            if is_success(result):
+                latency_tracker.record_hedge(key, won=future is hedge)
+                return result
+    latency_tracker.record_hedge(key, won=False)
+    return primary.result()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务耗时预测器
+按 生成模式 / 动作类型 / 配件数量 分类统计任务耗时（滑动窗口分位数 p50/p90），
+用于排队预估等待时间
+
+分类由细到粗逐级回退：
+    3D|站姿|2  ->  3D|*|2  ->  3D  ->  *
+样本不足时使用更粗的分类，全部为空时使用默认值
+"""
+
+import threading
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 参与计数的配件字段及视为"无"的取值
+_ACCESSORY_KEYS = ('上装', '下装', '头戴', '手持', '背景')
+_EMPTY_VALUES = ('', '无', 'none', 'null', '-', '没有')
+
+
+def count_accessories(analysis: Optional[Dict]) -> int:
+    """统计分析结果中的有效配件数量"""
+    if not analysis:
+        return 0
+    count = 0
+    for key in _ACCESSORY_KEYS:
+        value = str(analysis.get(key) or '').strip().lower()
+        if value not in _EMPTY_VALUES:
+            count += 1
+    return count
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    """线性插值分位数"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+class DurationPredictor:
+    """任务耗时预测器（线程安全）"""
+
+    def __init__(self, default_duration: float = 60.0, window_size: int = 50, min_samples: int = 3):
+        """
+        Args:
+            default_duration: 没有任何样本时的默认耗时（秒）
+            window_size: 每个分类保留的最近样本数
+            min_samples: 使用某个分类进行预测所需的最少样本数
+        """
+        self.default_duration = default_duration
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def class_keys(mode: str, action: str = "", accessories: Optional[int] = None) -> List[str]:
+        """
+        生成从细到粗的分类键列表
+
+        Args:
+            mode: 生成模式（2D / 3D）
+            action: 动作类型（未知时为空）
+            accessories: 配件数量（未知时为 None）
+        """
+        mode = mode or "3D"
+        keys = []
+        if accessories is not None:
+            if action:
+                keys.append(f"{mode}|{action}|{accessories}")
+            keys.append(f"{mode}|*|{accessories}")
+        keys.append(mode)
+        keys.append("*")
+        return keys
+
+    def record(self, keys: List[str], duration: float):
+        """记录一次任务耗时（写入所有层级的分类）"""
+        if duration <= 0:
+            return
+        with self._lock:
+            for key in keys:
+                samples = self._samples.get(key)
+                if samples is None:
+                    samples = self._samples[key] = deque(maxlen=self.window_size)
+                samples.append(duration)
+
+    def predict(self, keys: List[str], quantile: float = 0.5) -> float:
+        """
+        预测任务耗时
+
+        Args:
+            keys: class_keys() 生成的分类键（从细到粗）
+            quantile: 分位数（默认 p50）
+        """
+        with self._lock:
+            for i, key in enumerate(keys):
+                samples = self._samples.get(key)
+                if not samples:
+                    continue
+                # 最粗的分类有样本就使用，细分类需要足够样本
+                if len(samples) >= self.min_samples or i == len(keys) - 1:
+                    return _quantile(sorted(samples), quantile)
+        return self.default_duration
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取各分类的耗时分布"""
+        with self._lock:
+            snapshot = {key: sorted(samples) for key, samples in self._samples.items()}
+        return {
+            key: {
+                "count": len(values),
+                "p50": round(_quantile(values, 0.5), 1),
+                "p90": round(_quantile(values, 0.9), 1)
+            }
+            for key, values in sorted(snapshot.items())
+        }
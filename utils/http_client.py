@@ -2,7 +2,13 @@
 # -*- coding: utf-8 -*-
 """
 HTTP 客户端模块
-提供全局共享的 HTTP Session，复用 TCP 连接
+http_post / http_get 默认走共享的异步 HTTP 客户端（httpx，HTTP/2，按主机限制并发），
+未安装 httpx、设置 HTTP_CLIENT_BACKEND=requests 或需要流式读取时使用共享的 requests Session
+请求结果（含每次重试前的 429/5xx/超时）会上报给准入控制，用于统计下游健康度
+请求按 (主机, 模型) 经过熔断器，下游熔断中时直接抛出 CircuitOpenError
+
+所有出站 HTTP 请求都应经过本模块（或 LLM 网关），不要直接调用 requests.post/get，
+部署前由 utils.http_guard 检查
 """
 
 import threading
@@ -13,27 +19,51 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from .admission import record_upstream
+from .async_http import get_async_client, close_async_client
+from .circuit_breaker import circuit_breakers
+
 logger = logging.getLogger(__name__)
 
 # 全局 Session 实例
 _http_session: Optional[requests.Session] = None
+# 调用方指定重试次数时使用的 Session（重试次数 -> Session），如自行控制重试的 LLM 网关使用 0 次
+_retry_sessions: Dict[int, requests.Session] = {}
 _session_lock = threading.Lock()
 
+# 异步客户端支持的 requests 参数（其余参数如 stream/verify 使用 requests Session）
+_ASYNC_KWARGS = {"params", "data", "files", "cookies", "allow_redirects"}
+
+# 模型服务请求统一使用的 User-Agent
+USER_AGENT = "JoyIP-3D-System/1.0"
+
 
-def get_http_session() -> requests.Session:
+def get_http_session(max_retries: Optional[int] = None) -> requests.Session:
     """
     获取全局共享的 HTTP Session
     
     特性：
     - 连接池复用（减少 TCP 握手开销）
-    - 自动重试（3次，指数退避）
+    - 自动重试（默认3次，指数退避）
     - 线程安全
     
+    Args:
+        max_retries: 重试次数（None 使用默认的 3 次；调用方自行控制重试时传 0）
+    
     Returns:
         requests.Session: 共享的 Session 实例
     """
     global _http_session
     
+    if max_retries is not None:
+        session = _retry_sessions.get(max_retries)
+        if session is None:
+            with _session_lock:
+                session = _retry_sessions.get(max_retries)
+                if session is None:
+                    session = _retry_sessions[max_retries] = _create_session(max_retries)
+        return session
+    
     if _http_session is None:
         with _session_lock:
             if _http_session is None:
@@ -43,13 +73,34 @@ def get_http_session() -> requests.Session:
     return _http_session
 
 
-def _create_session() -> requests.Session:
-    """创建配置好的 Session"""
+class _TrackingRetry(Retry):
+    """重试策略：每次触发重试（429/5xx/超时/连接错误）时上报一次失败"""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        target = f"{_pool.scheme}://{_pool.host}" if _pool is not None else (url or "")
+        try:
+            record_upstream(target, getattr(response, "status", None), error=error is not None)
+        except Exception as e:
+            logger.debug(f"上报下游请求结果失败: {e}")
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _record_response(response: requests.Response, *args, **kwargs):
+    """响应钩子：上报最终响应的状态码与耗时"""
+    try:
+        record_upstream(response.url, response.status_code, response.elapsed.total_seconds())
+    except Exception as e:
+        logger.debug(f"上报下游请求结果失败: {e}")
+
+
+def _create_session(max_retries: int = 3) -> requests.Session:
+    """创建配置好的 Session（max_retries 为 0 时不做任何重试，429/5xx 响应直接返回给调用方）"""
     session = requests.Session()
+    session.hooks['response'].append(_record_response)
     
     # 配置重试策略（包含429频率限制错误）
-    retry_strategy = Retry(
-        total=3,
+    retry_strategy = Retry(total=0, read=False) if max_retries <= 0 else _TrackingRetry(
+        total=max_retries,
         backoff_factor=1.0,  # 增加退避时间：1s, 2s, 4s
         status_forcelist=[429, 500, 502, 503, 504],  # 添加429
         allowed_methods=["GET", "POST"],
@@ -69,28 +120,53 @@ def _create_session() -> requests.Session:
     return session
 
 
+def _send(method: str, url: str, model: Optional[str], timeout, max_retries: Optional[int],
+          call_type: Optional[str] = None, **kwargs) -> requests.Response:
+    """经过熔断器发送请求（参数均被异步客户端支持时走异步客户端，否则走 requests Session）"""
+    key = circuit_breakers.acquire(url, model, call_type)
+    status_code = None
+    try:
+        client = get_async_client()
+        if client is not None and _ASYNC_KWARGS.issuperset(set(kwargs) - {"json", "headers"}):
+            response = client.request_sync(method, url, timeout=timeout, max_retries=max_retries, **kwargs)
+        else:
+            # 调用方指定重试次数时使用对应的 Session，避免底层再按默认次数重试
+            response = get_http_session(max_retries).request(method, url, timeout=timeout, **kwargs)
+        status_code = response.status_code
+        return response
+    finally:
+        circuit_breakers.record_response(key, status_code)
+
+
 def http_post(
     url: str,
     json: Optional[Dict] = None,
     headers: Optional[Dict] = None,
     timeout: int = 60,
+    max_retries: Optional[int] = None,
+    call_type: Optional[str] = None,
     **kwargs
 ) -> requests.Response:
     """
-    发送 POST 请求（使用共享 Session）
+    发送 POST 请求（使用共享连接池）
     
     Args:
         url: 请求 URL
         json: JSON 数据
         headers: 请求头
         timeout: 超时时间（秒）
+        max_retries: 重试次数（None 使用默认配置；仅异步客户端生效）
+        call_type: 调用类型（可选），与主机、模型一起作为熔断维度，使该类调用独立熔断
         **kwargs: 其他 requests 参数
         
     Returns:
         requests.Response
+
+    Raises:
+        CircuitOpenError: 下游（主机 + 请求体中的 model + 调用类型）熔断中
     """
-    session = get_http_session()
-    return session.post(url, json=json, headers=headers, timeout=timeout, **kwargs)
+    model = json.get("model") if isinstance(json, dict) else None
+    return _send("POST", url, model, timeout, max_retries, call_type, json=json, headers=headers, **kwargs)
 
 
 def http_get(
@@ -100,7 +176,7 @@ def http_get(
     **kwargs
 ) -> requests.Response:
     """
-    发送 GET 请求（使用共享 Session）
+    发送 GET 请求（使用共享连接池）
     
     Args:
         url: 请求 URL
@@ -110,9 +186,32 @@ def http_get(
         
     Returns:
         requests.Response
+
+    Raises:
+        CircuitOpenError: 下游主机熔断中
+    """
+    return _send("GET", url, None, timeout, None, headers=headers, **kwargs)
+
+
+def api_headers(api_key: str, trace_id: Optional[str] = None) -> Dict[str, str]:
+    """
+    模型服务接口的请求头
+
+    连接复用（keep-alive）与压缩协商由共享客户端处理，调用方不需要自行设置
+
+    Args:
+        api_key: Bearer 令牌
+        trace_id: 链路追踪标识（可选）
     """
-    session = get_http_session()
-    return session.get(url, headers=headers, timeout=timeout, **kwargs)
+    headers = {
+        "Accept": "*/*",
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "User-Agent": USER_AGENT
+    }
+    if trace_id:
+        headers["Trace-Id"] = trace_id
+    return headers
 
 
 def parse_ai_response(data: Dict[str, Any]) -> str:
@@ -176,10 +275,17 @@ def parse_ai_response(data: Dict[str, Any]) -> str:
 
 
 def close_session():
-    """关闭全局 Session（通常在应用退出时调用）"""
+    """关闭全局 Session 与异步客户端（通常在应用退出时调用）"""
     global _http_session
-    
+
+    close_async_client()
     with _session_lock:
+        for session in _retry_sessions.values():
+            try:
+                session.close()
+            except Exception as e:
+                logger.warning(f"关闭 HTTP Session 失败: {e}")
+        _retry_sessions.clear()
         if _http_session is not None:
             try:
                 _http_session.close()
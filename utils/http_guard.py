@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+出站 HTTP 调用检查
+所有出站请求都应经过共享客户端（utils.http_client / LLM 网关），
+直接使用 requests.post/get、requests.Session、httpx 或 urllib 会绕过连接复用、熔断与下游统计
+
+用法（在项目根目录，发现违规时退出码为 1，deploy.sh 部署前执行）：
+    python3 utils/http_guard.py
+"""
+
+import os
+import ast
+import sys
+from typing import List, Tuple
+
+# 允许直接创建客户端的模块（共享客户端本身）
+ALLOWED_FILES = {
+    os.path.join("utils", "http_client.py"),
+    os.path.join("utils", "async_http.py"),
+}
+
+# 不检查的目录
+SKIP_DIRS = {".git", "venv", ".venv", "node_modules", "frontend", "__pycache__", "cache"}
+
+# 禁止直接使用的属性（模块 -> 属性）；requests.exceptions 等异常类型不受限制
+FORBIDDEN_ATTRS = {
+    "requests": {"get", "post", "put", "patch", "delete", "head", "options", "request", "Session", "session"},
+    "httpx": {"get", "post", "put", "patch", "delete", "head", "options", "request", "Client", "AsyncClient"},
+    "urllib.request": {"urlopen", "Request"},
+}
+
+
+def _dotted_name(node: ast.AST) -> str:
+    """a.b.c 形式的属性访问转为字符串，其他节点返回空字符串"""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return ".".join(reversed(parts))
+    return ""
+
+
+def check_source(source: str, filename: str = "<string>") -> List[Tuple[int, str]]:
+    """
+    检查一段源码中的直接 HTTP 调用
+
+    Returns:
+        [(行号, 说明), ...]
+    """
+    violations = []
+    for node in ast.walk(ast.parse(source, filename)):
+        if isinstance(node, ast.ImportFrom) and node.module in FORBIDDEN_ATTRS:
+            for alias in node.names:
+                if alias.name in FORBIDDEN_ATTRS[node.module]:
+                    violations.append((node.lineno, f"from {node.module} import {alias.name}"))
+        elif isinstance(node, ast.Attribute):
+            module = _dotted_name(node.value)
+            if node.attr in FORBIDDEN_ATTRS.get(module, ()):
+                violations.append((node.lineno, f"{module}.{node.attr}"))
+    return sorted(violations)
+
+
+def find_direct_http_calls(root: str = ".") -> List[Tuple[str, int, str]]:
+    """
+    扫描目录下所有 Python 文件
+
+    Returns:
+        [(相对路径, 行号, 说明), ...]
+    """
+    results = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        for filename in sorted(filenames):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(path, root)
+            if rel_path in ALLOWED_FILES:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                source = f.read()
+            for lineno, desc in check_source(source, rel_path):
+                results.append((rel_path, lineno, desc))
+    return results
+
+
+def main() -> int:
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    violations = find_direct_http_calls(root)
+    for path, lineno, desc in violations:
+        print(f"{path}:{lineno}: 直接使用 {desc}，请改用 utils.http_client 或 LLM 网关")
+    if violations:
+        print(f"发现 {len(violations)} 处绕过共享 HTTP 客户端的调用")
+        return 1
+    print("出站 HTTP 调用检查通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片载荷编解码
+远程模型调用（图片生成、Gate 检查、头像/身体分析）共用的图片 base64 编解码：
+
+- 编码结果按 (文件路径, 修改时间, 文件大小, 参数) 缓存，同一张图片在生成 → Gate 检查等
+  多次调用之间只读取、编码一次；缓存按编码后的总大小做 LRU 淘汰
+- 按调用类型的上传前变换（profile）：限制最长边、选择编码格式与质量，
+  Gate 检查等只需看清内容的调用使用 JPEG/WebP，只有需要透明通道时才使用 PNG；
+  每次变换记录尺寸、体积与 PSNR（有损格式）
+- 变换后仍超过 IMAGE_PAYLOAD_MAX_BYTES 时继续按比例缩小，避免超大请求体
+- 响应中的 base64 图片分块解码后直接写入磁盘（先写临时文件再替换），
+  不在内存中同时保留完整的解码结果
+"""
+
+import io
+import os
+import time
+import base64
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 编解码配置（可通过环境变量覆盖）
+IMAGE_PAYLOAD_MAX_BYTES = int(os.environ.get("IMAGE_PAYLOAD_MAX_BYTES", str(8 * 1024 * 1024)))  # 0 表示不限制
+IMAGE_CODEC_CACHE_MB = float(os.environ.get("IMAGE_CODEC_CACHE_MB", "256"))
+
+# 各调用类型的上传前变换：max_side 最长边（0 不限制）；format 为 png / jpeg / webp，
+# auto 表示有透明像素时用 PNG、否则用 JPEG，空表示保持原格式；quality 为有损格式质量
+# 可通过环境变量 IMAGE_PROFILE_<名称>（如 IMAGE_PROFILE_GATE="max_side=768,format=webp,quality=80"）覆盖
+PROFILE_GENERATION = "generation"  # 远程图片生成的输入图
+PROFILE_GATE = "gate"  # Gate 质量检查
+PROFILE_ANALYSIS = "analysis"  # 大模型图片分析
+_DEFAULT_PROFILES = {
+    PROFILE_GENERATION: "max_side=1536,format=auto,quality=92",
+    PROFILE_GATE: "max_side=1024,format=jpeg,quality=85",
+    PROFILE_ANALYSIS: "max_side=768,format=jpeg,quality=80",
+}
+
+# 分块解码的块大小（base64 字符数，必须是 4 的倍数）
+_DECODE_CHUNK = 4 * 256 * 1024
+# 缩小图片时的最短边下限（像素）
+_MIN_SIDE = 256
+
+_MIME_BY_EXT = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+}
+_PIL_FORMAT = {
+    "image/png": "PNG",
+    "image/jpeg": "JPEG",
+    "image/webp": "WEBP",
+    "image/bmp": "BMP",
+    "image/gif": "GIF",
+}
+
+
+def guess_image_mime(path: str) -> str:
+    """根据扩展名判断图片 MIME 类型（未知扩展名按 PNG 处理）"""
+    return _MIME_BY_EXT.get(os.path.splitext(str(path))[1].lower(), "image/png")
+
+
+class ImageProfile:
+    """上传前的图片变换配置"""
+
+    def __init__(self, name: str, max_side: int = 0, fmt: str = "", quality: int = 85):
+        self.name = name
+        self.max_side = max_side
+        self.fmt = fmt.lower()
+        self.quality = quality
+
+    @classmethod
+    def parse(cls, name: str, spec: str) -> "ImageProfile":
+        """解析 "max_side=1024,format=jpeg,quality=85" 形式的配置"""
+        options = {}
+        for item in spec.split(","):
+            key, _, value = item.partition("=")
+            if key.strip():
+                options[key.strip().lower()] = value.strip()
+        try:
+            return cls(
+                name,
+                max_side=int(options.get("max_side", 0) or 0),
+                fmt=options.get("format", ""),
+                quality=int(options.get("quality", 85) or 85)
+            )
+        except ValueError:
+            logger.warning(f"无效的图片变换配置: {name}={spec}，不做变换")
+            return cls(name)
+
+    @property
+    def key(self) -> tuple:
+        return (self.name, self.max_side, self.fmt, self.quality)
+
+    def __repr__(self):
+        return f"{self.name}(max_side={self.max_side}, format={self.fmt or 'keep'}, quality={self.quality})"
+
+
+def load_profiles() -> Dict[str, ImageProfile]:
+    """加载各调用类型的变换配置（环境变量覆盖默认值）"""
+    return {
+        name: ImageProfile.parse(name, os.environ.get(f"IMAGE_PROFILE_{name.upper()}", spec))
+        for name, spec in _DEFAULT_PROFILES.items()
+    }
+
+
+def _has_transparency(img) -> bool:
+    """图片是否含有非不透明像素"""
+    if img.mode in ("RGBA", "LA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    if img.mode == "P":
+        return "transparency" in img.info
+    return False
+
+
+def _psnr(reference, encoded: bytes) -> Optional[float]:
+    """计算编码结果相对参考图的 PSNR（dB）"""
+    try:
+        import numpy as np
+        from PIL import Image
+
+        with Image.open(io.BytesIO(encoded)) as decoded:
+            a = np.asarray(reference.convert("RGB"), dtype=np.float32)
+            b = np.asarray(decoded.convert("RGB"), dtype=np.float32)
+        mse = float(np.mean((a - b) ** 2))
+        return 99.0 if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+    except Exception:
+        return None
+
+
+class ImagePayloadCodec:
+    """图片载荷编解码器（线程安全）"""
+
+    def __init__(
+        self,
+        max_bytes: int = IMAGE_PAYLOAD_MAX_BYTES,
+        cache_mb: float = IMAGE_CODEC_CACHE_MB,
+        profiles: Optional[Dict[str, ImageProfile]] = None
+    ):
+        self.max_bytes = max_bytes
+        self.cache_limit = int(cache_mb * 1024 * 1024)
+        self.profiles = profiles if profiles is not None else load_profiles()
+        self._cache: "OrderedDict[tuple, Tuple[str, str]]" = OrderedDict()
+        self._cache_size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "reencoded": 0, "decoded": 0}
+        self._profile_stats: Dict[str, Dict] = {}
+
+    def encode(self, path: str, max_bytes: Optional[int] = None, profile: Optional[str] = None) -> Tuple[str, str]:
+        """
+        编码图片文件为 base64
+
+        Args:
+            path: 图片路径
+            max_bytes: 编码前大小上限（None 使用默认配置，0 表示不限制）
+            profile: 调用类型（PROFILE_GENERATION / PROFILE_GATE / PROFILE_ANALYSIS），
+                None 表示保持原图
+
+        Returns:
+            (base64 字符串, MIME 类型)
+
+        Raises:
+            FileNotFoundError: 文件不存在
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        image_profile = self.profiles.get(profile) if profile else None
+        abs_path = os.path.abspath(path)
+        st = os.stat(abs_path)
+        key = (abs_path, st.st_mtime_ns, st.st_size, max_bytes, image_profile.key if image_profile else None)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+            self._stats["misses"] += 1
+
+        mime = guess_image_mime(abs_path)
+        if image_profile is not None or (max_bytes and st.st_size > max_bytes):
+            data, mime = self._transform(abs_path, mime, st.st_size, max_bytes, image_profile)
+        else:
+            with open(abs_path, "rb") as f:
+                data = f.read()
+        entry = (base64.b64encode(data).decode("ascii"), mime)
+        del data
+
+        self._remember(key, entry)
+        return entry
+
+    def data_url(self, path: str, max_bytes: Optional[int] = None, profile: Optional[str] = None) -> str:
+        """编码为 data URL（data:<mime>;base64,...）"""
+        b64, mime = self.encode(path, max_bytes, profile)
+        return f"data:{mime};base64,{b64}"
+
+    def _transform(self, path: str, mime: str, size: int, max_bytes: int,
+                   profile: Optional[ImageProfile]) -> Tuple[bytes, str]:
+        """
+        按变换配置缩放、转码，仍超过 max_bytes 时继续按比例缩小
+
+        Returns:
+            (编码后的字节, MIME 类型)；变换结果不比原文件小（且原文件未超过 max_bytes）时返回原文件
+        """
+        from PIL import Image
+
+        start = time.time()
+        with Image.open(path) as img:
+            img.load()
+            width, height = img.size
+
+            # 选择输出格式
+            fmt = profile.fmt if profile else ""
+            if fmt == "auto":
+                fmt = "png" if _has_transparency(img) else "jpeg"
+            out_mime = _MIME_BY_EXT.get(f".{fmt}", mime) if fmt else mime
+            pil_format = _PIL_FORMAT.get(out_mime, "PNG")
+            quality = profile.quality if profile else 85
+
+            if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+                # JPEG 不支持透明通道：铺白色背景
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            elif pil_format == "PNG" and img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                img = img.convert("RGBA")
+
+            # 限制最长边
+            scale = 1.0
+            if profile and profile.max_side and max(width, height) > profile.max_side:
+                scale = profile.max_side / max(width, height)
+
+            while True:
+                new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+                resized = img.resize(new_size, Image.LANCZOS) if new_size != (width, height) else img
+                buffer = io.BytesIO()
+                save_kwargs = {"quality": quality} if pil_format in ("JPEG", "WEBP") else {"optimize": True}
+                resized.save(buffer, format=pil_format, **save_kwargs)
+                data = buffer.getvalue()
+                if not max_bytes or len(data) <= max_bytes or min(new_size) <= _MIN_SIDE:
+                    break
+                scale *= min(0.9, (max_bytes / len(data)) ** 0.5)
+
+            if len(data) >= size and (not max_bytes or size <= max_bytes):
+                logger.debug(f"[图片编码] {profile.name if profile else 'size_cap'}: {os.path.basename(path)} "
+                             f"变换后 {len(data) // 1024}KB 不小于原图 {size // 1024}KB，上传原图")
+                with open(path, "rb") as f:
+                    return f.read(), mime
+            psnr = _psnr(resized, data) if pil_format in ("JPEG", "WEBP") else None
+
+        elapsed = time.time() - start
+        name = profile.name if profile else "size_cap"
+        self._record_transform(name, size, len(data), psnr)
+        psnr_text = f", PSNR {psnr:.1f}dB" if psnr is not None else ""
+        logger.info(f"[图片编码] {name}: {os.path.basename(path)} {width}x{height} {size // 1024}KB "
+                    f"-> {new_size[0]}x{new_size[1]} {pil_format} {len(data) // 1024}KB "
+                    f"({len(data) / size:.0%}{psnr_text}, {elapsed * 1000:.0f}ms)")
+        return data, out_mime
+
+    def _record_transform(self, name: str, size_in: int, size_out: int, psnr: Optional[float]):
+        """记录变换统计"""
+        with self._lock:
+            self._stats["reencoded"] += 1
+            item = self._profile_stats.setdefault(
+                name, {"count": 0, "bytes_in": 0, "bytes_out": 0, "psnr_sum": 0.0, "psnr_count": 0}
+            )
+            item["count"] += 1
+            item["bytes_in"] += size_in
+            item["bytes_out"] += size_out
+            if psnr is not None:
+                item["psnr_sum"] += psnr
+                item["psnr_count"] += 1
+
+    def _remember(self, key: tuple, entry: Tuple[str, str]):
+        """写入缓存并按总大小淘汰"""
+        size = len(entry[0])
+        if size > self.cache_limit:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = entry
+            self._cache_size += size
+            while self._cache_size > self.cache_limit:
+                _, old = self._cache.popitem(last=False)
+                self._cache_size -= len(old[0])
+
+    def decode_to_file(self, b64_data: str, save_path: str) -> int:
+        """
+        base64 数据分块解码写入文件（支持 data URL 前缀）
+
+        Returns:
+            int: 写入的字节数
+        """
+        if b64_data.startswith("data:"):
+            b64_data = b64_data[b64_data.find(",") + 1:]
+        if "\n" in b64_data or "\r" in b64_data or " " in b64_data:
+            b64_data = "".join(b64_data.split())
+
+        directory = os.path.dirname(os.path.abspath(save_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{save_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        written = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for start in range(0, len(b64_data), _DECODE_CHUNK):
+                    chunk = base64.b64decode(b64_data[start:start + _DECODE_CHUNK])
+                    f.write(chunk)
+                    written += len(chunk)
+            os.replace(tmp_path, save_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._stats["decoded"] += 1
+        return written
+
+    def clear(self):
+        """清空编码缓存"""
+        with self._lock:
+            self._cache.clear()
+            self._cache_size = 0
+
+    def get_stats(self) -> Dict:
+        """获取编码缓存统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._cache)
+            stats["cached_mb"] = round(self._cache_size / 1024 / 1024, 1)
+            stats["profiles"] = {
+                name: {
+                    "count": item["count"],
+                    "ratio": round(item["bytes_out"] / item["bytes_in"], 3) if item["bytes_in"] else 0,
+                    "avg_psnr": round(item["psnr_sum"] / item["psnr_count"], 1) if item["psnr_count"] else None
+                }
+                for name, item in self._profile_stats.items()
+            }
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0
+        return stats
+
+
+# 全局图片载荷编解码器
+image_codec = ImagePayloadCodec()
@@ -3,19 +3,73 @@
 """
 任务管理器
 管理后台生成任务的生命周期，支持排队和并发控制
+任务状态通过 JobStore 持久化，服务重启后可恢复
+
+排队策略：按租户（API Token 或客户端 IP）加权公平排队，
+interactive / batch 两个优先级通道按权重分配，单租户在途任务数有上限
+
+请求合并：需求/模式/视角/预分析完全相同的任务在执行期间合并为一次生成，
+后到的任务（follower）跟随首个任务（leader）的进度并共享生成结果
 """
 
+import os
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
 import threading
 import time
 import uuid
 from collections import deque
 from typing import Dict, Optional, List, Callable
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from enum import Enum
 import logging
 
+from .job_store import JobStore, create_job_store
+from .duration_predictor import DurationPredictor, count_accessories
+from .cancellation import CancellationToken
+from .worker_pool import is_worker_process
+from .admission import AdmissionController, admission_controller, clamp_retry_after
+
 logger = logging.getLogger(__name__)
 
+# 在途任务数与排队上限（各阶段的资源占用由 StageScheduler 单独限制）
+JOB_MAX_CONCURRENT = int(os.environ.get("JOB_MAX_CONCURRENT", "10"))
+JOB_MAX_QUEUE_SIZE = int(os.environ.get("JOB_MAX_QUEUE_SIZE", "50"))
+# 每个任务保留的最近日志行数（环形缓冲，超出后丢弃最旧的日志）
+JOB_LOG_CAP = int(os.environ.get("JOB_LOG_CAP", "500"))
+# 每个任务保留的最近变更记录数（增量推送 / 长轮询使用）
+JOB_CHANGE_BUFFER = int(os.environ.get("JOB_CHANGE_BUFFER", "200"))
+# 单个租户同时执行的任务数上限（0 表示不限制）
+JOB_MAX_PER_TENANT = int(os.environ.get("JOB_MAX_PER_TENANT", "3"))
+# 是否合并执行中的相同请求
+JOB_COALESCE_ENABLED = os.environ.get("JOB_COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# 优先级通道及权重（权重越大，同等排队情况下越早被调度）
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANE_WEIGHTS = {
+    LANE_INTERACTIVE: float(os.environ.get("JOB_LANE_WEIGHT_INTERACTIVE", "4")),
+    LANE_BATCH: float(os.environ.get("JOB_LANE_WEIGHT_BATCH", "1")),
+}
+
+
+def coalesce_key(requirement: str, mode: str = "3D", perspective: str = "", pre_analysis: Optional[Dict] = None) -> str:
+    """
+    计算请求合并键（需求文本去除多余空白并忽略大小写，预分析按键排序）
+
+    Returns:
+        str: 相同生成输入得到相同的键
+    """
+    text = " ".join(str(requirement or "").split()).lower()
+    payload = json.dumps(
+        [text, (mode or "3D").upper(), perspective or "", pre_analysis or None],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
 
 class JobStatus(Enum):
     """任务状态"""
@@ -37,21 +91,53 @@ class Job:
     analysis: Optional[Dict] = None
     pre_analysis: Optional[Dict] = None  # 用户确认的预分析结果
     mode: str = "3D"  # 生成模式：2D 或 3D
+    tenant: str = ""  # 租户标识（API Token 摘要或客户端 IP）
+    lane: str = LANE_INTERACTIVE  # 优先级通道：interactive 或 batch
     perspective: str = "正视角"  # 视角：正视角 或 仰视角
     images: List[str] = field(default_factory=list)
     error: Optional[str] = None
     details: Dict = field(default_factory=dict)
-    logs: List[str] = field(default_factory=list)
+    logs: deque = field(default_factory=lambda: deque(maxlen=JOB_LOG_CAP))  # 最近日志（环形缓冲）
+    log_count: int = 0  # 累计日志条数（日志游标）
     created_at: float = field(default_factory=time.time)
     updated_at: float = field(default_factory=time.time)
     started_at: Optional[float] = None  # 开始执行时间
     finished_at: Optional[float] = None  # 完成时间
     queue_position: int = 0  # 队列位置（0表示正在执行或已完成）
     estimated_wait: float = 0  # 预估等待时间（秒）
+    coalesce_key: str = ""  # 请求合并键（作为 leader 执行时设置）
+    leader_id: str = ""  # 合并到的 leader 任务ID（follower 才有）
 
-    def to_dict(self) -> Dict:
-        """转换为字典"""
-        return {
+    def __post_init__(self):
+        # 从持久化记录恢复时 logs 为 list，统一转为有上限的环形缓冲
+        if not isinstance(self.logs, deque) or self.logs.maxlen != JOB_LOG_CAP:
+            self.logs = deque(self.logs, maxlen=JOB_LOG_CAP)
+        self.log_count = max(self.log_count, len(self.logs))
+
+    def logs_since(self, since: int = 0) -> tuple:
+        """
+        获取游标之后的新日志
+
+        Args:
+            since: 客户端已收到的日志条数（即上次返回的 log_cursor）
+
+        Returns:
+            (logs, truncated): 新日志列表；truncated=True 表示部分日志已被环形缓冲丢弃
+        """
+        first_seq = self.log_count - len(self.logs)  # 缓冲区第一条日志之前的累计条数
+        since = max(0, min(since, self.log_count))
+        truncated = since < first_seq
+        start = max(since, first_seq) - first_seq
+        return list(itertools.islice(self.logs, start, None)), truncated
+
+    def to_dict(self, include_logs: bool = False) -> Dict:
+        """
+        转换为字典
+
+        Args:
+            include_logs: 是否包含日志（默认不包含，日志通过 log_cursor 增量获取）
+        """
+        data = {
             "job_id": self.job_id,
             "status": self.status.value,
             "progress": self.progress,
@@ -60,6 +146,7 @@ class Job:
             "pre_analysis": self.pre_analysis,
             "mode": self.mode,
             "perspective": self.perspective,
+            "lane": self.lane,
             "images": self.images,
             "error": self.error,
             "details": self.details,
@@ -68,30 +155,77 @@ class Job:
             "estimated_wait": round(self.estimated_wait, 1),
             "created_at": self.created_at,
             "started_at": self.started_at,
-            "finished_at": self.finished_at
+            "finished_at": self.finished_at,
+            "log_cursor": self.log_count,
+            "coalesced_with": self.leader_id or None
         }
+        if include_logs:
+            data["logs"] = list(self.logs)
+        return data
+
+    def to_record(self) -> Dict:
+        """转换为持久化记录（包含需求原文与日志）"""
+        record = {f.name: getattr(self, f.name) for f in fields(self)}
+        record["status"] = self.status.value
+        record["images"] = list(self.images)
+        record["logs"] = list(self.logs)
+        return record
+
+    @classmethod
+    def from_record(cls, record: Dict) -> "Job":
+        """从持久化记录恢复任务（忽略未知字段）"""
+        known = {f.name for f in fields(cls)}
+        data = {k: v for k, v in record.items() if k in known}
+        data["status"] = JobStatus(data.get("status", JobStatus.QUEUED.value))
+        return cls(**data)
 
 
 class JobQueue:
     """
     任务队列管理器
     控制并发执行数量，超出的任务进入等待队列
+
+    等待队列采用 start-time fair queuing：
+    - 每个任务入队时分配虚拟完成标签 finish = max(虚拟时钟, 该租户上一个标签) + 1 / 通道权重
+    - 按标签从小到大调度，单租户连续提交的任务标签递增，不会饿死其他租户
+    - interactive 通道权重更高，标签增长更慢，因此优先于 batch
+    - 等待列表按标签有序，位置查询为二分查找
+
+    预估等待时间由 DurationPredictor 按任务分类（模式/动作/配件数）给出单任务耗时，
+    在队列变化时按并发槽位模拟一次调度，缓存每个任务的预计开始时间
+
+    实际并发上限取 max_concurrent 与 AdmissionController 自适应上限中的较小值，
+    下游退化时自动收缩，恢复后逐步放开
     """
 
     def __init__(
         self,
         max_concurrent: int = 5,
         max_queue_size: int = 50,
-        avg_job_duration: float = 60.0  # 默认预估每个任务60秒
+        avg_job_duration: float = 60.0,  # 默认预估每个任务60秒
+        on_job_change: Optional[Callable[[str], None]] = None,
+        max_per_tenant: int = JOB_MAX_PER_TENANT,
+        lane_weights: Optional[Dict[str, float]] = None,
+        admission: Optional[AdmissionController] = None
     ):
         self.max_concurrent = max_concurrent
         self.max_queue_size = max_queue_size
+        self.max_per_tenant = max_per_tenant
+        self.lane_weights = lane_weights or LANE_WEIGHTS
         self._avg_job_duration = avg_job_duration
+        # 任务状态变化回调（用于通知持久化层）
+        self._on_job_change = on_job_change
         
-        # 等待队列（FIFO）
-        self._waiting_queue: deque = deque()
-        # 正在执行的任务
+        # 等待队列：按 (finish_tag, seq) 有序的列表 + 任务索引
+        self._waiting_order: List[tuple] = []
+        self._waiting_jobs: Dict[str, tuple] = {}  # job_id -> (order_key, job, handler)
+        self._seq = itertools.count()
+        # 公平排队虚拟时钟与各租户最近的完成标签
+        self._virtual_time = 0.0
+        self._tenant_finish: Dict[str, float] = {}
+        # 正在执行的任务及各租户在途数
         self._running_jobs: Dict[str, Job] = {}
+        self._tenant_running: Dict[str, int] = {}
         # 任务执行函数映射
         self._job_handlers: Dict[str, Callable] = {}
         
@@ -100,8 +234,17 @@ class JobQueue:
         # 历史执行时间记录（用于动态计算平均时间）
         self._duration_history: List[float] = []
         self._max_history_size = 20
+        # 分类耗时预测与等待任务的预计开始时间
+        self._predictor = DurationPredictor(default_duration=avg_job_duration)
+        self._eta_at: Dict[str, float] = {}
+        # 自适应准入控制（并发上限变化时尝试调度等待任务）
+        self._admission = admission
+        if admission is not None:
+            admission.set_max_limit(max_concurrent)
+            admission.add_listener(self._on_limit_change)
         
-        logger.info(f"JobQueue 初始化: max_concurrent={max_concurrent}, max_queue={max_queue_size}")
+        logger.info(f"JobQueue 初始化: max_concurrent={max_concurrent}, max_queue={max_queue_size}, "
+                    f"max_per_tenant={max_per_tenant}, lanes={self.lane_weights}")
 
     @property
     def avg_job_duration(self) -> float:
@@ -110,6 +253,18 @@ class JobQueue:
             return sum(self._duration_history) / len(self._duration_history)
         return self._avg_job_duration
 
+    def _concurrency_limit(self) -> int:
+        """当前实际并发上限"""
+        if self._admission is None:
+            return self.max_concurrent
+        return min(self.max_concurrent, self._admission.concurrency_limit())
+
+    def _on_limit_change(self, limit: int):
+        """自适应并发上限变化回调：上限提高时启动等待任务，并重新计算预估时间"""
+        with self._lock:
+            self._try_start_next()
+            self._update_queue_positions()
+
     def _record_duration(self, duration: float):
         """记录任务执行时间"""
         with self._lock:
@@ -120,13 +275,35 @@ class JobQueue:
     def get_queue_stats(self) -> Dict:
         """获取队列统计信息"""
         with self._lock:
+            lanes = {lane: 0 for lane in self.lane_weights}
+            tenants = set()
+            for _, job, _ in self._waiting_jobs.values():
+                lanes[job.lane] = lanes.get(job.lane, 0) + 1
+                tenants.add(job.tenant)
             return {
                 "running_count": len(self._running_jobs),
-                "waiting_count": len(self._waiting_queue),
+                "waiting_count": len(self._waiting_order),
                 "max_concurrent": self.max_concurrent,
-                "avg_duration": round(self.avg_job_duration, 1)
+                "effective_concurrent": self._concurrency_limit(),
+                "max_per_tenant": self.max_per_tenant,
+                "waiting_by_lane": lanes,
+                "waiting_tenants": len(tenants),
+                "avg_duration": round(self.avg_job_duration, 1),
+                "duration_classes": self._predictor.get_stats()
             }
 
+    @staticmethod
+    def _job_class_keys(job: Job) -> List[str]:
+        """任务的耗时分类键（分析结果未知时只按模式分类）"""
+        analysis = job.analysis or job.pre_analysis
+        if not analysis:
+            return DurationPredictor.class_keys(job.mode)
+        return DurationPredictor.class_keys(
+            job.mode,
+            str(analysis.get('动作') or ''),
+            count_accessories(analysis)
+        )
+
     def get_position_and_wait(self, job_id: str) -> tuple:
         """
         获取任务的队列位置和预估等待时间
@@ -140,17 +317,29 @@ class JobQueue:
             if job_id in self._running_jobs:
                 return (0, 0)
             
-            # 在等待队列中查找位置
-            for i, (waiting_id, _, _) in enumerate(self._waiting_queue):
-                if waiting_id == job_id:
-                    position = i + 1
-                    # 预估等待时间 = 前面的任务数 * 平均执行时间
-                    # 考虑并发：实际等待 = (position / max_concurrent) * avg_duration
-                    batches_ahead = (position + len(self._running_jobs) - 1) // self.max_concurrent
-                    estimated_wait = batches_ahead * self.avg_job_duration
-                    return (position, estimated_wait)
-            
-            return (0, 0)
+            entry = self._waiting_jobs.get(job_id)
+            if entry is None:
+                return (0, 0)
+
+            # 有序等待列表中二分查找位置（已包含通道权重与租户公平性）
+            position = bisect.bisect_left(self._waiting_order, entry[0]) + 1
+            now = time.time()
+            return (position, max(0.0, self._eta_at.get(job_id, now) - now))
+
+    def check_admission(self) -> Optional[int]:
+        """
+        准入检查（队列已满或下游退化且排队过深时拒绝）
+
+        Returns:
+            Optional[int]: None 表示可以接收；否则为建议的重试等待秒数（按队尾任务的预计开始时间估算）
+        """
+        with self._lock:
+            waiting = len(self._waiting_order)
+            if waiting < self.max_queue_size and (self._admission is None or self._admission.check(waiting)):
+                return None
+            now = time.time()
+            last_start = self._eta_at.get(self._waiting_order[-1][2], now) if self._waiting_order else now
+            return clamp_retry_after(last_start - now)
 
     def submit(self, job: Job, handler: Callable) -> bool:
         """
@@ -165,32 +354,58 @@ class JobQueue:
         """
         with self._lock:
             # 检查队列是否已满
-            if len(self._waiting_queue) >= self.max_queue_size:
+            if len(self._waiting_order) >= self.max_queue_size:
                 logger.warning(f"队列已满，拒绝任务: {job.job_id}")
                 return False
             
             # 保存处理函数
             self._job_handlers[job.job_id] = handler
             
-            # 检查是否可以直接执行
-            if len(self._running_jobs) < self.max_concurrent:
+            # 检查是否可以直接执行（总并发与租户并发均未满；
+            # 有空闲槽位时等待列表中不会有可调度的任务，因此不会插队）
+            if len(self._running_jobs) < self._concurrency_limit() and self._tenant_has_capacity(job.tenant):
                 self._start_job(job)
             else:
-                # 加入等待队列
-                position = len(self._waiting_queue) + 1
-                job.queue_position = position
-                job.estimated_wait = self._calculate_wait_time(position)
-                self._waiting_queue.append((job.job_id, job, handler))
-                logger.info(f"任务加入队列: {job.job_id}, 位置: {position}, 预估等待: {job.estimated_wait:.1f}秒")
+                # 加入等待队列（插入位置之后的任务顺延）
+                position = self._enqueue(job, handler)
+                self._update_queue_positions()
+                logger.info(f"任务加入队列: {job.job_id}, 租户: {job.tenant or '-'}, 通道: {job.lane}, "
+                            f"位置: {position}, 预估等待: {job.estimated_wait:.1f}秒")
             
             return True
 
-    def _calculate_wait_time(self, position: int) -> float:
-        """计算预估等待时间"""
-        # 考虑并发执行
-        running_count = len(self._running_jobs)
-        batches_ahead = (position + running_count - 1) // self.max_concurrent
-        return batches_ahead * self.avg_job_duration
+    def _enqueue(self, job: Job, handler: Callable) -> int:
+        """按公平排队标签插入等待列表，返回排队位置（需要在锁内调用）"""
+        start = max(self._virtual_time, self._tenant_finish.get(job.tenant, 0.0))
+        finish = start + 1.0 / self._lane_weight(job.lane)
+        self._tenant_finish[job.tenant] = finish
+
+        order_key = (finish, next(self._seq), job.job_id)
+        index = bisect.bisect_left(self._waiting_order, order_key)
+        self._waiting_order.insert(index, order_key)
+        self._waiting_jobs[job.job_id] = (order_key, job, handler)
+        return index + 1
+
+    def _dequeue(self, job_id: str):
+        """从等待列表移除任务（需要在锁内调用）"""
+        entry = self._waiting_jobs.pop(job_id, None)
+        self._eta_at.pop(job_id, None)
+        if entry is None:
+            return None
+        index = bisect.bisect_left(self._waiting_order, entry[0])
+        if index < len(self._waiting_order) and self._waiting_order[index] == entry[0]:
+            del self._waiting_order[index]
+        return entry
+
+    def _lane_weight(self, lane: str) -> float:
+        """获取通道权重（未知通道按 interactive 处理）"""
+        return self.lane_weights.get(lane) or self.lane_weights.get(LANE_INTERACTIVE) or 1.0
+
+    def _tenant_has_capacity(self, tenant: str) -> bool:
+        """租户在途任务数是否未达上限（需要在锁内调用）"""
+        if self.max_per_tenant <= 0:
+            return True
+        return self._tenant_running.get(tenant, 0) < self.max_per_tenant
 
     def _start_job(self, job: Job):
         """启动任务执行（需要在锁内调用）"""
@@ -202,6 +417,8 @@ class JobQueue:
         job.updated_at = time.time()
         
         self._running_jobs[job.job_id] = job
+        self._tenant_running[job.tenant] = self._tenant_running.get(job.tenant, 0) + 1
+        self._notify_change(job.job_id)
         
         handler = self._job_handlers.get(job.job_id)
         if handler:
@@ -233,43 +450,93 @@ class JobQueue:
             if job_id in self._running_jobs:
                 job = self._running_jobs.pop(job_id)
                 job.finished_at = time.time()
+                # 只用成功任务训练耗时预测（失败/取消的任务耗时没有参考价值）
+                if job.status == JobStatus.SUCCEEDED and job.started_at:
+                    self._predictor.record(self._job_class_keys(job), job.finished_at - job.started_at)
+                remaining = self._tenant_running.get(job.tenant, 0) - 1
+                if remaining > 0:
+                    self._tenant_running[job.tenant] = remaining
+                else:
+                    self._tenant_running.pop(job.tenant, None)
+                self._notify_change(job_id)
             
             # 清理处理函数
             self._job_handlers.pop(job_id, None)
             
-            # 更新等待队列中所有任务的位置和预估时间
-            self._update_queue_positions()
-            
             # 启动下一个等待任务
             self._try_start_next()
+            
+            # 更新等待队列中所有任务的位置和预估时间
+            self._update_queue_positions()
+
+    def _notify_change(self, job_id: str):
+        """通知任务状态变化"""
+        if self._on_job_change:
+            try:
+                self._on_job_change(job_id)
+            except Exception as e:
+                logger.warning(f"任务变更通知失败: {job_id}, {e}")
 
     def _update_queue_positions(self):
         """更新等待队列中所有任务的位置（需要在锁内调用）"""
-        for i, (_, job, _) in enumerate(self._waiting_queue):
+        now = time.time()
+        # 并发槽位的空闲时间：执行中的任务按预测耗时推算剩余时间
+        slots = [
+            max(now, (job.started_at or now) + self._predictor.predict(self._job_class_keys(job)))
+            for job in self._running_jobs.values()
+        ]
+        slots.extend([now] * max(0, self._concurrency_limit() - len(slots)))
+        heapq.heapify(slots)
+
+        for i, order_key in enumerate(self._waiting_order):
+            job = self._waiting_jobs[order_key[2]][1]
+            start_at = heapq.heappop(slots)
+            heapq.heappush(slots, start_at + self._predictor.predict(self._job_class_keys(job)))
+            self._eta_at[job.job_id] = start_at
             job.queue_position = i + 1
-            job.estimated_wait = self._calculate_wait_time(i + 1)
-            job.updated_at = time.time()
+            job.estimated_wait = start_at - now
+            job.updated_at = now
 
     def _try_start_next(self):
         """尝试启动下一个等待任务（需要在锁内调用）"""
-        while len(self._running_jobs) < self.max_concurrent and self._waiting_queue:
-            job_id, job, handler = self._waiting_queue.popleft()
+        limit = self._concurrency_limit()
+        while len(self._running_jobs) < limit and self._waiting_order:
+            # 按标签顺序取第一个租户未达上限的任务
+            order_key = next(
+                (key for key in self._waiting_order
+                 if self._tenant_has_capacity(self._waiting_jobs[key[2]][1].tenant)),
+                None
+            )
+            if order_key is None:
+                break
+            job_id = order_key[2]
+            _, job, _ = self._dequeue(job_id)
+            # 虚拟时钟推进到被调度任务的起始标签
+            self._virtual_time = max(self._virtual_time, order_key[0] - 1.0 / self._lane_weight(job.lane))
             self._start_job(job)
             logger.info(f"从队列启动任务: {job_id}")
 
+        # 清理已落后于虚拟时钟的租户标签
+        if self._tenant_finish:
+            self._tenant_finish = {
+                tenant: finish for tenant, finish in self._tenant_finish.items()
+                if finish > self._virtual_time
+            }
+
     def cancel_job(self, job_id: str) -> bool:
         """取消任务"""
         with self._lock:
             # 从等待队列中移除
-            for i, (waiting_id, job, _) in enumerate(list(self._waiting_queue)):
-                if waiting_id == job_id:
-                    del self._waiting_queue[i]
-                    job.status = JobStatus.CANCELLED
-                    self._job_handlers.pop(job_id, None)
-                    self._update_queue_positions()
-                    logger.info(f"任务已取消: {job_id}")
-                    return True
-            return False
+            entry = self._dequeue(job_id)
+            if entry is None:
+                return False
+            job = entry[1]
+            job.status = JobStatus.CANCELLED
+            self._job_handlers.pop(job_id, None)
+            self._notify_change(job_id)
+            self._update_queue_positions()
+            logger.info(f"任务已取消: {job_id}")
+            return True
 
 
 class JobManager:
@@ -292,7 +559,8 @@ class JobManager:
         job_ttl: int = 3600,
         cleanup_interval: int = 300,
         max_concurrent: int = 5,
-        max_queue_size: int = 50
+        max_queue_size: int = 50,
+        store: Optional[JobStore] = None
     ):
         if self._initialized:
             return
@@ -302,11 +570,27 @@ class JobManager:
         self._jobs_lock = threading.Lock()
         self._max_jobs = max_jobs
         self._job_ttl = job_ttl
+        # 执行中任务的取消令牌
+        self._cancel_tokens: Dict[str, CancellationToken] = {}
+        # 任务变更记录（updated_at, 变更字段）与变更通知
+        self._changes: Dict[str, deque] = {}
+        self._changes_cond = threading.Condition(self._jobs_lock)
+        # 请求合并：合并键 -> leader，leader -> followers / 执行函数（leader 被取消时重新提交 followers）
+        self._inflight: Dict[str, str] = {}
+        self._followers: Dict[str, List[str]] = {}
+        self._coalesce_handlers: Dict[str, Callable] = {}
+
+        # 持久化存储（默认纯内存）
+        self._store = store or JobStore()
+        self._restore_from_store()
+        self._store.bind(self._snapshot_jobs)
 
         # 初始化任务队列
         self._queue = JobQueue(
             max_concurrent=max_concurrent,
-            max_queue_size=max_queue_size
+            max_queue_size=max_queue_size,
+            on_job_change=self._on_queue_change,
+            admission=admission_controller
         )
 
         # 启动清理线程
@@ -319,35 +603,85 @@ class JobManager:
 
         logger.info(f"JobManager 初始化完成: max_jobs={max_jobs}, ttl={job_ttl}s, max_concurrent={max_concurrent}")
 
-    def create_job(self, requirement: str) -> str:
-        """创建新任务（仅创建，不启动）"""
+    def create_job(self, requirement: str, tenant: str = "", lane: str = LANE_INTERACTIVE) -> str:
+        """
+        创建新任务（仅创建，不启动）
+
+        Args:
+            requirement: 用户需求
+            tenant: 租户标识（用于公平排队与租户并发上限）
+            lane: 优先级通道（interactive / batch）
+        """
         job_id = uuid.uuid4().hex
+        if lane not in LANE_WEIGHTS:
+            lane = LANE_INTERACTIVE
 
         with self._jobs_lock:
             if len(self._jobs) >= self._max_jobs:
                 self._cleanup_old_jobs()
 
-            job = Job(job_id=job_id, requirement=requirement)
+            job = Job(job_id=job_id, requirement=requirement, tenant=tenant, lane=lane)
             self._jobs[job_id] = job
+            self._store.mark_dirty(job_id)
 
         logger.info(f"创建任务: {job_id}")
         return job_id
 
-    def submit_job(self, job_id: str, handler: Callable) -> Dict:
+    def submit_job(self, job_id: str, handler: Callable, admit: bool = True, coalesce: bool = True) -> Dict:
         """
         提交任务到执行队列
+
+        Args:
+            admit: 是否做准入检查（重启恢复的任务跳过）
+            coalesce: 是否与执行中的相同请求合并（用户要求生成新变体时关闭）
         
         Returns:
-            Dict: 包含队列位置和预估等待时间
+            Dict: 包含队列位置和预估等待时间；被拒绝时包含 retry_after（秒）；
+                  合并到已有任务时包含 coalesced_with（leader 任务ID）
         """
+        key = ""
         with self._jobs_lock:
             job = self._jobs.get(job_id)
             if not job:
                 return {"success": False, "error": "任务不存在"}
+            job.leader_id = ""
+            job.coalesce_key = ""
+
+            if coalesce and JOB_COALESCE_ENABLED:
+                key = coalesce_key(job.requirement, job.mode, job.perspective, job.pre_analysis)
+                leader = self._jobs.get(self._inflight.get(key, ""))
+                if leader is not None and leader.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+                    self._attach_follower(leader, job)
+                    leader_id = leader.job_id
+                else:
+                    # 先登记为 leader，避免并发提交的相同请求同时进入队列
+                    leader_id = ""
+                    job.coalesce_key = key
+                    self._inflight[key] = job_id
+                    self._coalesce_handlers[job_id] = handler
+
+        if key and leader_id:
+            logger.info(f"任务合并: {job_id} -> {leader_id}")
+            position, wait_time = self._queue.get_position_and_wait(leader_id)
+            return {
+                "success": True,
+                "queue_position": position,
+                "estimated_wait": round(wait_time, 1),
+                "coalesced_with": leader_id
+            }
+
+        if admit:
+            retry_after = self._queue.check_admission()
+            if retry_after is not None:
+                error = "服务繁忙，请稍后重试"
+                self.set_failed(job_id, error)
+                return {"success": False, "error": error, "retry_after": retry_after}
 
         success = self._queue.submit(job, handler)
         if not success:
-            return {"success": False, "error": "队列已满，请稍后重试"}
+            error = "队列已满，请稍后重试"
+            self.set_failed(job_id, error)
+            return {"success": False, "error": error, "retry_after": clamp_retry_after(self._queue.avg_job_duration)}
 
         position, wait_time = self._queue.get_position_and_wait(job_id)
         return {
@@ -356,51 +690,244 @@ class JobManager:
             "estimated_wait": round(wait_time, 1)
         }
 
+    def _attach_follower(self, leader: Job, follower: Job):
+        """将任务合并到 leader，同步 leader 当前进度（需要在 _jobs_lock 内调用）"""
+        follower.leader_id = leader.job_id
+        self._followers.setdefault(leader.job_id, []).append(follower.job_id)
+        changed = {"coalesced_with": leader.job_id}
+        for key in ("status", "stage", "progress", "analysis", "started_at"):
+            value = getattr(leader, key)
+            if getattr(follower, key) != value:
+                setattr(follower, key, value)
+                changed[key] = value.value if isinstance(value, JobStatus) else value
+        follower.log_count += 1
+        line = f"步骤{follower.log_count}: 与执行中的相同请求合并，共享生成结果"
+        follower.logs.append(line)
+        changed["logs"] = [line]
+        changed["log_cursor"] = follower.log_count
+        self._record_change(follower, changed)
+        self._store.mark_dirty(follower.job_id)
+
+    def _release_coalesce(self, leader: Job) -> List[str]:
+        """leader 结束时解除合并关系，返回其 followers（需要在 _jobs_lock 内调用）"""
+        if leader.coalesce_key and self._inflight.get(leader.coalesce_key) == leader.job_id:
+            del self._inflight[leader.coalesce_key]
+        self._coalesce_handlers.pop(leader.job_id, None)
+        return self._followers.pop(leader.job_id, [])
+
+    def _resubmit_followers(self, follower_ids: List[str], handler: Optional[Callable]):
+        """leader 被取消后重新提交其 followers（第一个成为新的 leader，其余合并到它）"""
+        for follower_id in follower_ids:
+            if handler is None:
+                self.set_failed(follower_id, "合并的任务已取消，请重新提交")
+                continue
+            self.append_log(follower_id, "合并的任务已被取消，重新排队执行")
+            self.update_job(follower_id, status=JobStatus.QUEUED, stage='queued', progress=0, started_at=None)
+            self.submit_job(follower_id, handler, admit=False)
+
     def get_job(self, job_id: str) -> Optional[Job]:
         """获取任务"""
         with self._jobs_lock:
             return self._jobs.get(job_id)
 
-    def get_job_dict(self, job_id: str) -> Optional[Dict]:
-        """获取任务字典（包含队列信息）"""
+    def get_job_dict(self, job_id: str, log_since: Optional[int] = None) -> Optional[Dict]:
+        """
+        获取任务字典（包含队列信息）
+
+        Args:
+            log_since: 日志游标（可选），传入时附带该游标之后的新日志
+        """
         job = self.get_job(job_id)
         if not job:
             return None
         
-        # 更新队列位置信息
-        position, wait_time = self._queue.get_position_and_wait(job_id)
+        # 更新队列位置信息（follower 使用 leader 的排队位置）
+        position, wait_time = self._queue.get_position_and_wait(job.leader_id or job_id)
         job.queue_position = position
         job.estimated_wait = wait_time
         
-        return job.to_dict()
+        with self._jobs_lock:
+            data = job.to_dict()
+            if log_since is not None:
+                data["logs"], data["logs_truncated"] = job.logs_since(log_since)
+        return data
 
     def get_queue_stats(self) -> Dict:
-        """获取队列统计信息"""
-        return self._queue.get_queue_stats()
+        """获取队列统计信息（含准入控制与请求合并状态）"""
+        stats = self._queue.get_queue_stats()
+        stats["admission"] = admission_controller.get_stats()
+        with self._jobs_lock:
+            stats["coalescing"] = {
+                "enabled": JOB_COALESCE_ENABLED,
+                "leaders": len(self._inflight),
+                "followers": sum(len(ids) for ids in self._followers.values())
+            }
+        return stats
 
     def update_job(self, job_id: str, **kwargs):
-        """更新任务"""
+        """
+        更新任务（已取消的任务忽略执行线程的后续更新）
+
+        leader 的更新同步到合并的 followers；leader 结束时解除合并，
+        被取消时 followers 重新排队执行
+        """
+        resubmit, handler = [], None
         with self._jobs_lock:
             job = self._jobs.get(job_id)
-            if job:
-                for key, value in kwargs.items():
-                    if key == 'status':
-                        if isinstance(value, str):
-                            value = JobStatus(value)
-                        elif not isinstance(value, JobStatus):
-                            continue
-                    if hasattr(job, key):
-                        setattr(job, key, value)
-                job.updated_at = time.time()
+            if not job or not self._apply_update(job, kwargs):
+                return
+            finished = job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+            if job.status == JobStatus.CANCELLED:
+                handler = self._coalesce_handlers.get(job_id)
+                resubmit = self._release_coalesce(job)
+                for follower_id in resubmit:
+                    follower = self._jobs.get(follower_id)
+                    if follower:
+                        follower.leader_id = ""
+            else:
+                for follower_id in self._followers.get(job_id, ()):
+                    follower = self._jobs.get(follower_id)
+                    if follower and self._apply_update(follower, kwargs) and finished:
+                        follower.finished_at = time.time()
+                if finished:
+                    self._release_coalesce(job)
+
+        if resubmit:
+            self._resubmit_followers(resubmit, handler)
+
+    def _apply_update(self, job: Job, kwargs: Dict) -> bool:
+        """应用字段更新并记录变更，已取消的任务忽略更新时返回 False（需要在 _jobs_lock 内调用）"""
+        if job.status == JobStatus.CANCELLED and kwargs.get('status') not in (
+                JobStatus.CANCELLED, JobStatus.CANCELLED.value):
+            return False
+        changed = {}
+        for key, value in kwargs.items():
+            if key == 'status':
+                if isinstance(value, str):
+                    value = JobStatus(value)
+                elif not isinstance(value, JobStatus):
+                    continue
+            if hasattr(job, key):
+                if getattr(job, key) != value:
+                    changed[key] = value.value if isinstance(value, JobStatus) else value
+                setattr(job, key, value)
+        self._record_change(job, changed)
+        self._store.mark_dirty(job.job_id)
+        return True
 
     def append_log(self, job_id: str, message: str):
-        """追加日志"""
+        """追加日志（leader 的日志同步到合并的 followers）"""
         with self._jobs_lock:
             job = self._jobs.get(job_id)
             if job:
-                seq = len(job.logs) + 1
-                job.logs.append(f"步骤{seq}: {message}")
-                job.updated_at = time.time()
+                self._append_log_locked(job, message)
+                for follower_id in self._followers.get(job_id, ()):
+                    follower = self._jobs.get(follower_id)
+                    if follower and follower.status != JobStatus.CANCELLED:
+                        self._append_log_locked(follower, message)
+
+    def _append_log_locked(self, job: Job, message: str):
+        """追加一行日志（需要在 _jobs_lock 内调用）"""
+        job.log_count += 1
+        line = f"步骤{job.log_count}: {message}"
+        job.logs.append(line)
+        self._record_change(job, {"logs": [line], "log_cursor": job.log_count})
+        self._store.mark_dirty(job.job_id)
+
+    def _record_change(self, job: Job, changed: Dict):
+        """
+        记录一次任务变更并唤醒等待者（需要在 _jobs_lock 内调用）
+
+        updated_at 在同一任务内严格递增，可直接作为增量查询的游标
+        """
+        now = time.time()
+        job.updated_at = now if now > job.updated_at else job.updated_at + 1e-6
+        if not changed:
+            return
+        buffer = self._changes.get(job.job_id)
+        if buffer is None:
+            buffer = self._changes[job.job_id] = deque(maxlen=JOB_CHANGE_BUFFER)
+        buffer.append((job.updated_at, changed))
+        self._changes_cond.notify_all()
+
+    def _on_queue_change(self, job_id: str):
+        """任务队列调度引起的状态变化（开始执行、执行结束、取消）"""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            if job:
+                self._record_change(job, {
+                    "status": job.status.value,
+                    "stage": job.stage,
+                    "queue_position": job.queue_position,
+                    "started_at": job.started_at,
+                    "finished_at": job.finished_at
+                })
+                # leader 开始执行时同步到 followers（结束状态由 update_job 同步）
+                if job.status == JobStatus.RUNNING:
+                    for follower_id in self._followers.get(job_id, ()):
+                        follower = self._jobs.get(follower_id)
+                        if follower:
+                            self._apply_update(follower, {
+                                "status": JobStatus.RUNNING,
+                                "stage": job.stage,
+                                "started_at": job.started_at
+                            })
+        self._store.mark_dirty(job_id)
+
+    def get_job_changes(self, job_id: str, since: float = 0, timeout: float = 0) -> Optional[Dict]:
+        """
+        获取任务自 since 以来的增量变更（长轮询 / SSE 使用）
+
+        Args:
+            job_id: 任务ID
+            since: 上次收到的 updated_at 游标，0 表示获取完整快照
+            timeout: 没有新变更时最长等待时间（秒），0 表示立即返回
+
+        Returns:
+            Dict: {updated_at, full, changes, logs, finished}；任务不存在时返回 None
+            - full=True 时 changes 为完整任务字典（首次请求或游标已超出缓冲区）
+            - full=False 时 changes 只包含变化的字段，logs 为新增日志
+        """
+        deadline = time.time() + max(0.0, timeout)
+        with self._changes_cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None
+                finished = job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+                remaining = deadline - time.time()
+                if job.updated_at > since or finished or remaining <= 0:
+                    break
+                self._changes_cond.wait(remaining)
+
+            buffer = self._changes.get(job_id)
+            # 游标之后的变更可能已被丢弃：缓冲区已滚动，或服务重启后缓冲区为空
+            truncated = since < job.updated_at and (
+                not buffer or (len(buffer) == buffer.maxlen and since < buffer[0][0])
+            )
+            if since <= 0 or truncated:
+                # 首次请求或游标过旧：返回完整快照
+                result = {"full": True, "changes": job.to_dict(), "logs": list(job.logs)}
+            else:
+                changes, logs = {}, []
+                for ts, changed in buffer or ():
+                    if ts <= since:
+                        continue
+                    for key, value in changed.items():
+                        if key == "logs":
+                            logs.extend(value)
+                        else:
+                            changes[key] = value
+                result = {"full": False, "changes": changes, "logs": logs}
+            result["updated_at"] = job.updated_at
+            result["finished"] = finished
+
+        # 排队中的任务附带当前位置与预估等待（不在任务锁内查询队列）
+        if not finished and result["changes"].get("status", job.status.value) == JobStatus.QUEUED.value:
+            position, wait_time = self._queue.get_position_and_wait(job.leader_id or job_id)
+            result["changes"]["queue_position"] = position
+            result["changes"]["estimated_wait"] = round(wait_time, 1)
+        return result
 
     def set_failed(self, job_id: str, error: str, **kwargs):
         """设置任务失败"""
@@ -422,12 +949,49 @@ class JobManager:
             **kwargs
         )
 
+    def get_cancel_token(self, job_id: str) -> CancellationToken:
+        """获取任务的取消令牌（不存在则创建）"""
+        with self._jobs_lock:
+            token = self._cancel_tokens.get(job_id)
+            if token is None:
+                token = self._cancel_tokens[job_id] = CancellationToken()
+            return token
+
     def cancel_job(self, job_id: str) -> bool:
-        """取消排队中的任务"""
-        success = self._queue.cancel_job(job_id)
-        if success:
+        """
+        取消任务
+        - 排队中的任务直接移出队列
+        - 执行中的任务触发取消令牌，生成流程在下一个检查点停止，未开始的子任务被丢弃
+        - 合并的 follower 只解除合并，不影响 leader 的执行
+        """
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            if job and job.leader_id and job.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+                followers = self._followers.get(job.leader_id, [])
+                if job_id in followers:
+                    followers.remove(job_id)
+                job.leader_id = ""
+                self._apply_update(job, {"status": JobStatus.CANCELLED, "stage": "cancelled"})
+                logger.info(f"合并的任务已取消: {job_id}")
+                return True
+
+        if self._queue.cancel_job(job_id):
             self.update_job(job_id, status=JobStatus.CANCELLED)
-        return success
+            return True
+
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            if not job or job.status != JobStatus.RUNNING:
+                return False
+            token = self._cancel_tokens.get(job_id)
+            if token is None:
+                token = self._cancel_tokens[job_id] = CancellationToken()
+
+        token.cancel()
+        self.update_job(job_id, status=JobStatus.CANCELLED, stage='cancelled')
+        self.append_log(job_id, "任务已取消，停止后续生成")
+        logger.info(f"执行中的任务已取消: {job_id}")
+        return True
 
     def _cleanup_old_jobs(self):
         """清理过期任务（需要在锁内调用）"""
@@ -440,10 +1004,78 @@ class JobManager:
 
         for job_id in expired:
             del self._jobs[job_id]
+            self._cancel_tokens.pop(job_id, None)
+            self._changes.pop(job_id, None)
+        self._store.mark_deleted(expired)
 
         if expired:
             logger.info(f"清理了 {len(expired)} 个过期任务")
 
+    def _snapshot_jobs(self, job_ids) -> List[Dict]:
+        """生成任务持久化快照（供 JobStore 刷盘线程调用）"""
+        with self._jobs_lock:
+            return [self._jobs[jid].to_record() for jid in job_ids if jid in self._jobs]
+
+    def _restore_from_store(self):
+        """启动时从持久化存储恢复任务"""
+        try:
+            records = self._store.load_all()
+        except Exception as e:
+            logger.error(f"加载持久化任务失败: {e}")
+            return
+
+        now = time.time()
+        restored = 0
+        expired = []
+        for record in records:
+            try:
+                job = Job.from_record(record)
+            except Exception as e:
+                logger.warning(f"跳过无法恢复的任务记录: {e}")
+                continue
+            finished = job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+            if finished and now - job.created_at > self._job_ttl:
+                expired.append(job.job_id)
+                continue
+            self._jobs[job.job_id] = job
+            restored += 1
+
+        self._store.mark_deleted(expired)
+        if restored:
+            logger.info(f"从持久化存储恢复了 {restored} 个任务")
+
+    def resume_pending_jobs(self, handler: Callable) -> int:
+        """
+        重新提交重启前未完成的任务（排队中或执行中）
+
+        Args:
+            handler: 任务执行函数 handler(job_id, requirement)
+
+        Returns:
+            int: 重新入队的任务数量
+        """
+        with self._jobs_lock:
+            pending = sorted(
+                (job for job in self._jobs.values()
+                 if job.status in (JobStatus.QUEUED, JobStatus.RUNNING)),
+                key=lambda j: j.created_at
+            )
+
+        resumed = 0
+        for job in pending:
+            if job.status == JobStatus.RUNNING:
+                self.append_log(job.job_id, "服务重启，任务重新排队执行")
+            self.update_job(job.job_id, status=JobStatus.QUEUED, stage='queued', progress=0, started_at=None)
+            result = self.submit_job(job.job_id, handler, admit=False)
+            if result.get("success"):
+                resumed += 1
+            else:
+                self.set_failed(job.job_id, f"服务重启后重新排队失败: {result.get('error')}")
+
+        if resumed:
+            logger.info(f"重启恢复: {resumed} 个未完成任务已重新入队")
+        return resumed
+
     def _cleanup_loop(self, interval: int):
         """定期清理循环"""
         while True:
@@ -452,5 +1084,129 @@ class JobManager:
                 self._cleanup_old_jobs()
 
 
-# 全局任务管理器（并发限制5个）
-job_manager = JobManager(max_concurrent=5, max_queue_size=50)
+class WorkerJobManager:
+    """
+    工作进程内的任务管理器代理
+
+    读取主进程下发的任务快照，状态更新与日志通过事件队列回传主进程 JobManager，
+    使生成流程代码在线程模式与进程模式下无需区分
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, Dict] = {}
+        self._cancel_tokens: Dict[str, CancellationToken] = {}
+        self._events = None
+
+    def attach(self, event_queue):
+        """接入主进程事件队列"""
+        self._events = event_queue
+
+    def bind_snapshot(self, job_id: str, snapshot: Dict, cancel_event=None):
+        """
+        绑定任务快照（任务开始前调用）
+
+        Args:
+            cancel_event: 主进程设置的跨进程取消标志（可选）
+        """
+        self._snapshots[job_id] = dict(snapshot)
+        self._cancel_tokens[job_id] = CancellationToken(cancel_event)
+
+    def release(self, job_id: str):
+        """释放任务快照，并通知主进程该任务的事件已全部发出"""
+        self._snapshots.pop(job_id, None)
+        self._cancel_tokens.pop(job_id, None)
+        self._emit("done", job_id, None)
+
+    def get_cancel_token(self, job_id: str) -> CancellationToken:
+        """获取任务的取消令牌"""
+        token = self._cancel_tokens.get(job_id)
+        if token is None:
+            token = self._cancel_tokens[job_id] = CancellationToken()
+        return token
+
+    def _emit(self, kind: str, job_id: str, payload):
+        if self._events is None:
+            return
+        try:
+            self._events.put((kind, job_id, payload))
+        except Exception as e:
+            logger.warning(f"任务事件回传失败: {job_id}, {kind}, {e}")
+
+    def get_job_dict(self, job_id: str) -> Optional[Dict]:
+        """获取任务快照"""
+        snapshot = self._snapshots.get(job_id)
+        return dict(snapshot) if snapshot is not None else None
+
+    def get_queue_stats(self) -> Dict:
+        return {}
+
+    def update_job(self, job_id: str, **kwargs):
+        """更新任务（同步到本地快照并回传主进程）"""
+        if isinstance(kwargs.get('status'), JobStatus):
+            kwargs['status'] = kwargs['status'].value
+        snapshot = self._snapshots.get(job_id)
+        if snapshot is not None:
+            snapshot.update(kwargs)
+        self._emit("update", job_id, kwargs)
+
+    def append_log(self, job_id: str, message: str):
+        """追加日志（回传主进程）"""
+        self._emit("log", job_id, message)
+
+    def forward_upstream(self, host: str, ok: bool, latency: float):
+        """转发下游请求结果（由主进程的准入控制器统计）"""
+        self._emit("upstream", "", (host, ok, latency))
+
+    def forward_breaker(self, key: str, snapshot: Dict):
+        """转发熔断状态变化（由主进程汇总展示）"""
+        self._emit("breaker", "", (str(os.getpid()), key, snapshot))
+
+    def set_failed(self, job_id: str, error: str, **kwargs):
+        self.update_job(job_id, status=JobStatus.FAILED, error=error, **kwargs)
+
+    def set_succeeded(self, job_id: str, images: List[str], **kwargs):
+        self.update_job(job_id, status=JobStatus.SUCCEEDED, images=images, progress=100, stage='done', **kwargs)
+
+    def resume_pending_jobs(self, handler: Callable) -> int:
+        """工作进程不负责任务恢复"""
+        return 0
+
+
+_GLOBAL_JOB_MANAGER = None
+_JOB_MANAGER_LOCK = threading.Lock()
+
+
+def get_job_manager():
+    """
+    获取全局任务管理器（首次调用时创建）
+
+    主进程为 JobManager（默认 SQLite 持久化）；生成任务工作进程为 WorkerJobManager，
+    不持有任务表和持久化存储，只做状态转发
+    """
+    global _GLOBAL_JOB_MANAGER
+
+    if _GLOBAL_JOB_MANAGER is None:
+        with _JOB_MANAGER_LOCK:
+            if _GLOBAL_JOB_MANAGER is None:
+                if is_worker_process():
+                    _GLOBAL_JOB_MANAGER = WorkerJobManager()
+                else:
+                    _GLOBAL_JOB_MANAGER = JobManager(
+                        max_concurrent=JOB_MAX_CONCURRENT,
+                        max_queue_size=JOB_MAX_QUEUE_SIZE,
+                        store=create_job_store()
+                    )
+    return _GLOBAL_JOB_MANAGER
+
+
+class _LazyJobManager:
+    """
+    全局任务管理器的代理：首次访问属性时才创建实例，
+    导入 utils（如命令行脚本）不会创建任务数据库或启动执行线程
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_job_manager(), name)
+
+
+job_manager = _LazyJobManager()
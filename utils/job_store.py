@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务持久化存储
+为 JobManager 提供可插拔的持久化后端，服务重启后任务不丢失
+
+- JobStore: 默认后端（纯内存，不做持久化）
+- SQLiteJobStore: SQLite WAL 后端，批量异步写入（write-behind），
+  update_job / append_log 只标记脏数据，不在调用路径上做磁盘 IO
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 持久化配置（可通过环境变量覆盖）
+JOB_STORE_BACKEND = os.environ.get("JOB_STORE_BACKEND", "sqlite").strip().lower()
+# 相对路径按项目根目录解析（与启动时的工作目录无关）
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOB_STORE_PATH = os.path.join(_PROJECT_ROOT, os.environ.get("JOB_STORE_PATH", "cache/jobs.db"))
+JOB_STORE_FLUSH_INTERVAL = float(os.environ.get("JOB_STORE_FLUSH_INTERVAL", "0.5"))
+
+
+class JobStore:
+    """
+    任务存储基类（内存模式，不做持久化）
+
+    子类只需实现 load_all / _write，批量写入与刷盘线程由基类统一管理
+    """
+
+    persistent = False
+
+    def __init__(self, flush_interval: float = JOB_STORE_FLUSH_INTERVAL):
+        self._flush_interval = flush_interval
+        self._snapshot_fn: Optional[Callable[[Iterable[str]], List[Dict]]] = None
+        self._dirty: set = set()
+        self._deleted: set = set()
+        self._dirty_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+
+    def bind(self, snapshot_fn: Callable[[Iterable[str]], List[Dict]]):
+        """
+        绑定快照函数并启动刷盘线程
+
+        Args:
+            snapshot_fn: snapshot_fn(job_ids) -> 任务记录列表（由 JobManager 在锁内生成）
+        """
+        self._snapshot_fn = snapshot_fn
+        if not self.persistent or self._flush_thread is not None:
+            return
+        self._flush_thread = threading.Thread(
+            target=self._flush_loop,
+            daemon=True,
+            name="JobStore-Flush"
+        )
+        self._flush_thread.start()
+        atexit.register(self.flush)
+
+    def load_all(self) -> List[Dict]:
+        """加载所有已持久化的任务记录"""
+        return []
+
+    def mark_dirty(self, job_id: str):
+        """标记任务需要写入（仅内存操作，O(1)）"""
+        if not self.persistent:
+            return
+        with self._dirty_lock:
+            self._dirty.add(job_id)
+            self._deleted.discard(job_id)
+
+    def mark_deleted(self, job_ids: Iterable[str]):
+        """标记任务需要删除"""
+        if not self.persistent:
+            return
+        with self._dirty_lock:
+            for job_id in job_ids:
+                self._dirty.discard(job_id)
+                self._deleted.add(job_id)
+
+    def flush(self):
+        """将所有脏数据一次性写入存储"""
+        if not self.persistent or self._snapshot_fn is None:
+            return
+        with self._flush_lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+                deleted, self._deleted = self._deleted, set()
+            if not dirty and not deleted:
+                return
+            try:
+                records = self._snapshot_fn(dirty) if dirty else []
+                self._write(records, list(deleted))
+            except Exception as e:
+                # 写入失败时放回脏集合，下个周期重试
+                logger.warning(f"任务持久化写入失败，将重试: {e}")
+                with self._dirty_lock:
+                    self._dirty |= dirty
+                    self._deleted |= deleted
+
+    def _write(self, records: List[Dict], deleted_ids: List[str]):
+        """写入一批任务记录（子类实现）"""
+        pass
+
+    def _flush_loop(self):
+        """刷盘循环"""
+        while True:
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """关闭存储"""
+        self.flush()
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLite 任务存储（WAL 模式）
+
+    - journal_mode=WAL + synchronous=NORMAL：写入不阻塞读取，提交时不逐条 fsync
+    - 一个刷盘周期内的所有更新合并为一个事务
+    """
+
+    persistent = True
+
+    def __init__(self, db_path: str = JOB_STORE_PATH, flush_interval: float = JOB_STORE_FLUSH_INTERVAL):
+        super().__init__(flush_interval=flush_interval)
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn_lock = threading.Lock()
+        with self._conn_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+        logger.info(f"SQLiteJobStore 初始化: {db_path}, flush_interval={flush_interval}s")
+
+    def load_all(self) -> List[Dict]:
+        """按创建时间顺序加载所有任务记录"""
+        records = []
+        with self._conn_lock:
+            rows = self._conn.execute("SELECT data FROM jobs ORDER BY created_at").fetchall()
+        for (data,) in rows:
+            try:
+                records.append(json.loads(data))
+            except Exception as e:
+                logger.warning(f"跳过损坏的任务记录: {e}")
+        return records
+
+    def _write(self, records: List[Dict], deleted_ids: List[str]):
+        rows = [
+            (
+                r["job_id"],
+                r.get("status", ""),
+                r.get("created_at", time.time()),
+                r.get("updated_at", time.time()),
+                json.dumps(r, ensure_ascii=False)
+            )
+            for r in records
+        ]
+        with self._conn_lock:
+            self._conn.execute("BEGIN")
+            try:
+                if rows:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO jobs (job_id, status, created_at, updated_at, data) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+                if deleted_ids:
+                    self._conn.executemany(
+                        "DELETE FROM jobs WHERE job_id = ?",
+                        [(job_id,) for job_id in deleted_ids]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.debug(f"任务持久化: 写入 {len(rows)} 条, 删除 {len(deleted_ids)} 条")
+
+    def close(self):
+        super().close()
+        with self._conn_lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+
+
+def create_job_store(backend: str = JOB_STORE_BACKEND, path: str = JOB_STORE_PATH) -> JobStore:
+    """
+    根据配置创建任务存储后端
+
+    Args:
+        backend: 'sqlite' 或 'memory'
+        path: SQLite 数据库路径
+
+    Returns:
+        JobStore: 存储后端实例（初始化失败时回退到内存模式）
+    """
+    if backend == "sqlite":
+        try:
+            return SQLiteJobStore(path)
+        except Exception as e:
+            logger.error(f"SQLite 任务存储初始化失败，回退到内存模式: {e}")
+    return JobStore()
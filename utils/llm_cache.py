@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 响应缓存
+按内容寻址缓存确定性的大模型调用结果（低 temperature 的翻译、动作分类、需求分析等）
+
+- 缓存键：接口地址 + 请求体（模型、messages、temperature/max_tokens 等参数）+ 可选命名空间的 SHA-256，
+  不包含鉴权头；调用方可用命名空间（如翻译表版本）使旧结果整体失效
+- 两级存储：内存 LRU（进程内，亚毫秒命中）+ 磁盘（cache/llm，进程间与重启后共享）
+- 每条记录带过期时间，过期后视为未命中并删除
+- 只缓存 HTTP 200 且能解析出非空文本的响应（响应体是错误信息或内容为空时不缓存，
+  避免一次异常回复被固定到过期为止）
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .http_client import parse_ai_response
+
+logger = logging.getLogger(__name__)
+
+# 缓存配置（可通过环境变量覆盖）
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "cache/llm")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 秒
+LLM_CACHE_MEMORY_SIZE = int(os.environ.get("LLM_CACHE_MEMORY_SIZE", "1000"))
+# temperature 不超过该值的请求视为确定性调用，自动缓存
+LLM_CACHE_MAX_TEMPERATURE = float(os.environ.get("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+
+# 不参与缓存键的请求体字段
+_IGNORED_FIELDS = ("stream",)
+
+
+def is_cacheable(payload: Optional[Dict]) -> bool:
+    """请求是否为确定性调用（显式设置了较低的 temperature）"""
+    if not isinstance(payload, dict):
+        return False
+    temperature = payload.get("temperature")
+    return isinstance(temperature, (int, float)) and temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+
+class LLMResponseCache:
+    """LLM 响应缓存（线程安全）"""
+
+    def __init__(
+        self,
+        cache_dir: str = LLM_CACHE_DIR,
+        ttl: int = LLM_CACHE_TTL,
+        memory_size: int = LLM_CACHE_MEMORY_SIZE,
+        enabled: bool = LLM_CACHE_ENABLED
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, body)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "rejected": 0}
+
+    @staticmethod
+    def make_key(url: str, payload: Dict, namespace: str = "") -> str:
+        """计算缓存键（namespace 为空时与不带命名空间的旧键一致）"""
+        body = {k: v for k, v in payload.items() if k not in _IGNORED_FIELDS}
+        parts = [url, body, namespace] if namespace else [url, body]
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, url: str, payload: Dict, namespace: str = "") -> Optional[requests.Response]:
+        """
+        查询缓存
+
+        Returns:
+            requests.Response: 命中时返回重建的响应（X-Cache: HIT），未命中返回 None
+        """
+        if not self.enabled:
+            return None
+        key = self.make_key(url, payload, namespace)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return self._to_response(url, entry[1])
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            record = None
+        except Exception as e:
+            logger.warning(f"[LLM缓存] 读取失败: {key[:8]}..., {e}")
+            record = None
+
+        with self._lock:
+            if record is None or record.get("expires_at", 0) <= now:
+                self._stats["misses"] += 1
+                if record is not None:
+                    self._remove_file(path)
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, record["expires_at"], record["body"])
+        return self._to_response(url, record["body"])
+
+    def set(self, url: str, payload: Dict, response: requests.Response, namespace: str = ""):
+        """缓存响应（仅 HTTP 200 且能解析出非空文本）"""
+        if not self.enabled or response.status_code != 200:
+            return
+        try:
+            text = parse_ai_response(response.json())
+        except Exception:
+            text = ""
+        if not text:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return
+        key = self.make_key(url, payload, namespace)
+        body = response.text
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            self._remember(key, expires_at, body)
+            self._stats["stores"] += 1
+
+        path = self._path(key)
+        record = {"expires_at": expires_at, "model": payload.get("model"), "body": body}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"[LLM缓存] 写入失败: {key[:8]}..., {e}")
+
+    def _remember(self, key: str, expires_at: float, body: str):
+        """写入内存 LRU（需要在锁内调用）"""
+        self._memory[key] = (expires_at, body)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _to_response(url: str, body: str) -> requests.Response:
+        """由缓存内容重建 requests.Response"""
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body.encode("utf-8")
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json", "X-Cache": "HIT"})
+        response.url = url
+        response.reason = "OK"
+        return response
+
+    def clear(self):
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    self._remove_file(os.path.join(root, name))
+        logger.info("[LLM缓存] 已清空")
+
+    def get_stats(self) -> Dict:
+        """获取缓存命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0
+        stats["enabled"] = self.enabled
+        return stats
+
+
+# 全局 LLM 响应缓存
+llm_cache = LLMResponseCache()
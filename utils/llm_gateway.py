@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 调用网关
+所有大模型 chat/completions 调用统一经过网关发出：
+
+- 按模型的令牌桶限流（LLM_RATE_LIMIT / LLM_MODEL_RATE_LIMITS），超出速率的请求排队等待
+- 优先级：交互式分析（PRIORITY_INTERACTIVE）优先于后台 Gate 检查（PRIORITY_BACKGROUND）
+- 统一重试：429 / 5xx / 连接错误按指数退避重试，重试同样需要令牌；
+  收到 Retry-After 时该模型进入冷却，所有调用方一起等待，避免各自的重试循环同时打到同一个接口
+- 按模型统计请求数、错误数、429 次数、重试次数、排队等待与延迟
+- 确定性调用（低 temperature）先查 LLMResponseCache，命中时不占用令牌也不发请求
+- 下游熔断中（CircuitOpenError）时不重试，直接抛给调用方走降级逻辑
+
+多进程执行模式下，各工作进程分别限流
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+import requests
+
+from .http_client import http_post
+from .async_http import parse_retry_after, RETRY_STATUS
+from .llm_cache import llm_cache, is_cacheable
+from .circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# 优先级（数值越小越优先）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# 限流与重试配置（可通过环境变量覆盖）
+LLM_RATE_LIMIT = float(os.environ.get("LLM_RATE_LIMIT", "5"))  # 每个模型每秒请求数，0 表示不限制
+LLM_RATE_BURST = float(os.environ.get("LLM_RATE_BURST", "10"))  # 令牌桶容量
+LLM_MODEL_RATE_LIMITS = os.environ.get("LLM_MODEL_RATE_LIMITS", "")  # 例如 "gpt-5=1:2,doubao-seed-1.6-250615=10"
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BACKOFF = float(os.environ.get("LLM_RETRY_BACKOFF", "1.0"))
+LLM_MAX_RETRY_AFTER = float(os.environ.get("LLM_MAX_RETRY_AFTER", "60"))
+
+
+def _parse_model_limits(spec: str) -> Dict[str, tuple]:
+    """解析 "模型=速率[:容量]" 列表"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, value = item.split("=", 1)
+        rate, _, burst = value.partition(":")
+        try:
+            limits[model.strip().lower()] = (float(rate), float(burst) if burst else max(1.0, float(rate) * 2))
+        except ValueError:
+            logger.warning(f"无效的模型限流配置: {item}")
+    return limits
+
+
+class _ModelLimiter:
+    """单个模型的令牌桶、排队列表与统计"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Retry-After 冷却截止时间（monotonic）
+        self.waiters: list = []  # (priority, seq) 小顶堆
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.latencies: deque = deque(maxlen=200)
+
+    def refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class LLMGateway:
+    """LLM 调用网关（线程安全）"""
+
+    def __init__(
+        self,
+        rate: float = LLM_RATE_LIMIT,
+        burst: float = LLM_RATE_BURST,
+        model_limits: Optional[Dict[str, tuple]] = None,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff: float = LLM_RETRY_BACKOFF
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.model_limits = model_limits if model_limits is not None else _parse_model_limits(LLM_MODEL_RATE_LIMITS)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._limiters: Dict[str, _ModelLimiter] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+        logger.info(f"LLMGateway 初始化: rate={rate}/s, burst={burst}, models={self.model_limits}")
+
+    def _limiter(self, model: str) -> _ModelLimiter:
+        """获取模型的限流器（需要在锁内调用）"""
+        key = (model or "").strip().lower()
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            rate, burst = self.model_limits.get(key, (self.rate, self.burst))
+            limiter = self._limiters[key] = _ModelLimiter(rate, burst)
+        return limiter
+
+    def _acquire(self, model: str, priority: int) -> float:
+        """
+        获取一个令牌（按优先级排队，冷却期间等待）
+
+        Returns:
+            float: 排队等待时间（秒）
+        """
+        start = time.monotonic()
+        with self._cond:
+            limiter = self._limiter(model)
+            entry = (priority, next(self._seq))
+            heapq.heappush(limiter.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    limiter.refill(now)
+                    if now < limiter.blocked_until:
+                        wait = limiter.blocked_until - now
+                    elif limiter.waiters[0] != entry:
+                        # 前面还有更高优先级或更早的请求
+                        wait = 1.0
+                    elif limiter.rate <= 0 or limiter.tokens >= 1:
+                        if limiter.rate > 0:
+                            limiter.tokens -= 1
+                        break
+                    else:
+                        wait = (1 - limiter.tokens) / limiter.rate
+                    self._cond.wait(min(wait, 1.0))
+            finally:
+                limiter.waiters.remove(entry)
+                heapq.heapify(limiter.waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            limiter.total_wait += waited
+        return waited
+
+    def _cooldown(self, model: str, seconds: float):
+        """模型进入冷却（所有调用方暂停到 Retry-After 之后）"""
+        with self._cond:
+            limiter = self._limiter(model)
+            limiter.blocked_until = max(limiter.blocked_until, time.monotonic() + seconds)
+            limiter.tokens = 0.0
+            self._cond.notify_all()
+
+    def _record(self, model: str, status: Optional[int], latency: float, retried: bool):
+        with self._cond:
+            limiter = self._limiter(model)
+            limiter.requests += 1
+            if retried:
+                limiter.retries += 1
+            if status is None or status in RETRY_STATUS:
+                limiter.errors += 1
+            if status == 429:
+                limiter.rate_limited += 1
+            if status is not None and status not in RETRY_STATUS:
+                limiter.latencies.append(latency)
+
+    def post(
+        self,
+        model: str,
+        url: str,
+        json: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        timeout: int = 60,
+        priority: int = PRIORITY_INTERACTIVE,
+        cache: Optional[bool] = None,
+        cache_namespace: str = ""
+    ) -> requests.Response:
+        """
+        发送 LLM 请求（缓存、限流、排队、统一重试）
+
+        Args:
+            model: 模型名称（限流与统计的维度）
+            url: chat/completions 接口地址
+            json: 请求体
+            headers: 请求头
+            timeout: 单次请求超时（秒）
+            priority: PRIORITY_INTERACTIVE / PRIORITY_BACKGROUND
+            cache: 是否使用响应缓存（None 时按 temperature 自动判断）
+            cache_namespace: 缓存命名空间（可选），变化后旧的缓存结果不再命中
+
+        Returns:
+            requests.Response: 重试用尽后返回最后一次响应，由调用方检查状态码；
+            连接错误重试用尽后抛出 requests 异常，下游熔断中时立即抛出 CircuitOpenError
+        """
+        use_cache = is_cacheable(json) if cache is None else (cache and json is not None)
+        if use_cache:
+            cached = llm_cache.get(url, json, cache_namespace)
+            if cached is not None:
+                with self._cond:
+                    self._limiter(model).cache_hits += 1
+                return cached
+
+        attempt = 0
+        while True:
+            waited = self._acquire(model, priority)
+            if waited > 1:
+                logger.info(f"LLM 限流排队: model={model}, 等待 {waited:.1f}秒")
+            start = time.time()
+            try:
+                # 重试由网关统一控制，底层客户端不再单独重试
+                response = http_post(url, json=json, headers=headers, timeout=timeout, max_retries=0)
+            except CircuitOpenError:
+                raise
+            except requests.exceptions.RequestException as e:
+                self._record(model, None, time.time() - start, attempt > 0)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"LLM 请求失败，{delay:.1f}秒后重试 ({attempt + 1}/{self.max_retries}): "
+                               f"model={model}, {type(e).__name__} {e}")
+            else:
+                self._record(model, response.status_code, time.time() - start, attempt > 0)
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    if use_cache:
+                        llm_cache.set(url, json, response, cache_namespace)
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    delay = min(retry_after, LLM_MAX_RETRY_AFTER)
+                    self._cooldown(model, delay)
+                else:
+                    delay = self.backoff * (2 ** attempt)
+                logger.warning(f"LLM HTTP {response.status_code}，{delay:.1f}秒后重试 "
+                               f"({attempt + 1}/{self.max_retries}): model={model}")
+            attempt += 1
+            time.sleep(delay)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取各模型的限流与调用统计"""
+        with self._cond:
+            now = time.monotonic()
+            stats = {}
+            for model, limiter in sorted(self._limiters.items()):
+                latencies = sorted(limiter.latencies)
+                stats[model] = {
+                    "rate": limiter.rate,
+                    "waiting": len(limiter.waiters),
+                    "cooldown": round(max(0.0, limiter.blocked_until - now), 1),
+                    "requests": limiter.requests,
+                    "cache_hits": limiter.cache_hits,
+                    "errors": limiter.errors,
+                    "rate_limited": limiter.rate_limited,
+                    "retries": limiter.retries,
+                    "avg_wait": round(limiter.total_wait / limiter.requests, 2) if limiter.requests else 0,
+                    "p50_latency": round(latencies[len(latencies) // 2], 2) if latencies else 0,
+                    "p90_latency": round(latencies[int((len(latencies) - 1) * 0.9)], 2) if latencies else 0
+                }
+            return stats
+
+
+# 全局 LLM 网关
+llm_gateway = LLMGateway()
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 远程文件下载器模块
-提供远程文件下载功能
+提供远程文件下载功能（经共享 HTTP Session 流式下载）
 """
 
 import os
@@ -12,6 +12,8 @@ import logging
 from typing import Optional
 import requests
 
+from .http_client import http_get
+
 logger = logging.getLogger(__name__)
 
 
@@ -80,7 +82,7 @@ class RemoteFileDownloader:
         
         try:
             # 发送HTTP请求
-            response = requests.get(url, timeout=self.timeout, stream=True)
+            response = http_get(url, timeout=self.timeout, stream=True)
             response.raise_for_status()
             
             # 确定文件扩展名
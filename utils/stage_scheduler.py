@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阶段调度器
+为生成流程的每个阶段提供独立的并发上限，实现任务间的流水线执行
+
+- analyze: LLM 内容分析 / 合规检查 / 表情动作分析（远程调用，IO 密集）
+- compose: 素材匹配与基础图片合成（cv2/numpy/CLIP，CPU 密集）
+- generate: 远程图片生成（配件、背景）
+- gate: 最终 Gate 质量检查（远程调用）
+
+任务只在进入某个阶段时占用该阶段的槽位，等待图片生成接口的任务
+不会占住合成阶段的并发，JobQueue 只负责控制总的在途任务数
+多进程执行模式下，各阶段上限按工作进程分别生效
+"""
+
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from .cancellation import CancellationToken, CANCEL_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 阶段名称
+STAGE_ANALYZE = "analyze"
+STAGE_COMPOSE = "compose"
+STAGE_GENERATE = "generate"
+STAGE_GATE = "gate"
+
+# 各阶段并发上限（可通过环境变量覆盖）
+STAGE_LIMITS = {
+    STAGE_ANALYZE: int(os.environ.get("STAGE_CONCURRENCY_ANALYZE", "8")),
+    STAGE_COMPOSE: int(os.environ.get("STAGE_CONCURRENCY_COMPOSE", str(min(4, os.cpu_count() or 1)))),
+    STAGE_GENERATE: int(os.environ.get("STAGE_CONCURRENCY_GENERATE", "5")),
+    STAGE_GATE: int(os.environ.get("STAGE_CONCURRENCY_GATE", "5")),
+}
+
+
+class _Stage:
+    """单个阶段的并发槽位与计数"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.semaphore = threading.BoundedSemaphore(self.limit)
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+
+class StageScheduler:
+    """
+    阶段调度器（线程安全）
+
+    用法:
+        with stage_scheduler.stage(STAGE_COMPOSE, job_id):
+            ...
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        limits = limits or STAGE_LIMITS
+        self._stages: Dict[str, _Stage] = {name: _Stage(name, limit) for name, limit in limits.items()}
+        self._lock = threading.Lock()
+        logger.info(f"StageScheduler 初始化: {', '.join(f'{s.name}={s.limit}' for s in self._stages.values())}")
+
+    @contextmanager
+    def stage(self, name: str, job_id: str = "", cancel_token: Optional[CancellationToken] = None):
+        """
+        进入阶段（阶段并发已满时阻塞等待）
+
+        Args:
+            name: 阶段名称，未配置的阶段不做限制
+            job_id: 任务ID（用于日志）
+            cancel_token: 取消令牌（可选），等待槽位期间被取消或超时则抛出 JobCancelledError
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        stage = self._stages.get(name)
+        if stage is None:
+            yield
+            return
+
+        with self._lock:
+            stage.waiting += 1
+        wait_start = time.time()
+        try:
+            while not stage.semaphore.acquire(timeout=CANCEL_POLL_INTERVAL):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+        except BaseException:
+            with self._lock:
+                stage.waiting -= 1
+            raise
+        waited = time.time() - wait_start
+        with self._lock:
+            stage.waiting -= 1
+            stage.running += 1
+            stage.total_wait += waited
+        if waited > 1:
+            logger.info(f"[Job {job_id}] 阶段 {name} 排队等待 {waited:.1f}秒")
+
+        run_start = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                stage.running -= 1
+                stage.completed += 1
+                stage.total_run += time.time() - run_start
+            stage.semaphore.release()
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取各阶段的并发与排队情况"""
+        with self._lock:
+            return {
+                stage.name: {
+                    "limit": stage.limit,
+                    "running": stage.running,
+                    "waiting": stage.waiting,
+                    "completed": stage.completed,
+                    "avg_wait": round(stage.total_wait / stage.completed, 1) if stage.completed else 0,
+                    "avg_duration": round(stage.total_run / stage.completed, 1) if stage.completed else 0
+                }
+                for stage in self._stages.values()
+            }
+
+
+# 全局阶段调度器
+stage_scheduler = StageScheduler()
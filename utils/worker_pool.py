@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成任务工作进程池
+可选的多进程执行模式：生成任务在常驻工作进程中运行，绕开 GIL，
+图片合成（cv2/numpy）与 CLIP 编码等 CPU 密集阶段可以利用多核
+
+- 工作进程使用 spawn 方式启动，启动时预加载 CLIP 模型与素材缓存（warm worker）
+- 工作进程内的 job_manager 是转发代理（WorkerJobManager），
+  任务状态/进度/日志通过事件队列回传主进程的 JobManager，对外 API 不变
+- 取消标志放在共享内存槽位表中，主进程取消任务时置位，工作进程在检查点读取
+- 工作进程内的下游请求结果同样经事件队列转发给主进程的准入控制器
+- 默认 thread 模式，设置 JOB_EXECUTION_MODE=process 启用
+"""
+
+import os
+import time
+import threading
+import logging
+import itertools
+import multiprocessing
+from multiprocessing.context import SpawnContext, SpawnProcess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 执行模式配置（可通过环境变量覆盖）
+JOB_EXECUTION_MODE = os.environ.get("JOB_EXECUTION_MODE", "thread").strip().lower()
+JOB_PROCESS_WORKERS = int(os.environ.get("JOB_PROCESS_WORKERS", "0")) or min(5, os.cpu_count() or 1)
+JOB_WORKER_PRELOAD = os.environ.get("JOB_WORKER_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# 任务结束后等待事件队列排空的最长时间（秒）
+_EVENT_DRAIN_TIMEOUT = 10.0
+# 共享取消标志槽位数（同时提交到进程池的任务数上限）
+_CANCEL_SLOTS = 256
+
+# 生成任务工作进程的进程名前缀（工作进程标记）
+_WORKER_NAME_PREFIX = "GenerationWorker-"
+
+_GLOBAL_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def is_worker_process() -> bool:
+    """
+    当前是否为生成任务工作进程
+
+    注意：spawn 子进程在重新导入主模块时 initializer 尚未执行、parent_process() 也未设置，
+    而进程名在导入前已经设置，因此工作进程以专用进程名前缀标记；
+    其他 multiprocessing 子进程不受影响
+    """
+    return multiprocessing.current_process().name.startswith(_WORKER_NAME_PREFIX)
+
+
+class _WorkerProcess(SpawnProcess):
+    """生成任务工作进程（以进程名前缀标记）"""
+
+    _seq = itertools.count(1)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = f"{_WORKER_NAME_PREFIX}{next(self._seq)}"
+
+
+class _WorkerContext(SpawnContext):
+    """创建 _WorkerProcess 的 spawn 上下文"""
+    Process = _WorkerProcess
+
+
+class GenerationWorkerPool:
+    """
+    生成任务进程池
+
+    JobQueue 仍负责排队与并发控制，执行线程只调用 run() 等待工作进程返回，
+    实际计算在工作进程中完成
+    """
+
+    def __init__(self, max_workers: int = JOB_PROCESS_WORKERS, preload: bool = JOB_WORKER_PRELOAD):
+        self.max_workers = max_workers
+        self.preload = preload
+        self._ctx = _WorkerContext()
+        self._events = self._ctx.Queue()
+        self._cancel_flags = self._ctx.Array('b', _CANCEL_SLOTS, lock=False)
+        self._free_slots = deque(range(_CANCEL_SLOTS))
+        # 槽位当前占用者的分配序号：任务结束后迟到的取消回调不会误设其他任务的标志
+        self._slot_owners: Dict[int, int] = {}
+        self._slot_seq = itertools.count(1)
+        self._slot_lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._done_events: Dict[str, threading.Event] = {}
+        self._pump_thread: Optional[threading.Thread] = None
+
+        logger.info(f"GenerationWorkerPool 初始化: workers={max_workers}, preload={preload}")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """获取进程池（懒创建，进程池损坏后自动重建）"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=self._ctx,
+                    initializer=_init_worker,
+                    initargs=(self._events, self._cancel_flags, self.preload)
+                )
+            if self._pump_thread is None:
+                self._pump_thread = threading.Thread(
+                    target=self._pump_events,
+                    daemon=True,
+                    name="WorkerPool-Events"
+                )
+                self._pump_thread.start()
+            return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        """丢弃已损坏的进程池，下次提交时重建"""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        try:
+            executor.shutdown(wait=False, cancel_futures=True)
+        except Exception:
+            pass
+
+    def warm_up(self):
+        """提前拉起全部工作进程并完成预加载，避免首个任务承担冷启动开销"""
+        executor = self._get_executor()
+        for _ in range(self.max_workers):
+            executor.submit(_noop)
+        logger.info(f"🚀 已启动 {self.max_workers} 个生成工作进程")
+
+    def run(self, target: Callable, job_id: str, requirement: str):
+        """
+        在工作进程中执行任务（阻塞直到任务结束）
+
+        Args:
+            target: 任务函数 target(job_id, requirement)，必须是模块级函数（可 pickle）
+            job_id: 任务ID
+            requirement: 用户需求
+        """
+        from .job_manager import job_manager
+
+        snapshot = job_manager.get_job_dict(job_id) or {}
+        done = threading.Event()
+        self._done_events[job_id] = done
+        slot, owner = self._acquire_slot()
+        if slot >= 0:
+            job_manager.get_cancel_token(job_id).on_cancel(lambda: self._set_flag(slot, owner))
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_in_worker, target, job_id, requirement, snapshot, slot)
+            future.result()
+            # 等待工作进程发出的状态事件全部应用到 JobManager
+            if not done.wait(_EVENT_DRAIN_TIMEOUT):
+                logger.warning(f"等待任务事件回传超时: {job_id}")
+        except BrokenProcessPool as e:
+            logger.error(f"工作进程异常退出: {job_id}, {e}")
+            self._reset_executor(executor)
+            job_manager.set_failed(job_id, "生成进程异常退出，请重试")
+        except Exception as e:
+            logger.error(f"工作进程执行任务失败: {job_id}, {e}")
+            job_manager.set_failed(job_id, f"服务器错误: {str(e)}")
+        finally:
+            self._done_events.pop(job_id, None)
+            self._release_slot(slot)
+
+    def _acquire_slot(self):
+        """
+        分配一个共享取消标志槽位
+
+        Returns:
+            (槽位, 分配序号)；槽位用尽时槽位为 -1，该任务不支持跨进程取消
+        """
+        with self._slot_lock:
+            if not self._free_slots:
+                logger.warning("取消标志槽位已用尽")
+                return -1, 0
+            slot = self._free_slots.popleft()
+            owner = next(self._slot_seq)
+            self._slot_owners[slot] = owner
+            self._cancel_flags[slot] = 0
+            return slot, owner
+
+    def _release_slot(self, slot: int):
+        if slot < 0:
+            return
+        with self._slot_lock:
+            self._slot_owners.pop(slot, None)
+            self._free_slots.append(slot)
+
+    def _set_flag(self, slot: int, owner: int):
+        """设置取消标志（槽位已释放或被其他任务占用时忽略）"""
+        with self._slot_lock:
+            if self._slot_owners.get(slot) == owner:
+                self._cancel_flags[slot] = 1
+
+    def _pump_events(self):
+        """事件泵：将工作进程回传的任务更新应用到主进程 JobManager"""
+        from .job_manager import job_manager
+        from .admission import admission_controller
+        from .circuit_breaker import circuit_breakers
+
+        while True:
+            try:
+                kind, job_id, payload = self._events.get()
+            except (EOFError, OSError):
+                logger.warning("工作进程事件队列已关闭")
+                return
+            try:
+                if kind == "update":
+                    job_manager.update_job(job_id, **payload)
+                elif kind == "log":
+                    job_manager.append_log(job_id, payload)
+                elif kind == "upstream":
+                    admission_controller.record(*payload)
+                elif kind == "breaker":
+                    circuit_breakers.record_remote(*payload)
+                elif kind == "done":
+                    done = self._done_events.get(job_id)
+                    if done:
+                        done.set()
+            except Exception as e:
+                logger.warning(f"应用任务事件失败: {job_id}, {kind}, {e}")
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_worker_pool() -> Optional[GenerationWorkerPool]:
+    """
+    获取全局进程池（单例）
+
+    Returns:
+        GenerationWorkerPool: process 模式下返回进程池；thread 模式或在工作进程内返回 None
+    """
+    global _GLOBAL_POOL
+
+    if JOB_EXECUTION_MODE != "process" or is_worker_process():
+        return None
+
+    if _GLOBAL_POOL is None:
+        with _POOL_LOCK:
+            if _GLOBAL_POOL is None:
+                _GLOBAL_POOL = GenerationWorkerPool()
+
+    return _GLOBAL_POOL
+
+
+# =========================
+# 以下函数在工作进程中执行
+# =========================
+
+# 工作进程内的共享取消标志表（由 _init_worker 设置）
+_worker_cancel_flags = None
+# 共享取消标志 wait() 的轮询间隔（秒）
+_CANCEL_FLAG_POLL_INTERVAL = 0.1
+
+
+class _SharedCancelFlag:
+    """共享内存中的取消标志（提供与 threading.Event 相同的 is_set/set/wait 接口）"""
+
+    def __init__(self, flags, slot: int):
+        self._flags = flags
+        self._slot = slot
+
+    def is_set(self) -> bool:
+        return bool(self._flags[self._slot])
+
+    def set(self):
+        self._flags[self._slot] = 1
+
+    def wait(self, timeout: float) -> bool:
+        """轮询等待至多 timeout 秒，标志被设置时立即返回 True"""
+        end = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(_CANCEL_FLAG_POLL_INTERVAL, remaining))
+        return True
+
+
+def _init_worker(event_queue, cancel_flags, preload: bool):
+    """工作进程初始化：接入事件队列与取消标志表，并预加载模型与素材"""
+    global _worker_cancel_flags
+    from .job_manager import job_manager
+    from .admission import set_upstream_forwarder
+    from .circuit_breaker import circuit_breakers
+
+    job_manager.attach(event_queue)
+    # 下游请求结果转发给主进程的准入控制器，熔断状态变化转发给主进程展示
+    set_upstream_forwarder(job_manager.forward_upstream)
+    circuit_breakers.set_state_forwarder(job_manager.forward_breaker)
+    _worker_cancel_flags = cancel_flags
+    if preload:
+        _preload_resources()
+
+
+def _preload_resources():
+    """预加载 CLIP 模型、共享匹配器与 2D 素材/3D 头像向量缓存"""
+    try:
+        from .clip_manager import preload_clip
+        preload_clip()
+
+        from .resource_manager import resources
+        resources.get_head_matcher()
+        resources.get_body_matcher()
+        resources.get_content_agent()
+        resources.get_generation_controller()
+        resources.get_image_processor()
+
+        from .clip_cache import prebuild_2d_cache, prebuild_3d_head_cache
+        prebuild_2d_cache()
+        prebuild_3d_head_cache()
+        logger.info(f"✅ 工作进程预加载完成: pid={os.getpid()}")
+    except Exception as e:
+        logger.warning(f"工作进程预加载失败（将在首次使用时加载）: {e}")
+
+
+def _noop():
+    """空任务（用于预热工作进程）"""
+    return os.getpid()
+
+
+def _run_in_worker(target: Callable, job_id: str, requirement: str, snapshot: Dict, slot: int = -1):
+    """在工作进程中执行任务函数"""
+    from .job_manager import job_manager
+
+    cancel_event = None
+    if slot >= 0 and _worker_cancel_flags is not None:
+        cancel_event = _SharedCancelFlag(_worker_cancel_flags, slot)
+    job_manager.bind_snapshot(job_id, snapshot, cancel_event)
+    try:
+        target(job_id, requirement)
+    finally:
+        job_manager.release(job_id)